@@ -1,40 +1,70 @@
+import copy
 import itertools
 import logging
 import os
 import re
 import shutil
 import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
+from io import StringIO
 from os import path
 from pathlib import Path
+from threading import Lock
 
 import pymanga
 from fuzzywuzzy import fuzz
 from requests.exceptions import ConnectionError
 from xml.etree.ElementTree import SubElement, Element, Comment, tostring
-from xml.dom.minidom import parseString
+from xml.dom.minidom import parseString, Text
 from zipfile import ZipFile
 
 from jikanpy.exceptions import APIException
 
-from googletrans import Translator
 from MangaTaggerLib.api import MTJikan, AniList, Kitsu, MangaUpdates, NH, Fakku
-from MangaTaggerLib.database import MetadataTable, ProcFilesTable, ProcSeriesTable
+from MangaTaggerLib.database import MetadataCache, MetadataTable, ProcFilesTable, ProcSeriesTable, TitleIndex
 from MangaTaggerLib.errors import FileAlreadyProcessedError, FileUpdateNotRequiredError, UnparsableFilenameError, \
-    MangaNotFoundError, MangaMatchedException
+    MangaNotFoundError
+from MangaTaggerLib.filename_parser import parse_filename
+from MangaTaggerLib.language import detect_language
+from MangaTaggerLib.locks import KeyedLock
 from MangaTaggerLib.models import Metadata, Data
 from MangaTaggerLib.task_queue import QueueWorker
-from MangaTaggerLib.thumbnail import thumb
-from MangaTaggerLib.utils import AppSettings, compare
+from MangaTaggerLib.thumbnail import cover_key, first_image, thumb
+from MangaTaggerLib.utils import AppSettings, TitleScorer
 
 # Global Variable Declaration
 LOG = logging.getLogger('MangaTaggerLib.MangaTaggerLib')
 
-CURRENTLY_PENDING_DB_SEARCH = set()
-CURRENTLY_PENDING_RENAME = set()
+CURRENTLY_PENDING_DB_SEARCH = KeyedLock('database search')
+CURRENTLY_PENDING_RENAME = KeyedLock('rename')
+
+# Seconds a chapter will wait on another chapter's rename or database search before giving up
+lock_timeout = 600
+
+# Size of the thread pool shared by all workers for searching metadata sources concurrently
+search_threads = 5
+_search_executor = None
+_search_executor_lock = Lock()
 
 preferences = ["AniList", "MangaUpdates", "MAL", "Fakku", "NHentai"]
 
+# Search sources one at a time in preference order, stopping at the first match, instead of all at once
+lazy_source_search = False
+
+# Match series against the titles and synonyms already in manga_metadata before searching any source
+local_title_matching = True
+
+# Rewrites tried, alone and in every combination, on titles no source matched
+title_formats = [(r"(\w)([A-Z])", r"\1 \2"), (r"[ ][,]", ","), (r"[.]", ""), (r"([^ ]+)[']([^ ]+)", ""),
+                 (r"([^ ]+)[.]([^ ]+)", ""), (r"[ ][-]([^ ]+)", r" \1")]
+
+# Most NHentai searches made for the rewritten titles of one series; NHentai allows 30 searches a minute
+formatted_search_limit = 10
+
 sources = {
     "MAL": MTJikan(),
     "AniList": AniList(),
@@ -48,7 +78,7 @@ def main():
     QueueWorker.run()
 
 
-def process_manga_chapter(file_path: Path, event_id, download_dir):
+def process_manga_chapter(file_path: Path, event_id, download_dir, series_batch=None, parsed=None):
     filename = file_path.name
     directory_path = file_path.parent
     directory_name = file_path.parent.name
@@ -66,10 +96,10 @@ def process_manga_chapter(file_path: Path, event_id, download_dir):
     LOG.debug(f'directory_name: {directory_name}')
 
     if directory_path == download_dir:
-        manga_details = file_renamer(filename, None, logging_info)
+        manga_details = file_renamer(filename, None, logging_info, parsed)
         directory_name = manga_details[2]
     else:
-        manga_details = file_renamer(filename, directory_name, logging_info)
+        manga_details = file_renamer(filename, directory_name, logging_info, parsed)
 
     try:
         new_filename = manga_details[0]
@@ -92,52 +122,53 @@ def process_manga_chapter(file_path: Path, event_id, download_dir):
              extra=logging_info)
 
     if AppSettings.mode_settings is None or AppSettings.mode_settings['rename_file']:
-        try:
-            # Multithreading Optimization
-            if new_file_path in CURRENTLY_PENDING_RENAME:
-                LOG.info(f'A file is currently being renamed under the filename "{new_filename}". Locking '
-                         f'{file_path} from further processing until this rename action is complete...',
-                         extra=logging_info)
-
-                while new_file_path in CURRENTLY_PENDING_RENAME:
-                    time.sleep(1)
+        # Multithreading Optimization
+        if CURRENTLY_PENDING_RENAME.locked(new_file_path):
+            LOG.info(f'A file is currently being renamed under the filename "{new_filename}". Locking '
+                     f'{file_path} from further processing until this rename action is complete...',
+                     extra=logging_info)
+        else:
+            LOG.info(f'No files currently currently being processed under the filename '
+                     f'"{new_filename}". Locking new filename for processing...', extra=logging_info)
 
-                LOG.info(f'The file being renamed to "{new_file_path}" has been completed. Unlocking '
-                         f'"{new_filename}" for file rename processing.', extra=logging_info)
-            else:
-                LOG.info(f'No files currently currently being processed under the filename '
-                         f'"{new_filename}". Locking new filename for processing...', extra=logging_info)
-                CURRENTLY_PENDING_RENAME.add(new_file_path)
+        if not CURRENTLY_PENDING_RENAME.acquire(new_file_path, lock_timeout):
+            LOG.warning(f'Timed out after {lock_timeout}s waiting for the rename of "{new_filename}" to complete; '
+                        f'"{file_path}" will not be processed.', extra=logging_info)
+            return
 
+        try:
             rename_action(file_path, new_file_path, directory_name, manga_details[1], logging_info)
         except (FileExistsError, FileUpdateNotRequiredError, FileAlreadyProcessedError) as e:
             LOG.exception(e, extra=logging_info)
-            CURRENTLY_PENDING_RENAME.remove(new_file_path)
             return
+        finally:
+            CURRENTLY_PENDING_RENAME.release(new_file_path)
 
     # More Multithreading Optimization
     if re.sub(r"[$.]", "_", directory_name) in ProcSeriesTable.processed_series:
         LOG.info(f'"{directory_name}" has been processed as a searched series and will continue processing.',
                  extra=logging_info)
     else:
-        if directory_name in CURRENTLY_PENDING_DB_SEARCH:
+        if CURRENTLY_PENDING_DB_SEARCH.locked(directory_name):
             LOG.info(f'"{directory_name}" has not been processed as a searched series but is currently pending '
                      f'a database search. Suspending further processing until database search has finished...',
                      extra=logging_info)
 
-            while directory_name in CURRENTLY_PENDING_DB_SEARCH:
-                time.sleep(1)
-
+        if not CURRENTLY_PENDING_DB_SEARCH.acquire(directory_name, lock_timeout):
+            LOG.warning(f'Timed out after {lock_timeout}s waiting for the database search of "{directory_name}"; '
+                        f'continuing without the series lock.', extra=logging_info)
+        elif re.sub(r"[$.]", "_", directory_name) in ProcSeriesTable.processed_series:
+            CURRENTLY_PENDING_DB_SEARCH.release(directory_name)
             LOG.info(f'"{directory_name}" has been processed as a searched series and will now be unlocked for '
                      f'processing.', extra=logging_info)
         else:
             LOG.info(f'"{directory_name}" has not been processed as a searched series nor is it currently pending '
                      f'a database search. Locking series from being processed until database has been searched...',
                      extra=logging_info)
-            CURRENTLY_PENDING_DB_SEARCH.add(directory_name)
 
     try:
-        metadata_tagger(directory_name, manga_details[1], manga_details[2], logging_info, new_file_path, file_path)
+        metadata_tagger(directory_name, manga_details[1], manga_details[2], logging_info, new_file_path, file_path,
+                        series_batch)
 
     except MangaNotFoundError:
         LOG.info(f'Processing on "{new_file_path}" has failed.', extra=logging_info)
@@ -153,83 +184,26 @@ def process_manga_chapter(file_path: Path, event_id, download_dir):
             os.mkdir(error_folder_path)
         shutil.move(new_file_path, Path(error_folder_path, new_file_path.parts[-1]))
 
+    finally:
+        # A no-op unless this chapter still holds the series lock, e.g. when the search itself failed
+        CURRENTLY_PENDING_DB_SEARCH.release(directory_name)
+
     LOG.info(f'Processing on "{new_file_path}" has finished.', extra=logging_info)
 
 
-def file_renamer(filename, manga_title, logging_info):
+def file_renamer(filename, manga_title, logging_info, parsed=None):
     LOG.info(f'Attempting to rename "{filename}"...', extra=logging_info)
 
-    delimiters = ["chapter", "ch.", "ch", "act"]
-    volumedelimiters = ["volume", "vol.", "vol"]
-    filename = filename.replace(".cbz", "").title()
-    if filename.find('-.-') != -1:
-        split_filename = [x.strip() for x in filename.split('-.-')]
-        LOG.debug(f'Chapter text for {filename}.cbz is assumed to be {split_filename}')
-        if split_filename:
-            filename = split_filename[1]
-        else:
-            filename = ""
-        if manga_title is None and split_filename[0]:
-            LOG.debug(f'File was in download directory, manga name assumed to be {split_filename[0]}')
-            manga_title = split_filename[0]
-    for x in delimiters:
-        if re.search("([ ]|^)" + x + "([0-9. ])", filename.lower(), flags=re.IGNORECASE):
-            LOG.debug(f'Chapter delimiter {x} was found in string {filename}')
-            vol_num = None
-            text = re.split(x, filename, maxsplit=1, flags=re.IGNORECASE)
-            for y in volumedelimiters:
-                if re.search("([ ]|^)" + y + "([0-9. ])", text[0], flags=re.IGNORECASE):
-                    LOG.debug(f'Volume delimiter {y} was found in string {text[0]}')
-                    volume = re.split(y, text[0], flags=re.IGNORECASE)[1]
-                    vol_num = re.search(r'[\d.]+', volume).group(0)
-                    LOG.debug(f'Volume #: {vol_num}')
-                    break
-            chapter_text = text[1].strip()
-            LOG.debug(f'Chapter # + title should be: {chapter_text}')
-            if re.search(r'[\d.]+', chapter_text) is None:
-                LOG.debug(f'Chapter # was not found. Checking for another chapter delimiter')
-                continue
-            ch_num = re.search(r'[\d.]+', chapter_text).group(0)
-            ch_num = ch_num.lstrip("0") or "0"
-            LOG.debug(f'Chapter #: {ch_num}')
-            chapter_title = re.split(r'[\d.]+', chapter_text, maxsplit=1)[1].strip()
-            LOG.debug(f'Chapter title: {chapter_title}')
-            if not chapter_title:
-                return [f"Chapter {ch_num}.cbz", ch_num, manga_title]
-            if vol_num:
-                return [f"Vol. {vol_num} Chapter {ch_num}.cbz", ch_num, chapter_title]
-            else:
-                return [f"Chapter {ch_num}.cbz", ch_num, chapter_title]
-
-    if re.search("oneshot", filename, flags=re.IGNORECASE):
-        LOG.debug(f'manga_type: Oneshot')
-        return [f'{manga_title}.cbz', '0', manga_title]
-
-    for x in volumedelimiters:
-        if re.search("([ ]|^)" + x + "([0-9. ])", filename, flags=re.IGNORECASE):
-            LOG.debug(f'Volume delimiter {x} was found in string {filename}')
-            volume = re.split(x, filename, flags=re.IGNORECASE)[1]
-            vol_num = re.search(r'[\d.]+', volume).group(0)
-            LOG.debug(f'Volume #: {vol_num}')
-            volume_title = re.split(r'[\d.]+', filename, maxsplit=1)[1].strip()
-            LOG.debug(f'Volume title: {volume_title}')
-            if not volume_title:
-                return [f"Volume {vol_num}.cbz", vol_num, manga_title]
-            else:
-                return [f"Volume {vol_num}.cbz", vol_num, volume_title]
-
-    if filename.strip().isdigit():
-        LOG.debug(f'File name is a number')
-        return [f'{filename}.cbz', f'{filename}', manga_title]
-
-    if manga_title is None:
-        manga_title = filename
-
-    logging_info['new_filename'] = filename
+    # Chapters found by the startup scan were already parsed along with the rest of their directory
+    if parsed is None:
+        parsed = parse_filename(filename, manga_title)
+    LOG.debug(f'Parsed "{filename}" as {parsed}')
 
-    LOG.info(f'File will be renamed to "{filename}".', extra=logging_info)
+    if parsed.kind == 'unknown':
+        logging_info['new_filename'] = parsed.name
+        LOG.info(f'File will be renamed to "{parsed.name}".', extra=logging_info)
 
-    return ["000.cbz", "0", manga_title]
+    return parsed.as_list()
 
 
 def rename_action(current_file_path: Path, new_file_path: Path, manga_title, chapter_number, logging_info):
@@ -282,7 +256,7 @@ def rename_action(current_file_path: Path, new_file_path: Path, manga_title, cha
                 raise FileAlreadyProcessedError(current_file_path.name)
 
     LOG.info(f'"{new_file_path.name}" will be unlocked for any pending processes.', extra=logging_info)
-    CURRENTLY_PENDING_RENAME.remove(new_file_path)
+    CURRENTLY_PENDING_RENAME.release(new_file_path)
 
 
 def compare_versions(old_filename: str, new_filename: str):
@@ -321,113 +295,79 @@ def compare_versions(old_filename: str, new_filename: str):
         return False
 
 
-def metadata_tagger(manga_title, manga_chapter_number, manga_chapter_title, logging_info, manga_file_path=None, old_file_path=None):
-    manga_search = None
-    db_exists = False
+def metadata_tagger(manga_title, manga_chapter_number, manga_chapter_title, logging_info, manga_file_path=None,
+                    old_file_path=None, series_batch=None):
+    if series_batch is None:
+        series_metadata = resolve_metadata(manga_title, logging_info, old_file_path)
+    else:
+        # Only the first chapter of a batch resolves the series; the rest wait here and reuse its result
+        with series_batch.lock:
+            if series_batch.not_found is not None:
+                LOG.info(f'"{manga_title}" was already searched for by another chapter in this batch and no match '
+                         f'was found.', extra=logging_info)
+                raise series_batch.not_found
+
+            if series_batch.metadata is None:
+                try:
+                    series_batch.metadata = resolve_metadata(manga_title, logging_info, old_file_path)
+                except MangaNotFoundError as mnfe:
+                    series_batch.not_found = mnfe
+                    raise
+            else:
+                LOG.info(f'Reusing metadata resolved for "{manga_title}" by another chapter in this batch.',
+                         extra=logging_info)
+            series_metadata = series_batch.metadata
 
+    # Each chapter gets its own copy since the title is set per chapter and chapters run concurrently
+    manga_metadata = copy.copy(series_metadata)
+    logging_info['metadata'] = manga_metadata.__dict__
+
+    if AppSettings.mode_settings is None or ('write_comicinfo' in AppSettings.mode_settings.keys()
+                                             and AppSettings.mode_settings['write_comicinfo']):
+        manga_metadata.title = manga_chapter_title
+        comicinfo_xml = construct_comicinfo_xml(manga_metadata, manga_chapter_number, logging_info)
+        reconstruct_manga_chapter(comicinfo_xml[0], manga_file_path, comicinfo_xml[1], logging_info,
+                                  tryIter(manga_metadata.url))
+
+    return manga_metadata
+
+
+def resolve_metadata(manga_title, logging_info, old_file_path=None):
     LOG.info(f'Table search value is "{manga_title}"', extra=logging_info)
 
-    for x in range(4):
-        manga_search = dbSearch(manga_title, x)
+    manga_metadata = MetadataCache.get(manga_title)
+    if manga_metadata is not None:
+        LOG.info(f'Found cached metadata for "{manga_title}".', extra=logging_info)
+    else:
+        manga_search = MetadataTable.search(manga_title)
+        if manga_search is None and local_title_matching:
+            manga_search = _match_known_title(manga_title, logging_info)
         if manga_search is not None:
-            db_exists = True
-            break
+            manga_metadata = Metadata(manga_title, logging_info, db_details=manga_search)
+            MetadataCache.put(manga_title, manga_metadata)
+
     # Metadata already exists
-    if db_exists:
+    if manga_metadata is not None:
         if re.sub(r"[$.]", "_", manga_title) in ProcSeriesTable.processed_series:
             LOG.info(f'Found an entry in manga_metadata for "{manga_title}".', extra=logging_info)
         else:
             LOG.info(f'Found an entry in manga_metadata for "{manga_title}"; unlocking series for processing.',
                      extra=logging_info)
-            ProcSeriesTable.processed_series.add(re.sub(r"[$.]", "_", manga_title))
-            CURRENTLY_PENDING_DB_SEARCH.remove(manga_title)
+            ProcSeriesTable.add(re.sub(r"[$.]", "_", manga_title), logging_info)
+            CURRENTLY_PENDING_DB_SEARCH.release(manga_title)
 
-        manga_metadata = Metadata(manga_title, logging_info, db_details=manga_search)
         logging_info['metadata'] = manga_metadata.__dict__
     # Get metadata
     else:
-        # sources["Kitsu"] = Kitsu
-        results = {}
-        metadata = None
         try:
-            results["MAL"] = sources["MAL"].search('manga', manga_title)
-        except:
-            results["MAL"] = []
-            pass
-        results["AniList"] = sources["AniList"].search(manga_title, logging_info)
-        results["MangaUpdates"] = sources["MangaUpdates"].search(manga_title)
-        results["NHentai"] = sources["NHentai"].search(manga_title)
-        results["Fakku"] = sources["Fakku"].search(manga_title)
-        try:
-            for source in preferences:
-                for result in results[source]:
-                    if source == "AniList":
-                        # Construct Anilist XML
-                        titles = [x[1] for x in result["title"].items() if x[1] is not None]
-                        [titles.append(x) for x in result["synonyms"]]
-                        for title in titles:
-                            if compare(manga_title, title) >= 0.9:
-                                manga = sources["AniList"].manga(result["id"], logging_info)
-                                manga["source"] = "AniList"
-                                metadata = Data(manga, manga_title)
-                                raise MangaMatchedException("Found a match")
-                    elif source == "MangaUpdates":
-                        # Construct MangaUpdates XML
-                        if compare(manga_title, result['title']) >= 0.9:
-                            manga = sources["MangaUpdates"].series(result["id"])
-                            manga["source"] = "MangaUpdates"
-                            metadata = Data(manga, manga_title, result["id"])
-                            raise MangaMatchedException("Found a match")
-                    elif source == "MAL":
-                        if compare(manga_title, result['title']) >= 0.9:
-                            try:
-                                manga = sources["MAL"].manga(result["mal_id"])
-                            except (APIException, ConnectionError) as e:
-                                LOG.warning(e, extra=logging_info)
-                                LOG.warning(
-                                    'Manga Tagger has unintentionally breached the API limits on Jikan. Waiting 60s to clear '
-                                    'all rate limiting limits...')
-                                time.sleep(60)
-                                manga = sources["MAL"].manga(result["mal_id"])
-                            manga["source"] = "MAL"
-                            metadata = Data(manga, manga_title, result["mal_id"])
-                            raise MangaMatchedException("Found a match")
-                    elif source == "Fakku":
-                        if result["success"]:
-                            manga = sources["Fakku"].manga(result["url"])
-                            manga["source"] = "Fakku"
-                            metadata = Data(manga, manga_title)
-                            raise MangaMatchedException("Found a match")
-                    elif source == "NHentai":
-                        filenametoolong = False
-                        if len(old_file_path.absolute().__str__()) == 259:
-                            if fuzz.partial_ratio(manga_title, result["title"]) == 100:
-                                filenametoolong = True
-                        if compare(manga_title, result["title"]) >= 0.8 or filenametoolong:
-                            manga = sources["NHentai"].manga(result["id"], result["title"])
-                            manga["source"] = "NHentai"
-                            metadata = Data(manga, manga_title, result["id"])
-                            raise MangaMatchedException("Found a match")
-            formats = [(r"(\w)([A-Z])", r"\1 \2"), (r"[ ][,]", ","), (r"[.]", ""), (r"([^ ]+)[']([^ ]+)", ""), (r"([^ ]+)[.]([^ ]+)", ""), (r"[ ][-]([^ ]+)", r" \1")]
-            for x in range(len(formats)):
-                combinations = itertools.combinations(formats, x+1)
-                for y in combinations:
-                    for z in y:
-                        formatted = manga_title
-                        formatted = re.sub(z[0],z[1], formatted)
-                        formattedresults = sources["NHentai"].search(formatted)
-                        for formattedresult in formattedresults:
-                            if compare(manga_title, formattedresult["title"]) >= 0.8:
-                                manga = sources["NHentai"].manga(formattedresult["id"], formattedresult["title"])
-                                manga["source"] = "NHentai"
-                                metadata = Data(manga, manga_title, formattedresult["id"])
-                                raise MangaMatchedException("Found a match")
-            raise MangaNotFoundError(manga_title)
+            metadata = _search_sources(manga_title, logging_info, old_file_path)
+            if metadata is None:
+                metadata = _search_formatted_titles(manga_title, logging_info)
+            if metadata is None:
+                raise MangaNotFoundError(manga_title)
         except MangaNotFoundError as mnfe:
             LOG.exception(mnfe, extra=logging_info)
             raise
-        except MangaMatchedException:
-            pass
 
         manga_metadata = Metadata(manga_title, logging_info, details=metadata.toDict())
         logging_info['metadata'] = manga_metadata.__dict__
@@ -435,38 +375,319 @@ def metadata_tagger(manga_title, manga_chapter_number, manga_chapter_title, logg
         if AppSettings.mode_settings is None or ('database_insert' in AppSettings.mode_settings.keys()
                                                  and AppSettings.mode_settings['database_insert']):
             MetadataTable.insert(manga_metadata, logging_info)
+        MetadataCache.put(manga_title, manga_metadata)
 
         LOG.info(f'Retrieved metadata for "{manga_title}" from the Anilist and MyAnimeList APIs; '
                  f'now unlocking series for processing!', extra=logging_info)
-        ProcSeriesTable.processed_series.add(re.sub(r"[$.]", "_", manga_title))
-        CURRENTLY_PENDING_DB_SEARCH.remove(manga_title)
-
-    if AppSettings.mode_settings is None or ('write_comicinfo' in AppSettings.mode_settings.keys()
-                                             and AppSettings.mode_settings['write_comicinfo']):
-        manga_metadata.title = manga_chapter_title
-        comicinfo_xml = construct_comicinfo_xml(manga_metadata, manga_chapter_number, logging_info)
-        reconstruct_manga_chapter(comicinfo_xml[0], manga_file_path, comicinfo_xml[1], logging_info)
+        ProcSeriesTable.add(re.sub(r"[$.]", "_", manga_title), logging_info)
+        CURRENTLY_PENDING_DB_SEARCH.release(manga_title)
 
     return manga_metadata
 
+
+def _match_known_title(manga_title, logging_info):
+    """
+    Looks for a series already in manga_metadata with a title or synonym close to manga_title, scored on their
+    normalized forms against the same 0.9 threshold the sources use.
+    """
+    scorer = TitleScorer(TitleIndex.normalize(manga_title))
+    match, best = scorer.first_match(TitleIndex.candidates(manga_title), 0.9)
+    if match is None:
+        if best is not None:
+            LOG.debug(f'Closest known title to "{manga_title}" was "{best[1]}" ({best[2]:.2f})', extra=logging_info)
+        return None
+
+    LOG.info(f'"{manga_title}" matched the known title "{match[1]}" ({match[2]:.2f}).', extra=logging_info)
+    return MetadataTable.find_by_id(match[0])
+
+
+def _get_search_executor():
+    global _search_executor
+
+    with _search_executor_lock:
+        if _search_executor is None:
+            _search_executor = ThreadPoolExecutor(max_workers=search_threads, thread_name_prefix='MTS')
+        return _search_executor
+
+
+def _search_sources(manga_title, logging_info, old_file_path=None):
+    """
+    Checks the preferred sources in preference order and returns the first match. The first source with a matching
+    result wins, exactly as if the sources had been searched one after another.
+
+    By default every source is searched concurrently up front and any searches that have not started by the time a
+    match is found are cancelled. With lazy_source_search enabled, a source is only searched once the loop reaches it,
+    which spends no rate limit on sources that are never needed.
+    """
+    futures = {}
+    if lazy_source_search:
+        searches = {source: partial(_search_source, source, manga_title, logging_info) for source in preferences}
+    else:
+        futures = {source: _get_search_executor().submit(_search_source, source, manga_title, logging_info)
+                   for source in preferences}
+        searches = {source: future.result for source, future in futures.items()}
+
+    try:
+        for source in preferences:
+            metadata = _match_source(source, searches[source](), manga_title, logging_info, old_file_path)
+            if metadata is not None:
+                LOG.debug(f'"{manga_title}" was matched using {source}', extra=logging_info)
+                return metadata
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+    return None
+
+
+def _search_source(source, manga_title, logging_info):
+    if source == "MAL":
+        try:
+            return sources["MAL"].search('manga', manga_title)
+        except:
+            return []
+    elif source == "AniList":
+        return sources["AniList"].search(manga_title, logging_info)
+    else:
+        return sources[source].search(manga_title)
+
+
+def _match_source(source, results, manga_title, logging_info, old_file_path=None):
+    if source == "Fakku":
+        for result in results:
+            if result["success"]:
+                manga = sources["Fakku"].manga(result["url"])
+                manga["source"] = "Fakku"
+                return Data(manga, manga_title)
+        return None
+
+    # A filename cut short by the path length limit may only partially match its title
+    truncated = source == "NHentai" and results and len(old_file_path.absolute().__str__()) == 259
+    accept = (lambda result, title: fuzz.partial_ratio(manga_title, title) == 100) if truncated else None
+
+    cutoff = 0.8 if source == "NHentai" else 0.9
+    match, best = TitleScorer(manga_title).first_match(_candidate_titles(source, results), cutoff, accept)
+    if match is None:
+        if best is not None:
+            LOG.debug(f'Best {source} candidate for "{manga_title}" was "{best[1]}" ({best[2]:.2f})',
+                      extra=logging_info)
+        return None
+
+    result = match[0]
+    if source == "AniList":
+        # Construct Anilist XML
+        manga = sources["AniList"].manga(result["id"], logging_info)
+        manga["source"] = "AniList"
+        return Data(manga, manga_title)
+    elif source == "MangaUpdates":
+        # Construct MangaUpdates XML
+        manga = sources["MangaUpdates"].series(result["id"])
+        manga["source"] = "MangaUpdates"
+        return Data(manga, manga_title, result["id"])
+    elif source == "MAL":
+        try:
+            manga = sources["MAL"].manga(result["mal_id"])
+        except (APIException, ConnectionError) as e:
+            LOG.warning(e, extra=logging_info)
+            LOG.warning(
+                'Manga Tagger has unintentionally breached the API limits on Jikan. Waiting 60s to clear '
+                'all rate limiting limits...')
+            time.sleep(60)
+            manga = sources["MAL"].manga(result["mal_id"])
+        manga["source"] = "MAL"
+        return Data(manga, manga_title, result["mal_id"])
+    elif source == "NHentai":
+        manga = sources["NHentai"].manga(result["id"], result["title"])
+        manga["source"] = "NHentai"
+        return Data(manga, manga_title, result["id"])
+
+    return None
+
+
+def _candidate_titles(source, results):
+    """
+    Yields (result, title) for every title a source's results could match on, in the order they are checked.
+    """
+    for result in results:
+        if source == "AniList":
+            for title in result["title"].values():
+                if title is not None:
+                    yield result, title
+            for title in result["synonyms"]:
+                yield result, title
+        else:
+            yield result, result["title"]
+
+
+def _search_formatted_titles(manga_title, logging_info):
+    # Searching the title rewritten by each format of each combination used to take this many NHentai searches
+    unbounded_searches = sum(len(combination) for size in range(1, len(title_formats) + 1)
+                             for combination in itertools.combinations(title_formats, size))
+
+    # The unchanged title has already been searched along with the other sources
+    skip = {manga_title} if "NHentai" in preferences else set()
+    scorer = TitleScorer(manga_title)
+    searches = 0
+    match = None
+    for formatted in _formatted_titles(manga_title, skip):
+        if searches == formatted_search_limit:
+            LOG.info(f'Stopped searching NHentai for rewritten titles of "{manga_title}" after '
+                     f'{formatted_search_limit} searches.', extra=logging_info)
+            break
+        searches += 1
+        match, _ = scorer.first_match(_candidate_titles("NHentai", sources["NHentai"].search(formatted)), 0.8)
+        if match is not None:
+            break
+
+    LOG.info(f'Searched NHentai for {searches} rewritten titles of "{manga_title}", '
+             f'{unbounded_searches - searches} fewer than every rewrite of every combination.', extra=logging_info)
+
+    if match is None:
+        return None
+    formattedresult = match[0]
+    manga = sources["NHentai"].manga(formattedresult["id"], formattedresult["title"])
+    manga["source"] = "NHentai"
+    return Data(manga, manga_title, formattedresult["id"])
+
+
+def _formatted_titles(manga_title, skip=()):
+    """
+    Yields each distinct title made by rewriting manga_title with a combination of title_formats, smallest
+    combinations first, applying every format in a combination in turn. Titles in skip, and blank titles, are left out.
+    """
+    seen = set(skip)
+    for size in range(1, len(title_formats) + 1):
+        for combination in itertools.combinations(title_formats, size):
+            formatted = manga_title
+            for pattern, replacement in combination:
+                formatted = re.sub(pattern, replacement, formatted)
+            if formatted.strip() and formatted not in seen:
+                seen.add(formatted)
+                yield formatted
+
+
+class ComicInfoTemplate:
+    """
+    ComicInfo.xml for one series, rendered once with placeholders where the chapter's Title and Number go. Filling in
+    a chapter gives exactly what building and pretty-printing the whole document would.
+    """
+    max_size = 64
+
+    _templates = OrderedDict()
+    _lock = Lock()
+
+    # Characters that are not allowed in XML at all; chapters containing them are rendered the slow way, which fails
+    # just as it always has
+    _invalid = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+    def __init__(self, metadata):
+        title_mark = f'title-{uuid.uuid4().hex}'
+        number_mark = f'number-{uuid.uuid4().hex}'
+        rendered = _render_comicinfo(_build_comicinfo(metadata, title_mark, number_mark))
+
+        self._parts = None
+        if rendered.count(title_mark) == 1 and rendered.count(number_mark) == 1:
+            head, _, rest = rendered.partition(f'<Title>{title_mark}</Title>')
+            middle, _, tail = rest.partition(f'<Number>{number_mark}</Number>')
+            if number_mark not in head and number_mark not in middle + tail:
+                self._parts = (head, middle, tail)
+
+    @classmethod
+    def for_metadata(cls, metadata):
+        try:
+            key = _freeze([getattr(metadata, field) for field in (
+                'series_title', 'series_title_eng', 'series_title_jap', 'synonyms', 'description', 'page_count',
+                'publish_date', 'source', 'staff', 'serializations', 'genres', 'url', 'scrape_date')])
+            hash(key)
+        except TypeError:
+            return cls(metadata)
+
+        with cls._lock:
+            template = cls._templates.get(key)
+            if template is not None:
+                cls._templates.move_to_end(key)
+                return template
+
+        template = cls(metadata)
+        with cls._lock:
+            cls._templates[key] = template
+            while len(cls._templates) > cls.max_size:
+                cls._templates.popitem(last=False)
+        return template
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._templates.clear()
+
+    def render(self, title, number):
+        """
+        Returns the ComicInfo.xml for one chapter, or None if the template cannot reproduce it.
+        """
+        if self._parts is None:
+            return None
+        title_xml = self._element('Title', title)
+        number_xml = self._element('Number', number)
+        if title_xml is None or number_xml is None:
+            return None
+        head, middle, tail = self._parts
+        return f'{head}{title_xml}{middle}{number_xml}{tail}'
+
+    @classmethod
+    def _element(cls, tag, text):
+        if text is None or text == '':
+            return f'<{tag}/>'
+        if not isinstance(text, str) or cls._invalid.search(text):
+            return None
+
+        # Parsing the serialized tree turned every line break into a newline, and minidom escapes the text as it writes
+        node = Text()
+        node.data = text.replace('\r\n', '\n').replace('\r', '\n')
+        writer = StringIO()
+        node.writexml(writer, '', '', '')
+        return f'<{tag}>{writer.getvalue()}</{tag}>'
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
 def construct_comicinfo_xml(metadata, chapter_number, logging_info):
     LOG.info(f'Constructing comicinfo object for "{metadata.series_title}", chapter {chapter_number}...',
              extra=logging_info)
 
+    # Only the title and number differ between chapters of a series, so the rest is rendered once per series
+    comicinfo_xml = ComicInfoTemplate.for_metadata(metadata).render(metadata.title, f'{chapter_number}')
+    if comicinfo_xml is None:
+        comicinfo_xml = _render_comicinfo(_build_comicinfo(metadata, metadata.title, chapter_number))
+
+    hentai = False
+    if metadata.source == "Fakku" or metadata.source == "NHentai":
+        hentai = True
+
+    LOG.info(f'Finished creating ComicInfo object for "{metadata.series_title}", chapter {chapter_number}.',
+             extra=logging_info)
+    return [comicinfo_xml, hentai]
+
+
+def _build_comicinfo(metadata, title, chapter_number):
     comicinfo = Element('ComicInfo')
 
     application_tag = Comment('Generated by Manga Tagger, an Endless Galaxy Studios project')
     comicinfo.append(application_tag)
 
-    title = SubElement(comicinfo, 'Title')
-    title.text = metadata.title
+    title_element = SubElement(comicinfo, 'Title')
+    title_element.text = title
 
     series = SubElement(comicinfo, 'Series')
     series.text = metadata.series_title
 
     alt_series = SubElement(comicinfo, 'AlternateSeries')
-    if metadata.series_title and metadata.series_title.strip():
-        series_title_lang = Translator().detect(metadata.series_title).lang
+    series_title_lang = detect_language(metadata.series_title)
     if metadata.series_title_eng and series_title_lang == "ja":
         alt_series.text = metadata.series_title_eng
     elif metadata.series_title_jap and series_title_lang == "en":
@@ -562,20 +783,27 @@ def construct_comicinfo_xml(metadata, chapter_number, logging_info):
     comicinfo.set('xmlns:xsd', 'http://www.w3.org/2001/XMLSchema')
     comicinfo.set('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
 
-    hentai = False
-    if metadata.source == "Fakku" or metadata.source == "NHentai":
-        hentai = True
+    return comicinfo
 
-    LOG.info(f'Finished creating ComicInfo object for "{metadata.series_title}", chapter {chapter_number}.',
-             extra=logging_info)
-    return [parseString(tostring(comicinfo,short_empty_elements=False)).toprettyxml(indent="   "), hentai]
+
+def _render_comicinfo(comicinfo):
+    return parseString(tostring(comicinfo,short_empty_elements=False)).toprettyxml(indent="   ")
 
 
-def reconstruct_manga_chapter(comicinfo_xml, manga_file_path, isHentai,logging_info):
+def reconstruct_manga_chapter(comicinfo_xml, manga_file_path, isHentai, logging_info, web_url):
+    """
+    Finishes a chapter in one pass over its archive: ComicInfo.xml is written and, if the series has no cover yet, the
+    first image is read while the archive is open so the cover can be made without reopening it.
+    """
     folderdir = os.path.dirname(manga_file_path)
     #folderdir = "\\".join(str(manga_file_path.absolute()).split("\\")[:-1])
+    thumbnail_dir = folderdir.replace("Manga", "Hentai") if isHentai else folderdir
+    cover_image = None
     try:
         with ZipFile(manga_file_path, 'a') as zipfile:
+            # Series with a page to download the cover from never need the first page
+            if cover_key(web_url) is None and not os.path.isfile(Path(thumbnail_dir, "default.jpg")):
+                cover_image = first_image(zipfile)
             zipfile.writestr('ComicInfo.xml', comicinfo_xml)
     except Exception as e:
         LOG.exception(e, extra=logging_info)
@@ -583,18 +811,17 @@ def reconstruct_manga_chapter(comicinfo_xml, manga_file_path, isHentai,logging_i
                     extra=logging_info)
         return
     if isHentai:
-        dirh = Path(folderdir.replace("Manga", "Hentai"))
+        dirh = Path(thumbnail_dir)
         if not os.path.isdir(dirh):
             os.mkdir(dirh)
         shutil.move(manga_file_path, Path(str(manga_file_path.absolute()).replace("Manga", "Hentai")))
         shutil.rmtree(Path(folderdir))
         folderdir = dirh
     try:
-        thumb(folderdir, logging_info)
-    except:
-        if "ComicInfo.xml" in os.listdir(folderdir):
-            os.remove(Path(folderdir, "ComicInfo.xml"))
-        pass
+        thumb(folderdir, logging_info, web_url, cover_image)
+    except Exception as e:
+        LOG.exception(e, extra=logging_info)
+        LOG.warning(f'No cover could be made for "{folderdir}".', extra=logging_info)
 
     LOG.info(f'ComicInfo.xml has been created and appended to "{manga_file_path}".', extra=logging_info)
 
@@ -608,12 +835,3 @@ def tryIter(x):
         return next(iter(x))
     except StopIteration:
         return "None"
-
-
-def dbSearch(string, mode):
-    if mode == 0:
-        return MetadataTable.search_by_search_value(string)
-    elif mode == 1:
-        return MetadataTable.search_by_series_title(string)
-    elif mode == 2:
-        return MetadataTable.search_by_series_title_eng(string)
\ No newline at end of file
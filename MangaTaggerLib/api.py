@@ -1,7 +1,7 @@
 import logging
 import requests
 import time
-from datetime import datetime
+from threading import Lock
 from typing import Optional, Dict, Mapping, Union, Any
 import re
 
@@ -9,58 +9,201 @@ from bs4 import BeautifulSoup
 from jikanpy import Jikan
 from NHentai import NHentai, SearchPage, Doujin, DoujinThumbnail
 import pymanga
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from MangaTaggerLib.cache import cached
 
-class API:
-    max_cpm = None
-    max_cps = None
-    last_api_call = None
+
+class _DefaultTimeoutSession(requests.Session):
+    """
+    Session that applies HttpSession's timeouts to requests made without one, such as those from jikanpy.
+    """
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (HttpSession.connect_timeout, HttpSession.read_timeout))
+        return super().request(method, url, **kwargs)
+
+
+class HttpSession:
+    """
+    Process-wide keep-alive HTTP session shared by the API clients and thumbnail downloads.
+
+    requests.Session keeps a connection pool per host, so reusing one session avoids a new TCP/TLS handshake for every
+    call. The pool is sized to the number of worker threads so concurrent workers do not discard connections, and
+    idempotent failures (connection errors, 429 and 5xx responses) are retried with exponential backoff.
+    """
+    _log = None
+    _session: requests.Session = None
+    _adapter: HTTPAdapter = None
+    _lock = Lock()
+
+    pool_size = 8
+    connect_timeout = 5
+    read_timeout = 30
+    retries = 3
+    backoff_factor = 0.5
+    retry_statuses = (429, 500, 502, 503, 504)
 
     @classmethod
-    def __init__(cls, calls_per_second=2, calls_per_minute=30):
-        cls.calls_second = 0
-        cls.calls_minute = 0
-        cls.max_cps = calls_per_second
-        cls.max_cpm = calls_per_minute
-        cls.last_api_call = datetime.now()
+    def initialize(cls, pool_size=None):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+        if pool_size is not None:
+            cls.pool_size = max(pool_size, 1)
+
+        # Mount a fresh adapter on the existing session so clients that already hold a reference to it pick up the new
+        # pool size and retry policy
+        cls._mount(cls.session())
+        cls._log.debug(f'{cls.__name__} class has been initialized with a pool size of {cls.pool_size}')
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        with cls._lock:
+            if cls._session is None:
+                cls._session = _DefaultTimeoutSession()
+                cls._mount(cls._session)
+            return cls._session
+
+    @classmethod
+    def _mount(cls, session):
+        retry_options = dict(total=cls.retries, backoff_factor=cls.backoff_factor,
+                             status_forcelist=cls.retry_statuses, raise_on_status=False)
+        methods = frozenset(['GET', 'POST'])
+        try:
+            retry = Retry(allowed_methods=methods, **retry_options)
+        except TypeError:
+            # urllib3 < 1.26
+            retry = Retry(method_whitelist=methods, **retry_options)
+
+        cls._adapter = HTTPAdapter(pool_connections=10, pool_maxsize=cls.pool_size, max_retries=retry)
+        session.mount('https://', cls._adapter)
+        session.mount('http://', cls._adapter)
+
+    @classmethod
+    def request(cls, method, url, **kwargs) -> requests.Response:
+        return cls.session().request(method, url, **kwargs)
+
+    @classmethod
+    def get(cls, url, **kwargs) -> requests.Response:
+        return cls.request('GET', url, **kwargs)
+
+    @classmethod
+    def post(cls, url, **kwargs) -> requests.Response:
+        return cls.request('POST', url, **kwargs)
+
+    @classmethod
+    def pool_utilization(cls) -> Dict[str, Dict[str, int]]:
+        """
+        Returns, per host, how many pooled connections are currently checked out, how many have been opened in total and
+        the maximum the pool keeps alive.
+        """
+        if cls._adapter is None:
+            return {}
+
+        utilization = {}
+        pools = cls._adapter.poolmanager.pools
+        with pools.lock:
+            connection_pools = list(pools._container.values())
+
+        for pool in connection_pools:
+            if pool.pool is None:
+                continue
+            utilization[f'{pool.scheme}://{pool.host}'] = {
+                'in_use': max(pool.pool.maxsize - pool.pool.qsize(), 0),
+                'opened': pool.num_connections,
+                'max': pool.pool.maxsize
+            }
+
+        return utilization
 
-    # Rate Limit: 2 requests/second
     @classmethod
-    def _check_rate_seconds(cls):
-        last_api_call_delta = (datetime.now() - cls.last_api_call).total_seconds()
+    def log_pool_utilization(cls):
+        for host, stats in cls.pool_utilization().items():
+            cls._log.info(f'Connection pool for {host}: {stats["in_use"]}/{stats["max"]} in use, '
+                          f'{stats["opened"]} connections opened')
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket limiter that enforces one or more (calls, seconds) limits at once, e.g. 2 calls per second
+    and 30 calls per minute.
+
+    Each call to acquire() reserves the next available slot in every bucket while holding the lock, then sleeps outside
+    of it for exactly the time until that slot, so concurrent callers are spaced out instead of all waking at once and
+    overshooting the limit.
+    """
+    def __init__(self, name, limits, clock=time.monotonic, sleep=time.sleep):
+        self._log = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.name = name
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = Lock()
+
+        now = clock()
+        # [capacity, tokens per second, tokens, last refill time]; buckets start full so a burst up to the limit is free
+        self._buckets = [[calls, calls / seconds, float(calls), now] for calls, seconds in limits]
+
+    def _refill(self, now):
+        for bucket in self._buckets:
+            capacity, rate, tokens, updated = bucket
+            bucket[2] = min(capacity, tokens + (now - updated) * rate)
+            bucket[3] = now
+
+    def _wait_time(self):
+        return max(max(0.0, (1 - tokens) / rate) for _, rate, tokens, _ in self._buckets)
+
+    def wait_time(self):
+        """
+        Returns how many seconds a call made now would have to wait for a token, without reserving one.
+        """
+        with self._lock:
+            self._refill(self._clock())
+            return self._wait_time()
+
+    def acquire(self):
+        """
+        Blocks until a call is allowed by every limit and returns the number of seconds waited.
+        """
+        with self._lock:
+            self._refill(self._clock())
+            wait = self._wait_time()
+            for bucket in self._buckets:
+                bucket[2] -= 1
 
-        if cls.calls_second > cls.max_cps and last_api_call_delta < 1:
-            time.sleep(1)
-        elif last_api_call_delta > 1:
-            cls.calls_second = 0
+        if wait > 0:
+            self._log.debug(f'Rate limit reached for {self.name}; waiting {wait:.2f}s')
+            self._sleep(wait)
+
+        return wait
+
+
+class API:
+    limiter: RateLimiter = None
 
-    # Rate Limit: 30 requests/minute
     @classmethod
-    def _check_rate_minutes(cls):
-        last_api_call_delta = (datetime.now() - cls.last_api_call).total_seconds()
+    def __init__(cls, calls_per_second=2, calls_per_minute=30):
+        cls.limiter = RateLimiter(cls.__name__, [(calls_per_second, 1), (calls_per_minute, 60)])
 
-        if cls.calls_minute > cls.max_cpm and last_api_call_delta < 60:
-            time.sleep(61 - last_api_call_delta)
-        elif last_api_call_delta > 60:
-            cls.calls_minute = 0
+    # Default Rate Limit: 2 requests/second and 30 requests/minute
+    @classmethod
+    def _wait_for_rate_limit(cls):
+        cls.limiter.acquire()
 
 
 class MTJikan(API):
-    calls_minute = None
-    calls_second = None
-    last_api_call = None
+    limiter: RateLimiter = None
 
     def __init__(
             self,
             selected_base: Optional[str] = None,
             session: Optional[requests.Session] = None,
     ) -> None:
-        self.jikan = Jikan()
+        self.jikan = Jikan(selected_base=selected_base, session=session or HttpSession.session())
 
     @classmethod
     def initialize(cls):
         super().__init__(2, 30)
 
+    @cached('MAL')
     def search(
             self,
             search_type: str,
@@ -68,36 +211,32 @@ class MTJikan(API):
             page: Optional[int] = None,
             parameters: Optional[Mapping[str, Optional[Union[int, str, float]]]] = None,
     ) -> Dict[str, Any]:
-        super()._check_rate_seconds()
-        super()._check_rate_minutes()
-
-        MTJikan.calls_second += 1
-        MTJikan.calls_minute += 1
-        MTJikan.last_api_call = datetime.now()
+        super()._wait_for_rate_limit()
         search_results = self.jikan.search(search_type, query, page, parameters)
         return search_results["results"]
 
+    @cached('MAL')
     def manga(
             self, id: int, extension: Optional[str] = None, page: Optional[int] = None
     ) -> Dict[str, Any]:
-        super()._check_rate_seconds()
-        super()._check_rate_minutes()
-
-        MTJikan.calls_second += 1
-        MTJikan.calls_minute += 1
-        MTJikan.last_api_call = datetime.now()
+        super()._wait_for_rate_limit()
         search_results = self.jikan.manga(id, extension, page)
         search_results["source"] = "MAL"
         search_results["id"] = str(id)
         search_results["url"] = r"https://myanimelist.net/manga/" + str(id)
         return search_results
 
+    def person(
+            self, id: int, extension: Optional[str] = None, page: Optional[int] = None
+    ) -> Dict[str, Any]:
+        super()._wait_for_rate_limit()
+
+        return self.jikan.person(id, extension, page)
+
 
 class AniList(API):
     _log = None
-    calls_minute = None
-    calls_second = None
-    last_api_call = None
+    limiter: RateLimiter = None
 
     @classmethod
     def initialize(cls):
@@ -106,14 +245,9 @@ class AniList(API):
 
     @classmethod
     def _post(cls, query, variables, logging_info):
-        super()._check_rate_seconds()
-        super()._check_rate_minutes()
-
-        cls.calls_second += 1
-        cls.calls_minute += 1
-        cls.last_api_call = datetime.now()
+        super()._wait_for_rate_limit()
         try:
-            response = requests.post('https://graphql.anilist.co', json={'query': query, 'variables': variables})
+            response = HttpSession.post('https://graphql.anilist.co', json={'query': query, 'variables': variables})
         except Exception as e:
             cls._log.exception(e, extra=logging_info)
             cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
@@ -176,7 +310,9 @@ class AniList(API):
 
         return cls._post(query, variables, logging_info)
 
+    # Cached here rather than in _post, whose responses are never empty even when nothing was found
     @classmethod
+    @cached('AniList', ignore=('logging_info',))
     def search(cls, query, logging_info):
         form = '''
         query ($id: Int, $page: Int, $perPage: Int, $string: String) {
@@ -239,6 +375,7 @@ class AniList(API):
         return cls._post(form, variables, logging_info)['Page']['media']
 
     @classmethod
+    @cached('AniList', ignore=('logging_info',))
     def manga(cls, id, logging_info):
         form = """
         query ($id: Int){ # Define which variables will be used in the query (id)
@@ -344,22 +481,16 @@ class Kitsu:
 
 
 class MangaUpdates(API):
-    calls_minute = None
-    calls_second = None
-    last_api_call = None
+    limiter: RateLimiter = None
 
     @classmethod
     def initialize(cls):
         super().__init__(2, 30)
 
     @classmethod
+    @cached('MangaUpdates')
     def search(cls, query):
-        super()._check_rate_seconds()
-        super()._check_rate_minutes()
-
-        cls.calls_second += 1
-        cls.calls_minute += 1
-        cls.last_api_call = datetime.now()
+        super()._wait_for_rate_limit()
 
         data = pymanga.search(query)["series"]
         for x in data:
@@ -367,13 +498,9 @@ class MangaUpdates(API):
         return data
 
     @classmethod
+    @cached('MangaUpdates')
     def series(cls, id):
-        super()._check_rate_seconds()
-        super()._check_rate_minutes()
-
-        cls.calls_second += 1
-        cls.calls_minute += 1
-        cls.last_api_call = datetime.now()
+        super()._wait_for_rate_limit()
 
         dct = pymanga.series(id)
         dct["source"] = "MangaUpdates"
@@ -383,9 +510,7 @@ class MangaUpdates(API):
 
 
 class Fakku(API):
-    calls_minute = None
-    calls_second = None
-    last_api_call = None
+    limiter: RateLimiter = None
 
     @classmethod
     def initialize(cls):
@@ -401,17 +526,12 @@ class Fakku(API):
 
     @classmethod
     def search(cls, title):
-        super()._check_rate_seconds()
-        super()._check_rate_minutes()
-
-        cls.calls_second += 1
-        cls.calls_minute += 1
-        cls.last_api_call = datetime.now()
+        super()._wait_for_rate_limit()
 
         query = re.sub(r"\[([^]]+)\]", "", str(title))
         query = re.sub(r"\(([^)]+)\)", "", query)
         url = r"https://www.fakku.net/hentai/" + query.strip().replace(" ", "-") + "-english"
-        req = requests.get(url, cls.headers)
+        req = HttpSession.get(url, headers=cls.headers)
         soup = BeautifulSoup(req.content, 'html.parser')
         dct = {
             "success": str(soup.find("title").contents[0]) != "Error Message",
@@ -421,14 +541,9 @@ class Fakku(API):
 
     @classmethod
     def manga(cls, url):
-        super()._check_rate_seconds()
-        super()._check_rate_minutes()
+        super()._wait_for_rate_limit()
 
-        cls.calls_second += 1
-        cls.calls_minute += 1
-        cls.last_api_call = datetime.now()
-
-        req = requests.get(url, cls.headers)
+        req = HttpSession.get(url, headers=cls.headers)
         soup = BeautifulSoup(req.content, 'html.parser')
         series_title = soup.find("title").contents[0].split(" Hentai by")[0]
         series_title_eng = None
@@ -465,9 +580,7 @@ class Fakku(API):
 
 
 class NH(API):
-    calls_minute = None
-    calls_second = None
-    last_api_call = None
+    limiter: RateLimiter = None
 
     def __init__(self):
         self.NH = NHentai()
@@ -476,13 +589,9 @@ class NH(API):
     def initialize(cls):
         super().__init__(2, 30)
 
+    @cached('NHentai')
     def search(self, query):
-        super()._check_rate_seconds()
-        super()._check_rate_minutes()
-
-        NH.calls_second += 1
-        NH.calls_minute += 1
-        NH.last_api_call = datetime.now()
+        super()._wait_for_rate_limit()
 
         cleanquery = query
         tldfilter = [".us", ".com"]
@@ -491,13 +600,9 @@ class NH(API):
         search_obj: SearchPage = self.NH.search(query=cleanquery, sort="popular", page=1)
         return [x.__dict__ for x in search_obj.doujins]
 
+    @cached('NHentai')
     def manga(self, id, title):
-        super()._check_rate_seconds()
-        super()._check_rate_minutes()
-
-        NH.calls_second += 1
-        NH.calls_minute += 1
-        NH.last_api_call = datetime.now()
+        super()._wait_for_rate_limit()
 
         book = re.sub(r"\[([^]]+)\]", "", title)
         book = re.findall(r"\(([^)]+)\)", book)
@@ -0,0 +1,390 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+
+
+class ResponseCache:
+    """
+    Persistent on-disk cache of upstream metadata API responses, stored in SQLite.
+
+    Entries are keyed by source plus the normalized request arguments and expire after a per-source TTL. Once the cache
+    holds max_entries responses, the least recently read ones are evicted. Until initialize() is called every lookup is
+    a miss and nothing is stored, so the API classes work unchanged without a cache.
+    """
+    path = None
+    max_entries = 10000
+    default_ttl = 7 * 24 * 60 * 60
+    ttls = {}
+
+    hits = {}
+    misses = {}
+
+    _connection = None
+    _lock = Lock()
+    _size = 0
+    _clock = time.time
+    _log = None
+
+    @classmethod
+    def initialize(cls, path, ttls=None, max_entries=None, clock=time.time):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+        cls.close()
+
+        cls.path = Path(path)
+        cls.path.parent.mkdir(parents=True, exist_ok=True)
+        if ttls is not None:
+            cls.ttls = dict(ttls)
+        if max_entries is not None:
+            cls.max_entries = max(max_entries, 1)
+        cls._clock = clock
+        cls.hits = {}
+        cls.misses = {}
+
+        with cls._lock:
+            cls._connection = sqlite3.connect(str(cls.path), check_same_thread=False, isolation_level=None)
+            cls._connection.execute('PRAGMA journal_mode=WAL')
+            cls._connection.execute('PRAGMA synchronous=NORMAL')
+            cls._connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                    'key TEXT PRIMARY KEY, '
+                                    'source TEXT NOT NULL, '
+                                    'value BLOB NOT NULL, '
+                                    'created REAL NOT NULL, '
+                                    'accessed REAL NOT NULL)')
+            cls._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            cls._purge_expired()
+            cls._size = cls._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+        cls._log.info(f'Response cache "{cls.path}" loaded with {cls._size} entries')
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._connection is not None:
+                cls._connection.close()
+                cls._connection = None
+                cls._size = 0
+
+    @classmethod
+    def ttl(cls, source):
+        return cls.ttls.get(source, cls.default_ttl)
+
+    @staticmethod
+    def _normalize(value):
+        if isinstance(value, str):
+            return ' '.join(value.split()).casefold()
+        if isinstance(value, dict):
+            return {str(key): ResponseCache._normalize(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [ResponseCache._normalize(item) for item in value]
+        return value
+
+    @classmethod
+    def make_key(cls, source, request):
+        """
+        Builds the cache key for a request: surrounding and repeated whitespace and letter case do not change the key,
+        so "Peach Girl" and " peach  girl" share a response.
+        """
+        return source + ':' + json.dumps(cls._normalize(request), sort_keys=True, default=str)
+
+    @classmethod
+    def _purge_expired(cls):
+        now = cls._clock()
+        sources = [row[0] for row in cls._connection.execute('SELECT DISTINCT source FROM responses')]
+        for source in sources:
+            cls._connection.execute('DELETE FROM responses WHERE source = ? AND created < ?',
+                                    (source, now - cls.ttl(source)))
+
+    @classmethod
+    def get(cls, source, key):
+        """
+        Returns (True, response) on a fresh hit, otherwise (False, None).
+        """
+        with cls._lock:
+            if cls._connection is None:
+                return False, None
+
+            now = cls._clock()
+            row = cls._connection.execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[1] < now - cls.ttl(source):
+                cls._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                cls._size -= 1
+                row = None
+
+            if row is None:
+                cls.misses[source] = cls.misses.get(source, 0) + 1
+                return False, None
+
+            cls._connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            cls.hits[source] = cls.hits.get(source, 0) + 1
+
+        return True, pickle.loads(row[0])
+
+    @classmethod
+    def put(cls, source, key, value):
+        if cls._connection is None:
+            return
+
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            cls._log.debug(f'Response from {source} could not be cached: {e}')
+            return
+
+        with cls._lock:
+            if cls._connection is None:
+                return
+
+            now = cls._clock()
+            exists = cls._connection.execute('SELECT 1 FROM responses WHERE key = ?', (key,)).fetchone()
+            cls._connection.execute('INSERT OR REPLACE INTO responses (key, source, value, created, accessed) '
+                                    'VALUES (?, ?, ?, ?, ?)', (key, source, blob, now, now))
+            if exists is None:
+                cls._size += 1
+
+            if cls._size > cls.max_entries:
+                evicted = cls._size - cls.max_entries
+                cls._connection.execute('DELETE FROM responses WHERE key IN '
+                                        '(SELECT key FROM responses ORDER BY accessed LIMIT ?)', (evicted,))
+                cls._size -= evicted
+
+    @classmethod
+    def size(cls):
+        with cls._lock:
+            return cls._size
+
+    @classmethod
+    def log_statistics(cls):
+        if cls._connection is None:
+            return
+
+        for source in sorted(set(cls.hits) | set(cls.misses)):
+            cls._log.info(f'Response cache for {source}: {cls.hits.get(source, 0)} hits, '
+                          f'{cls.misses.get(source, 0)} misses')
+
+
+class CoverCache:
+    """
+    Persistent cache of series cover images, so a series folder that lost its default.jpg gets it back with a file
+    copy instead of downloading the cover again.
+
+    Images are stored once per content, named by their SHA-256, and indexed in SQLite by source, series id and kind
+    ("original" for the downloaded cover, "thumbnail" for the cropped default.jpg). Once the images take up more than
+    max_bytes, the least recently used ones are evicted. Until initialize() is called every lookup is a miss and nothing
+    is stored.
+    """
+    directory = None
+    max_bytes = 256 * 1024 * 1024
+
+    hits = 0
+    misses = 0
+
+    _connection = None
+    _lock = Lock()
+    _bytes = 0
+    _clock = time.time
+    _log = None
+
+    @classmethod
+    def initialize(cls, directory, max_bytes=None, clock=time.time):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+        cls.close()
+
+        cls.directory = Path(directory)
+        cls.directory.mkdir(parents=True, exist_ok=True)
+        if max_bytes is not None:
+            cls.max_bytes = max(max_bytes, 0)
+        cls._clock = clock
+        cls.hits = 0
+        cls.misses = 0
+
+        with cls._lock:
+            cls._connection = sqlite3.connect(str(Path(cls.directory, 'covers.db')), check_same_thread=False,
+                                              isolation_level=None)
+            cls._connection.execute('PRAGMA journal_mode=WAL')
+            cls._connection.execute('PRAGMA synchronous=NORMAL')
+            cls._connection.execute('CREATE TABLE IF NOT EXISTS images ('
+                                    'digest TEXT PRIMARY KEY, '
+                                    'size INTEGER NOT NULL, '
+                                    'accessed REAL NOT NULL)')
+            cls._connection.execute('CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed)')
+            cls._connection.execute('CREATE TABLE IF NOT EXISTS covers ('
+                                    'source TEXT NOT NULL, '
+                                    'id TEXT NOT NULL, '
+                                    'kind TEXT NOT NULL, '
+                                    'digest TEXT NOT NULL, '
+                                    'PRIMARY KEY (source, id, kind))')
+            cls._connection.execute('CREATE INDEX IF NOT EXISTS covers_digest ON covers (digest)')
+            cls._bytes = cls._connection.execute('SELECT COALESCE(SUM(size), 0) FROM images').fetchone()[0]
+            cls._evict()
+            count = cls._connection.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+        cls._log.info(f'Cover cache "{cls.directory}" loaded with {count} images ({cls._bytes} bytes)')
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._connection is not None:
+                cls._connection.close()
+                cls._connection = None
+                cls._bytes = 0
+
+    @classmethod
+    def _image_path(cls, digest):
+        return Path(cls.directory, digest[:2], digest)
+
+    @classmethod
+    def _lookup(cls, source, id, kind):
+        # Returns the path of a cached image and marks it as used, or None; the caller holds the lock
+        row = cls._connection.execute('SELECT digest FROM covers WHERE source = ? AND id = ? AND kind = ?',
+                                      (source, str(id), kind)).fetchone()
+        if row is not None:
+            path = cls._image_path(row[0])
+            if path.is_file():
+                cls._connection.execute('UPDATE images SET accessed = ? WHERE digest = ?', (cls._clock(), row[0]))
+                cls.hits += 1
+                return path
+            # The file was removed from under the cache
+            cls._remove(row[0])
+        cls.misses += 1
+        return None
+
+    @classmethod
+    def get(cls, source, id, kind):
+        """
+        Returns the cached image's bytes, or None on a miss.
+        """
+        with cls._lock:
+            if cls._connection is None:
+                return None
+            path = cls._lookup(source, id, kind)
+            if path is None:
+                return None
+            return path.read_bytes()
+
+    @classmethod
+    def copy_to(cls, source, id, kind, destination):
+        """
+        Copies the cached image to destination. Returns False, leaving destination alone, on a miss.
+        """
+        with cls._lock:
+            if cls._connection is None:
+                return False
+            path = cls._lookup(source, id, kind)
+            if path is None:
+                return False
+            shutil.copyfile(path, destination)
+        return True
+
+    @classmethod
+    def put(cls, source, id, kind, image):
+        if cls._connection is None:
+            return
+
+        digest = hashlib.sha256(image).hexdigest()
+        with cls._lock:
+            if cls._connection is None:
+                return
+
+            now = cls._clock()
+            path = cls._image_path(digest)
+            exists = cls._connection.execute('SELECT 1 FROM images WHERE digest = ?', (digest,)).fetchone()
+            if exists is None or not path.is_file():
+                path.parent.mkdir(exist_ok=True)
+                temporary = path.with_name(f'{digest}.tmp')
+                temporary.write_bytes(image)
+                os.replace(temporary, path)
+            if exists is None:
+                cls._bytes += len(image)
+            cls._connection.execute('INSERT OR REPLACE INTO images (digest, size, accessed) VALUES (?, ?, ?)',
+                                    (digest, len(image), now))
+
+            previous = cls._connection.execute('SELECT digest FROM covers WHERE source = ? AND id = ? AND kind = ?',
+                                               (source, str(id), kind)).fetchone()
+            cls._connection.execute('INSERT OR REPLACE INTO covers (source, id, kind, digest) VALUES (?, ?, ?, ?)',
+                                    (source, str(id), kind, digest))
+            if previous is not None and previous[0] != digest:
+                cls._release(previous[0])
+            cls._evict()
+
+    @classmethod
+    def _release(cls, digest):
+        # Drops an image no cover refers to any more
+        if cls._connection.execute('SELECT 1 FROM covers WHERE digest = ? LIMIT 1', (digest,)).fetchone() is None:
+            cls._remove(digest)
+
+    @classmethod
+    def _remove(cls, digest):
+        row = cls._connection.execute('SELECT size FROM images WHERE digest = ?', (digest,)).fetchone()
+        cls._connection.execute('DELETE FROM covers WHERE digest = ?', (digest,))
+        cls._connection.execute('DELETE FROM images WHERE digest = ?', (digest,))
+        if row is not None:
+            cls._bytes -= row[0]
+        try:
+            os.remove(cls._image_path(digest))
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def _evict(cls):
+        while cls._bytes > cls.max_bytes:
+            row = cls._connection.execute('SELECT digest FROM images ORDER BY accessed LIMIT 1').fetchone()
+            if row is None:
+                cls._bytes = 0
+                break
+            cls._remove(row[0])
+
+    @classmethod
+    def size(cls):
+        """
+        Returns the number of bytes of images held.
+        """
+        with cls._lock:
+            return cls._bytes
+
+    @classmethod
+    def log_statistics(cls):
+        if cls._connection is None:
+            return
+
+        cls._log.info(f'Cover cache: {cls.hits} hits, {cls.misses} misses')
+
+
+def cached(source, ignore=()):
+    """
+    Decorates an API method so its responses are served from ResponseCache. The first argument (self or cls) and any
+    parameters named in ignore, such as logging_info, are left out of the cache key. None and empty responses and
+    exceptions are never cached, so failed lookups and searches that found nothing, as during an outage or for a series
+    just added, are retried on the next call.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            request = [function.__name__] + [value for name, value in list(bound.arguments.items())[1:]
+                                             if name not in ignore]
+            key = ResponseCache.make_key(source, request)
+
+            hit, response = ResponseCache.get(source, key)
+            if hit:
+                return response
+
+            response = function(*args, **kwargs)
+            if response is not None and not (isinstance(response, (list, tuple, dict)) and not response):
+                ResponseCache.put(source, key, response)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -1,15 +1,28 @@
+import heapq
+import itertools
 import logging
+import math
+import re
 import sys
+import time
+from collections import Counter, OrderedDict, defaultdict
 from datetime import datetime
 from pathlib import Path
-from queue import Queue
+from threading import Condition, Lock, Thread
 
-from bson.errors import InvalidDocument
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError
+import bson
+from bson import ObjectId
+from pymongo import ASCENDING, DeleteOne, InsertOne, MongoClient, UpdateOne
+from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError, OperationFailure, BulkWriteError
+from pymongo.write_concern import WriteConcern
+
+from MangaTaggerLib.sqlite_store import SQLiteClient
 
 
 class Database:
+    # "mongodb", or "sqlite" to keep every table in a local file at sqlite_path instead of a MongoDB server
+    backend = 'mongodb'
+    sqlite_path = None
     database_name = None
     host_address = None
     port = None
@@ -18,6 +31,32 @@ class Database:
     auth_source = None
     server_selection_timeout_ms = None
 
+    # Indexes each table needs, as (keys, options) pairs passed to create_index, and example filters for the queries
+    # they are meant to serve, used when checking query plans
+    indexes = []
+    index_queries = []
+
+    # Write-behind buffer: inserts and updates are queued and written in unordered bulk writes once write_batch_size
+    # operations are pending or the oldest has waited write_interval seconds. write_concern sets how durable each
+    # batch must be before it counts as written.
+    write_batch_size = 100
+    write_interval = 1
+    write_concern = 'acknowledged'
+    write_concerns = {
+        'unacknowledged': WriteConcern(w=0),
+        'acknowledged': WriteConcern(w=1),
+        'journaled': WriteConcern(w=1, j=True),
+        'majority': WriteConcern(w='majority', j=True)
+    }
+
+    _write_buffer = []
+    _writes_in_flight = []
+    _write_condition = Condition()
+    _flush_lock = Lock()
+    _oldest_write_time = None
+    _writer = None
+    _writer_running = False
+
     _client = None
     _database = None
     _log = None
@@ -26,28 +65,34 @@ class Database:
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
 
-        if cls.auth_source is None:
-            cls._client = MongoClient(cls.host_address,
-                                      cls.port,
-                                      username=cls.username,
-                                      password=cls.password,
-                                      serverSelectionTimeoutMS=cls.server_selection_timeout_ms)
+        if cls.backend == 'sqlite':
+            cls._log.info(f'Opening local database "{cls.sqlite_path}"...')
+            # Batches that must be journaled are synced to disk on every commit
+            synchronous = 'FULL' if cls.write_concern in ('journaled', 'majority') else 'NORMAL'
+            cls._client = SQLiteClient(cls.sqlite_path, synchronous)
         else:
-            cls._client = MongoClient(cls.host_address,
-                                      cls.port,
-                                      username=cls.username,
-                                      password=cls.password,
-                                      authSource=cls.auth_source,
-                                      serverSelectionTimeoutMS=cls.server_selection_timeout_ms)
-
-        try:
-            cls._log.info('Establishing database connection...')
-            cls._client.is_mongos
-        except ServerSelectionTimeoutError as sste:
-            cls._log.exception(sste)
-            cls._log.critical('Manga Tagger cannot run without a database connection. Please check the'
-                              'configuration in settings.json and try again.')
-            sys.exit(1)
+            if cls.auth_source is None:
+                cls._client = MongoClient(cls.host_address,
+                                          cls.port,
+                                          username=cls.username,
+                                          password=cls.password,
+                                          serverSelectionTimeoutMS=cls.server_selection_timeout_ms)
+            else:
+                cls._client = MongoClient(cls.host_address,
+                                          cls.port,
+                                          username=cls.username,
+                                          password=cls.password,
+                                          authSource=cls.auth_source,
+                                          serverSelectionTimeoutMS=cls.server_selection_timeout_ms)
+
+            try:
+                cls._log.info('Establishing database connection...')
+                cls._client.is_mongos
+            except ServerSelectionTimeoutError as sste:
+                cls._log.exception(sste)
+                cls._log.critical('Manga Tagger cannot run without a database connection. Please check the'
+                                  'configuration in settings.json and try again.')
+                sys.exit(1)
 
         cls._database = cls._client[cls.database_name]
 
@@ -56,24 +101,100 @@ class Database:
         ProcSeriesTable.initialize()
         TaskQueueTable.initialize()
 
+        for table in cls.tables():
+            table.create_indexes()
+        cls.verify_indexes()
+
+        cls.start_writer()
+
         cls._log.info('Database connection established!')
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
+    @staticmethod
+    def tables():
+        return [MetadataTable, ProcFilesTable, ProcSeriesTable, TaskQueueTable]
+
     @classmethod
-    def load_database_tables(cls):
-        ProcSeriesTable.load()
+    def create_indexes(cls):
+        for keys, options in cls.indexes:
+            cls._log.info(f'Ensuring index {keys} on "{cls._database.name}"...')
+            start = time.perf_counter()
+            try:
+                name = cls._database.create_index(keys, **options)
+            except (DuplicateKeyError, OperationFailure) as e:
+                cls._log.exception(e)
+                cls._log.error(f'Index {keys} could not be built on "{cls._database.name}"; lookups on these keys '
+                               f'will scan the whole collection until the conflicting documents are removed.')
+                continue
+
+            cls._log.info(f'Index "{name}" is ready ({time.perf_counter() - start:.2f}s)')
+
+    @classmethod
+    def missing_indexes(cls):
+        """
+        Returns the declared indexes that do not exist on the collection.
+        """
+        existing = [index['key'] for index in cls._database.index_information().values()]
+        existing = [[(field, direction if isinstance(direction, str) else int(direction)) for field, direction in key]
+                    for key in existing]
+        return [(keys, options) for keys, options in cls.indexes if list(keys) not in existing]
 
     @classmethod
-    def save_database_tables(cls):
-        ProcSeriesTable.save()
+    def query_plans(cls):
+        """
+        Returns the winning plan stages for each of the table's example queries, e.g. IXSCAN or COLLSCAN.
+        """
+        plans = {}
+        for query in cls.index_queries:
+            plan = cls._database.find(query).limit(1).explain()['queryPlanner']['winningPlan']
+            stages = []
+            while plan is not None:
+                stages.append(plan['stage'])
+                plan = plan.get('inputStage')
+            plans[str(list(query.keys()))] = stages
+        return plans
+
+    @classmethod
+    def verify_indexes(cls):
+        """
+        Logs any missing indexes and the query plan of every indexed lookup. Returns True if nothing is missing and no
+        lookup falls back to a collection scan.
+        """
+        healthy = True
+        for table in cls.tables():
+            for keys, options in table.missing_indexes():
+                healthy = False
+                cls._log.warning(f'Index {keys} is missing on "{table._database.name}"')
+
+            try:
+                plans = table.query_plans()
+            except OperationFailure as e:
+                cls._log.exception(e)
+                continue
+
+            for query, stages in plans.items():
+                cls._log.debug(f'Query plan for "{table._database.name}" by {query}: {" <- ".join(stages)}')
+                if 'COLLSCAN' in stages:
+                    healthy = False
+                    cls._log.warning(f'Lookups on "{table._database.name}" by {query} scan the whole collection')
+
+        return healthy
+
+    @classmethod
+    def load_database_tables(cls):
+        ProcSeriesTable.load()
+        MetadataTable.load()
 
     @classmethod
     def close_connection(cls):
+        cls.stop_writer()
         cls._log.info('Closing database connection...')
         cls._client.close()
 
     @classmethod
     def print_debug_settings(cls):
+        cls._log.debug(f'Backend: {Database.backend}')
+        cls._log.debug(f'SQLite Path: {Database.sqlite_path}')
         cls._log.debug(f'Database Name: {Database.database_name}')
         cls._log.debug(f'Host Address: {Database.host_address}')
         cls._log.debug(f'Port: {Database.port}')
@@ -81,39 +202,177 @@ class Database:
         cls._log.debug(f'Password: {Database.password}')
         cls._log.debug(f'Authentication Source: {Database.auth_source}')
         cls._log.debug(f'Server Selection Timeout (ms): {Database.server_selection_timeout_ms}')
+        cls._log.debug(f'Write Batch Size: {Database.write_batch_size}')
+        cls._log.debug(f'Write Interval (s): {Database.write_interval}')
+        cls._log.debug(f'Write Concern: {Database.write_concern}')
+        cls._log.debug(f'Max Task Replays: {TaskQueueTable.max_replays}')
 
     @classmethod
-    def insert(cls, data, logging_info=None):
-        try:
-            cls._log.info('Attempting to insert record into the database...', extra=logging_info)
+    def start_writer(cls):
+        with Database._write_condition:
+            if Database._writer_running:
+                return
+            Database._writer_running = True
 
-            if type(data) is dict:
-                cls._database.insert_one(data)
-            else:
-                cls._database.insert_one(data.__dict__)
-        except (DuplicateKeyError, InvalidDocument) as e:
-            cls._log.exception(e, extra=logging_info)
-            return
+        Database._writer = Thread(target=Database._run_writer, name='MTT-DBWriter', daemon=True)
+        Database._writer.start()
+
+    @classmethod
+    def stop_writer(cls):
+        """
+        Stops the background writer and writes everything still buffered.
+        """
+        with Database._write_condition:
+            Database._writer_running = False
+            Database._write_condition.notify_all()
+
+        if Database._writer is not None:
+            Database._writer.join()
+            Database._writer = None
+
+        Database.flush()
+
+    @classmethod
+    def _run_writer(cls):
+        while True:
+            with Database._write_condition:
+                while Database._writer_running and not Database._write_due():
+                    if Database._write_buffer:
+                        timeout = Database._oldest_write_time + Database.write_interval - time.monotonic()
+                    else:
+                        timeout = None
+                    Database._write_condition.wait(timeout)
+
+                if not Database._writer_running:
+                    return
+
+            Database.flush()
+
+    @classmethod
+    def _write_due(cls):
+        if not Database._write_buffer:
+            return False
+        return (len(Database._write_buffer) >= Database.write_batch_size
+                or time.monotonic() - Database._oldest_write_time >= Database.write_interval)
+
+    @classmethod
+    def _buffer_write(cls, operation, logging_info, document=None):
+        with Database._write_condition:
+            if not Database._write_buffer:
+                Database._oldest_write_time = time.monotonic()
+            Database._write_buffer.append((cls, operation, logging_info, document))
+            Database._write_condition.notify_all()
+            writer_running = Database._writer_running
+
+        # Without a background writer, write through so nothing is left sitting in the buffer
+        if not writer_running:
+            Database.flush()
+
+    @classmethod
+    def flush(cls):
+        """
+        Writes all buffered operations now, one unordered bulk write per collection. Within a batch MongoDB applies all
+        inserts before any updates and all updates before any deletes. Batches are written one at a time, so an
+        operation is never overtaken by one buffered after it.
+        """
+        with Database._flush_lock:
+            with Database._write_condition:
+                if not Database._write_buffer:
+                    return
+                batch = Database._write_buffer
+                Database._write_buffer = []
+                Database._writes_in_flight = batch
+
+            try:
+                tables = {}
+                for table, operation, logging_info, _ in batch:
+                    tables.setdefault(table._database.full_name, (table, []))[1].append((operation, logging_info))
+
+                for table, writes in tables.values():
+                    table._bulk_write(writes)
+            finally:
+                with Database._write_condition:
+                    Database._writes_in_flight = []
+
+    @classmethod
+    def _bulk_write(cls, writes):
+        collection = cls._database.with_options(write_concern=Database.write_concerns[Database.write_concern])
+        try:
+            collection.bulk_write([operation for operation, _ in writes], ordered=False)
+        except BulkWriteError as bwe:
+            for error in bwe.details['writeErrors']:
+                operation, logging_info = writes[error['index']]
+                cls._log.error(f'Failed to write {operation} to "{cls._database.name}": {error["errmsg"]}',
+                               extra=logging_info)
+            for error in bwe.details['writeConcernErrors']:
+                cls._log.error(f'Write concern not satisfied for "{cls._database.name}": {error["errmsg"]}')
+            written = len(writes) - len(bwe.details['writeErrors'])
         except Exception as e:
-            cls._log.exception(e, extra=logging_info)
-            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
-                             extra=logging_info)
+            cls._log.exception(e)
+            cls._log.warning(f'{len(writes)} buffered writes to "{cls._database.name}" were lost. Manga Tagger is '
+                             f'unfamiliar with this error. Please log an issue for investigation.')
             return
+        else:
+            written = len(writes)
 
-        cls._log.info('Insertion was successful!', extra=logging_info)
+        cls._log.debug(f'Wrote {written} buffered operations to "{cls._database.name}"')
 
     @classmethod
-    def update(cls, search_filter, data, logging_info):
+    def pending_inserts(cls):
+        """
+        Returns the documents queued for insertion into this table that may not have reached the database yet.
+        """
+        with Database._write_condition:
+            writes = Database._writes_in_flight + Database._write_buffer
+            return [document for table, _, _, document in writes
+                    if document is not None and table._database.full_name == cls._database.full_name]
+
+    @classmethod
+    def _encodable(cls, logging_info, *documents, check_keys=False):
+        """
+        Checks that documents can be sent to the database before their write is buffered, so a bad record is rejected
+        on its own instead of failing the bulk write it would have been part of. Inserts pass check_keys, as MongoDB
+        rejects inserted field names containing "." or starting with "$".
+        """
         try:
-            cls._log.info('Attempting to update record in the database...', extra=logging_info)
-            cls._database.update_one(search_filter, data)
+            for document in documents:
+                bson.encode(document, check_keys=check_keys)
         except Exception as e:
-            cls._log.exception(e, extra=logging_info)
-            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
-                             extra=logging_info)
+            cls._log.error(f'Record for "{cls._database.name}" cannot be written: {e}', extra=logging_info)
+            return False
+        return True
+
+    @classmethod
+    def insert(cls, data, logging_info=None):
+        """
+        Buffers a document for insertion and returns the copy that will be written, or None if it cannot be written.
+        """
+        # Copy the document so later changes to the caller's object cannot leak into the buffered write, and assign
+        # its _id up front so it can be referenced before it is written
+        document = dict(data) if type(data) is dict else dict(data.__dict__)
+        document.setdefault('_id', ObjectId())
+        if not cls._encodable(logging_info, document, check_keys=True):
+            return None
+
+        cls._log.info('Queuing record for insertion into the database...', extra=logging_info)
+        cls._buffer_write(InsertOne(document), logging_info, document)
+        return document
+
+    @classmethod
+    def update(cls, search_filter, data, logging_info):
+        if not cls._encodable(logging_info, search_filter, data):
+            return
+
+        cls._log.info('Queuing record update in the database...', extra=logging_info)
+        cls._buffer_write(UpdateOne(search_filter, data), logging_info)
+
+    @classmethod
+    def delete(cls, search_filter, logging_info=None):
+        if not cls._encodable(logging_info, search_filter):
             return
 
-        cls._log.info('Update was successful!', extra=logging_info)
+        cls._log.debug('Queuing record deletion from the database...', extra=logging_info)
+        cls._buffer_write(DeleteOne(search_filter), logging_info)
 
     @classmethod
     def delete_all(cls, logging_info):
@@ -129,7 +388,173 @@ class Database:
         cls._log.info('Deletion was successful!', extra=logging_info)
 
 
+class MetadataCache:
+    """
+    Bounded in-memory LRU cache of resolved series Metadata, keyed by normalized series title, so chapters of a series
+    that has already been resolved do not query manga_metadata again.
+    """
+    max_size = 512
+
+    _entries = OrderedDict()
+    _lock = Lock()
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def normalize(title):
+        return ' '.join(str(title).split()).casefold()
+
+    @classmethod
+    def get(cls, title):
+        key = cls.normalize(title)
+        with cls._lock:
+            metadata = cls._entries.get(key)
+            if metadata is None:
+                cls.misses += 1
+                return None
+
+            cls._entries.move_to_end(key)
+            cls.hits += 1
+            return metadata
+
+    @classmethod
+    def put(cls, title, metadata):
+        key = cls.normalize(title)
+        with cls._lock:
+            cls._entries[key] = metadata
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > cls.max_size:
+                cls._entries.popitem(last=False)
+
+    @classmethod
+    def invalidate(cls, *titles):
+        with cls._lock:
+            for title in titles:
+                if title is not None:
+                    cls._entries.pop(cls.normalize(title), None)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+            cls.hits = 0
+            cls.misses = 0
+
+
+class TitleIndex:
+    """
+    In-memory trigram index over the titles and synonyms of every series in manga_metadata, so a folder name that only
+    differs from a known title in punctuation, letter case or a leading "The" can be matched without any API call.
+    Titles are normalized before they are indexed; a normalized title belongs to the oldest series that has it.
+    """
+    fields = ('search_value', 'series_title', 'series_title_eng', 'series_title_jap')
+
+    # Most candidates returned for a lookup, best trigram overlap first, and the least overlap, as a Dice coefficient
+    # of the two titles' trigrams, a candidate needs to be returned at all
+    max_candidates = 10
+    min_similarity = 0.5
+
+    # Normalized title -> _id of its series, number of trigrams in the title, and trigram -> titles containing it
+    _titles = {}
+    _sizes = {}
+    _postings = defaultdict(set)
+    _lock = Lock()
+    _non_word = re.compile(r'[\W_]+')
+
+    @classmethod
+    def normalize(cls, title):
+        words = cls._non_word.sub(' ', str(title).casefold()).split()
+        if len(words) > 1 and words[0] == 'the':
+            words = words[1:]
+        return ' '.join(words)
+
+    @staticmethod
+    def trigrams(normalized):
+        padded = f'  {normalized} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    @classmethod
+    def add(cls, document):
+        titles = [document.get(field) for field in cls.fields]
+        synonyms = document.get('synonyms')
+        if isinstance(synonyms, str):
+            titles.append(synonyms)
+        elif synonyms:
+            titles.extend(synonyms)
+
+        with cls._lock:
+            for title in titles:
+                if title is None:
+                    continue
+                normalized = cls.normalize(title)
+                if not normalized or normalized in cls._titles:
+                    continue
+                trigrams = cls.trigrams(normalized)
+                cls._titles[normalized] = document['_id']
+                cls._sizes[normalized] = len(trigrams)
+                for trigram in trigrams:
+                    cls._postings[trigram].add(normalized)
+
+    @classmethod
+    def candidates(cls, title):
+        """
+        Returns (document _id, normalized title) pairs for the indexed titles sharing the most trigrams with title,
+        starting with an exact match of the normalized title if there is one.
+        """
+        normalized = cls.normalize(title)
+        if not normalized:
+            return []
+
+        trigrams = cls.trigrams(normalized)
+        with cls._lock:
+            if normalized in cls._titles:
+                return [(cls._titles[normalized], normalized)]
+
+            # Reaching min_similarity takes at least required shared trigrams, so every candidate appears in one of the
+            # rarest len(trigrams) - required + 1 posting lists; the more common ones are only checked for membership
+            postings = sorted((cls._postings.get(trigram, set()) for trigram in trigrams), key=len)
+            required = math.ceil(cls.min_similarity * len(trigrams) / (2 - cls.min_similarity))
+            rare, common = postings[:len(trigrams) - required + 1], postings[len(trigrams) - required + 1:]
+
+            shared = Counter()
+            for titles in rare:
+                shared.update(titles)
+
+            similarities = {}
+            for candidate, count in shared.items():
+                if count + len(common) < required:
+                    continue
+                count += sum(candidate in titles for titles in common)
+                similarity = 2 * count / (len(trigrams) + cls._sizes[candidate])
+                if similarity >= cls.min_similarity:
+                    similarities[candidate] = similarity
+
+            ranked = heapq.nlargest(cls.max_candidates, similarities, key=similarities.get)
+            return [(cls._titles[candidate], candidate) for candidate in ranked]
+
+    @classmethod
+    def size(cls):
+        return len(cls._titles)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._titles.clear()
+            cls._sizes.clear()
+            cls._postings.clear()
+
+
 class MetadataTable(Database):
+    indexes = [
+        ([('search_value', ASCENDING)], {}),
+        ([('series_title', ASCENDING)], {}),
+        ([('series_title_eng', ASCENDING)], {})
+    ]
+    index_queries = [{'search_value': None}, {'series_title': None}, {'series_title_eng': None}]
+
+    # Keys a series can be found by, in order of preference when a title matches different documents on different keys
+    search_keys = ('search_value', 'series_title', 'series_title_eng')
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
@@ -137,29 +562,61 @@ class MetadataTable(Database):
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
     @classmethod
-    def search_by_search_value(cls, manga_title):
-        cls._log.debug(f'Searching manga_metadata cls by key "search_value" using value "{manga_title}"')
-        return cls._database.find_one({
-            'search_value': manga_title
-        })
+    def load(cls):
+        cls._log.info('Indexing known series titles...')
+        TitleIndex.clear()
+        projection = dict.fromkeys(TitleIndex.fields + ('synonyms',), True)
+        for document in cls._database.find({}, projection).sort('_id', ASCENDING):
+            TitleIndex.add(document)
+        cls._log.info(f'Indexed {TitleIndex.size()} known series titles')
 
     @classmethod
-    def search_by_series_title_eng(cls, manga_title):
-        cls._log.debug(
-            f'Searching manga_metadata cls by key "series_title_eng" using value "{manga_title}"')
-        return cls._database.find_one({
-            'series_title_eng': manga_title
-        })
+    def insert(cls, data, logging_info=None):
+        document = super(MetadataTable, cls).insert(data, logging_info)
+        if document is None:
+            return
+        TitleIndex.add(document)
+
+        # A newer document supersedes whatever was cached under any of the titles it can be found by
+        MetadataCache.invalidate(document.get('search_value'), document.get('series_title'),
+                                 document.get('series_title_eng'))
 
     @classmethod
-    def search_by_series_title(cls, manga_title):
-        cls._log.debug(f'Searching manga_metadata cls by key "series_title" using value "{manga_title}"')
-        return cls._database.find_one({
-            'series_title': manga_title
-        })
+    def find_by_id(cls, document_id):
+        for document in cls.pending_inserts():
+            if document['_id'] == document_id:
+                return document
+        return cls._database.find_one({'_id': document_id})
+
+    @classmethod
+    def search(cls, manga_title):
+        """
+        Looks a series up by all of its search keys in one query. If several documents match, one matching on an
+        earlier key in search_keys wins, and ties go to the oldest document.
+        """
+        cls._log.debug(f'Searching manga_metadata by keys {cls.search_keys} using value "{manga_title}"')
+        results = cls._database.find({
+            '$or': [{key: manga_title} for key in cls.search_keys]
+        }).sort('_id', ASCENDING)
+
+        best_match = None
+        best_rank = len(cls.search_keys)
+        for document in itertools.chain(results, cls.pending_inserts()):
+            rank = next((i for i, key in enumerate(cls.search_keys) if document.get(key) == manga_title), best_rank)
+            if rank < best_rank:
+                best_match, best_rank = document, rank
+                if rank == 0:
+                    break
+
+        return best_match
 
 
 class ProcFilesTable(Database):
+    indexes = [
+        ([('series_title', ASCENDING), ('chapter_number', ASCENDING)], {'unique': True})
+    ]
+    index_queries = [{'series_title': None, 'chapter_number': None}]
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
@@ -170,6 +627,10 @@ class ProcFilesTable(Database):
     def search(cls, manga_title, chapter_number):
         cls._log.debug(f'Searching processed_files cls by keys "series_title" and "chapter_number" '
                        f'using values "{manga_title}" and {chapter_number}')
+        for document in cls.pending_inserts():
+            if document['series_title'] == manga_title and document['chapter_number'] == chapter_number:
+                return document
+
         return cls._database.find_one({
             'series_title': manga_title,
             'chapter_number': chapter_number
@@ -191,7 +652,7 @@ class ProcFilesTable(Database):
         cls._log.debug(f'Record: {record}')
 
         logging_info['inserted_processed_record'] = record
-        cls._database.insert(record, logging_info)
+        super(ProcFilesTable, cls).insert(record, logging_info)
 
     @classmethod
     def update_record_and_rename(cls, results, old_file_path: Path, new_file_path: Path, logging_info):
@@ -207,72 +668,151 @@ class ProcFilesTable(Database):
         cls._log.debug(f'Record: {record}')
 
         logging_info['updated_processed_record'] = record
-        cls._database.update(results, record, logging_info)
+        super(ProcFilesTable, cls).update(results, record, logging_info)
 
 
 class ProcSeriesTable(Database):
+    indexes = [
+        ([('series_title', ASCENDING)], {'unique': True})
+    ]
+    index_queries = [{'series_title': None}]
+
     processed_series = set()
+    _add_lock = Lock()
 
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['processed_series']
-        cls._id = None
-        cls._last_save_time = None
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
     @classmethod
-    def save(cls):
-        cls._log.info('Saving processed series...')
-        cls._database.delete_one({
-            '_id': cls._id
-        })
-        super(ProcSeriesTable, cls).insert(dict.fromkeys(cls.processed_series, True))
+    def add(cls, series_title, logging_info=None):
+        """
+        Marks a series as processed and persists it right away as its own document.
+        """
+        with cls._add_lock:
+            if series_title in cls.processed_series:
+                return
+            cls.processed_series.add(series_title)
+
+        super(ProcSeriesTable, cls)._buffer_write(UpdateOne(
+            {'series_title': series_title},
+            {'$setOnInsert': {'series_title': series_title, 'process_date': datetime.now()}},
+            upsert=True
+        ), logging_info)
 
     @classmethod
     def load(cls):
         cls._log.info('Loading processed series...')
-        results = cls._database.find_one()
-        if results is not None:
-            cls._id = results.pop('_id')
-            cls.processed_series = set(results.keys())
+        cls._migrate_legacy_document()
 
-    @classmethod
-    def save_while_running(cls):
-        if cls._last_save_time is not None:
-            last_save_delta = (datetime.now() - cls._last_save_time).total_seconds()
+        processed_series = set()
+        for result in cls._database.find({'series_title': {'$exists': True}}, {'series_title': True, '_id': False}):
+            processed_series.add(result['series_title'])
+        cls.processed_series = processed_series
 
-            # Save every hour
-            if last_save_delta > 3600:
-                cls._last_save_time = datetime.now()
-                cls.save()
+        cls._log.info(f'Loaded {len(processed_series)} processed series')
+
+    @classmethod
+    def _migrate_legacy_document(cls):
+        """
+        Older versions saved every processed series as a key of one document; split it into one document per series.
+        """
+        for legacy in cls._database.find({'series_title': {'$exists': False}}):
+            legacy_id = legacy.pop('_id')
+            cls._log.info(f'Migrating {len(legacy)} processed series to one document each...')
+            if legacy:
+                cls._database.bulk_write([UpdateOne({'series_title': series_title},
+                                                    {'$setOnInsert': {'series_title': series_title}}, upsert=True)
+                                          for series_title in legacy], ordered=False)
+            cls._database.delete_one({'_id': legacy_id})
 
 
 class TaskQueueTable(Database):
+    """
+    Journal of queued events. An event is appended when it is enqueued, marked in progress when a worker dequeues it and
+    deleted once it has been processed, so after a crash every event still in the journal is replayed.
+
+    Appends and in-progress marks are written straight to the database, so no event is lost and no interrupted one goes
+    uncounted however the process ends. Acknowledgements go through the write-behind buffer; one lost in a crash only
+    means its chapter is processed again. An event interrupted more than max_replays times is dropped rather than
+    replayed, so a chapter that brings the process down cannot do so at every start.
+    """
+    QUEUED = 'queued'
+    IN_PROGRESS = 'in_progress'
+    max_replays = 3
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['task_queue']
-        cls.queue = Queue()
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
     @classmethod
     def load(cls, task_list: dict):
+        """
+        Fills task_list with every unfinished event, keyed by its journal _id so that chapters sharing a filename in
+        different series are all replayed.
+        """
         cls._log.info('Loading task queue...')
-        results = cls._database.find()
+        interrupted = 0
+        for result in cls._database.find().sort('_id', ASCENDING):
+            if result.get('status') == cls.IN_PROGRESS:
+                replays = result.get('replays', 0) + 1
+                if replays > cls.max_replays:
+                    cls._log.error(f'"{result["src_path"]}" was interrupted {replays} times while being processed and '
+                                   f'will not be replayed again')
+                    cls._write_now('delete_one', {'_id': result['_id']})
+                    continue
+                result['replays'] = replays
+                result['status'] = cls.QUEUED
+                cls._write_now('update_one', {'_id': result['_id']},
+                               {'$set': {'status': cls.QUEUED, 'replays': replays}})
+                interrupted += 1
+            task_list[result['_id']] = result
+
+        cls._log.info(f'Replaying {len(task_list)} unfinished events, {interrupted} of which were interrupted while '
+                      f'being processed')
+
+    @classmethod
+    def append(cls, event):
+        if event.journal_id is not None:
+            return
+
+        record = event.dictionary()
+        record['_id'] = event.journal_id = ObjectId()
+        record['status'] = cls.QUEUED
+        record['queue_date'] = datetime.now()
+        if not cls._write_now('insert_one', record):
+            event.journal_id = None
 
-        if results is not None:
-            for result in results:
-                task_list[result['manga_chapter']] = result
+    @classmethod
+    def mark_in_progress(cls, event):
+        if event.journal_id is None:
+            return
+
+        cls._write_now('update_one', {'_id': event.journal_id},
+                       {'$set': {'status': cls.IN_PROGRESS, 'start_date': datetime.now()}})
 
     @classmethod
-    def save(cls, queue):
-        if not queue.empty():
-            cls._log.info('Saving task queue...')
-            while not queue.empty():
-                event = queue.get()
-                super(TaskQueueTable, cls).insert(event.dictionary())
+    def _write_now(cls, method, *args):
+        """
+        Writes to the journal immediately, bypassing the write-behind buffer. Returns False if the write failed.
+        """
+        collection = cls._database.with_options(write_concern=Database.write_concerns[Database.write_concern])
+        try:
+            getattr(collection, method)(*args)
+        except Exception as e:
+            cls._log.exception(e)
+            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.')
+            return False
+        return True
 
     @classmethod
-    def delete_all(cls):
-        super(TaskQueueTable, cls).delete_all(None)
+    def acknowledge(cls, event):
+        if event.journal_id is None:
+            return
+
+        super(TaskQueueTable, cls).delete({'_id': event.journal_id})
+        event.journal_id = None
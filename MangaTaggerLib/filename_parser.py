@@ -0,0 +1,141 @@
+import re
+from typing import List, Optional
+
+CHAPTER_DELIMITERS = ('chapter', 'ch.', 'ch', 'act')
+VOLUME_DELIMITERS = ('volume', 'vol.', 'vol')
+
+
+class _Delimiter:
+    """
+    Compiled patterns for one delimiter. The delimiter text is used as a regular expression, exactly as file_renamer
+    always has, so "ch." matches "ch" followed by any character.
+    """
+    __slots__ = ('text', 'search', 'split')
+
+    def __init__(self, text):
+        self.text = text
+        self.search = re.compile('([ ]|^)' + text + '([0-9. ])', flags=re.IGNORECASE).search
+        self.split = re.compile(text, flags=re.IGNORECASE).split
+
+
+def _any_of(delimiters):
+    # Matches wherever at least one of the delimiters' search patterns would, so a single miss rules them all out
+    return re.compile('([ ]|^)(?:' + '|'.join(delimiters) + ')([0-9. ])', flags=re.IGNORECASE).search
+
+
+_CHAPTER = tuple(_Delimiter(text) for text in CHAPTER_DELIMITERS)
+_VOLUME = tuple(_Delimiter(text) for text in VOLUME_DELIMITERS)
+_ANY_CHAPTER = _any_of(CHAPTER_DELIMITERS)
+_ANY_VOLUME = _any_of(VOLUME_DELIMITERS)
+_ONESHOT = re.compile('oneshot', flags=re.IGNORECASE).search
+_NUMBER = re.compile(r'[\d.]+')
+_find_number = _NUMBER.search
+_split_number = _NUMBER.split
+
+
+class ParsedChapter:
+    """
+    What a downloaded chapter's filename says about it.
+
+    kind is "chapter", "oneshot", "volume", "number" or "unknown". name is the filename as it was parsed: title-cased,
+    without its extension or FMD's "series -.- " prefix. chapter_title is the chapter or volume title, if the filename
+    has one.
+    """
+    __slots__ = ('kind', 'name', 'new_filename', 'chapter_number', 'volume', 'chapter_title', 'series')
+
+    def __init__(self, kind, name, new_filename, chapter_number, series, volume=None, chapter_title=None):
+        self.kind = kind
+        self.name = name
+        self.new_filename = new_filename
+        self.chapter_number = chapter_number
+        self.volume = volume
+        self.chapter_title = chapter_title
+        self.series = series
+
+    @property
+    def title(self):
+        """
+        What the chapter is tagged with: its title when it has one, otherwise the series.
+        """
+        return self.chapter_title or self.series
+
+    def as_list(self):
+        return [self.new_filename, self.chapter_number, self.title]
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.kind!r}, {self.name!r}, {self.new_filename!r}, ' \
+               f'{self.chapter_number!r}, {self.series!r}, {self.volume!r}, {self.chapter_title!r})'
+
+
+def parse_filename(filename, manga_title=None) -> ParsedChapter:
+    """
+    Parses an FMD chapter filename. The result is the same as file_renamer has always produced, using patterns compiled
+    once at import instead of on every call.
+    """
+    filename = filename.replace('.cbz', '').title()
+    if filename.find('-.-') != -1:
+        split_filename = [x.strip() for x in filename.split('-.-')]
+        filename = split_filename[1]
+        if manga_title is None and split_filename[0]:
+            manga_title = split_filename[0]
+
+    if _ANY_CHAPTER(filename.lower()):
+        lowered = filename.lower()
+        for delimiter in _CHAPTER:
+            if not delimiter.search(lowered):
+                continue
+
+            vol_num = None
+            text = delimiter.split(filename, maxsplit=1)
+            if _ANY_VOLUME(text[0]):
+                for volume_delimiter in _VOLUME:
+                    if volume_delimiter.search(text[0]):
+                        volume = volume_delimiter.split(text[0])[1]
+                        vol_num = _find_number(volume).group(0)
+                        break
+
+            chapter_text = text[1].strip()
+            match = _find_number(chapter_text)
+            if match is None:
+                continue
+            ch_num = match.group(0).lstrip('0') or '0'
+            chapter_title = _split_number(chapter_text, maxsplit=1)[1].strip()
+            if vol_num and chapter_title:
+                return ParsedChapter('chapter', filename, f'Vol. {vol_num} Chapter {ch_num}.cbz', ch_num, manga_title,
+                                     vol_num, chapter_title)
+            return ParsedChapter('chapter', filename, f'Chapter {ch_num}.cbz', ch_num, manga_title, vol_num,
+                                 chapter_title)
+
+    if _ONESHOT(filename):
+        return ParsedChapter('oneshot', filename, f'{manga_title}.cbz', '0', manga_title)
+
+    if _ANY_VOLUME(filename):
+        for delimiter in _VOLUME:
+            if delimiter.search(filename):
+                volume = delimiter.split(filename)[1]
+                vol_num = _find_number(volume).group(0)
+                volume_title = _split_number(filename, maxsplit=1)[1].strip()
+                return ParsedChapter('volume', filename, f'Volume {vol_num}.cbz', vol_num, manga_title, vol_num,
+                                     volume_title)
+
+    if filename.strip().isdigit():
+        return ParsedChapter('number', filename, f'{filename}.cbz', f'{filename}', manga_title)
+
+    if manga_title is None:
+        manga_title = filename
+
+    return ParsedChapter('unknown', filename, '000.cbz', '0', manga_title)
+
+
+def parse_filenames(filenames, manga_title=None) -> List[Optional[ParsedChapter]]:
+    """
+    Parses a directory's worth of chapter filenames in one pass, without logging each one. Each filename gets a
+    ParsedChapter, in order, or None if it names a volume without a number and cannot be parsed.
+    """
+    parsed = []
+    for filename in filenames:
+        try:
+            parsed.append(parse_filename(filename, manga_title))
+        except AttributeError:
+            parsed.append(None)
+    return parsed
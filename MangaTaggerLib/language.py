@@ -0,0 +1,62 @@
+import logging
+import re
+import unicodedata
+from functools import lru_cache
+
+_log = logging.getLogger(__name__)
+
+# Called with a Latin-script title the heuristics cannot place and returns a language code, e.g.
+# lambda title: Translator().detect(title).lang. Each title is only ever looked up once.
+fallback = None
+
+_KANA = re.compile('[\u3040-\u30ff\u31f0-\u31ff\uff66-\uff9f]')
+_HAN = re.compile('[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+_HANGUL = re.compile('[\u1100-\u11ff\u3130-\u318f\uac00-\ud7af]')
+_WORD = re.compile('[a-z]+')
+
+# A word spelled entirely in Hepburn romaji syllables: an optional consonant or digraph and vowel, a syllabic n, or
+# the first consonant of a doubled one
+_ROMAJI = re.compile(r'(?:(?:[bdfghjkmnprstwz]|ch|sh|ts)?y?[aeiou]|n(?![aeiouy])|([bcdfghkmprstz])(?=\1)|t(?=ch))+')
+
+# Common English words that are also valid romaji, or that rule romaji out
+_ENGLISH = {'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'game', 'he', 'her', 'his', 'home', 'in', 'is',
+            'it', 'man', 'me', 'my', 'name', 'of', 'on', 'one', 'or', 'she', 'so', 'the', 'this', 'time', 'we', 'were',
+            'who', 'with', 'you', 'your'}
+
+
+@lru_cache(maxsize=4096)
+def detect_language(title):
+    """
+    Guesses the language of a series title offline: "ja", "ko" or "zh" from the script of a native title, and "ja" or
+    "en" for a Latin-script title depending on how much of it reads as romaji. Returns None if there is nothing to go
+    on.
+    """
+    if not title or not title.strip():
+        return None
+    if _KANA.search(title):
+        return 'ja'
+    if _HANGUL.search(title):
+        return 'ko'
+    if _HAN.search(title):
+        return 'zh'
+
+    # Fold macrons and other accents, as in "Shōnen", onto plain letters
+    folded = unicodedata.normalize('NFKD', title).encode('ascii', 'ignore').decode('ascii').lower()
+    words = [word for word in _WORD.findall(folded) if len(word) > 1]
+    if not words:
+        return None
+    if any(word in _ENGLISH for word in words):
+        return 'en'
+
+    romaji = sum(1 for word in words if _ROMAJI.fullmatch(word)) / len(words)
+    if romaji >= 0.75:
+        return 'ja'
+    if romaji <= 0.25:
+        return 'en'
+
+    if fallback is not None:
+        try:
+            return fallback(title)
+        except Exception as e:
+            _log.warning(f'Language detection fallback failed for "{title}": {e}')
+    return 'ja' if romaji > 0.5 else 'en'
@@ -0,0 +1,75 @@
+import logging
+import time
+from threading import Condition, Lock, get_ident
+
+
+class KeyedLock:
+    """
+    A family of exclusive locks addressed by key, such as a file path or a series title.
+
+    Only the thread that acquired a key can release it, and releasing a key that the calling thread does not hold is a
+    no-op, so a key can safely be released both by the code that finishes the work early and by a finally block that
+    guards every exception path. Waiters block on a condition variable for their key and are woken the moment the
+    owner releases it.
+    """
+    def __init__(self, name):
+        self._log = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.name = name
+
+        self._lock = Lock()
+        self._owners = {}
+        self._waiters = {}
+
+    def acquire(self, key, timeout=None):
+        """
+        Blocks until the key is free and claims it for the calling thread. Returns False if the key could not be
+        claimed within timeout seconds; a timeout of None waits indefinitely.
+        """
+        me = get_ident()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._lock:
+            owner = self._owners.get(key)
+            if owner is None or owner == me:
+                self._owners[key] = me
+                return True
+
+            waiter = self._waiters.get(key)
+            if waiter is None:
+                waiter = self._waiters[key] = [Condition(self._lock), 0]
+            waiter[1] += 1
+
+            try:
+                while key in self._owners:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._log.debug(f'Timed out waiting on {self.name} lock for "{key}"')
+                        return False
+                    waiter[0].wait(remaining)
+
+                self._owners[key] = me
+                return True
+            finally:
+                waiter[1] -= 1
+                if waiter[1] == 0:
+                    del self._waiters[key]
+
+    def release(self, key):
+        """
+        Releases the key if it is held by the calling thread and wakes the next waiter. Returns whether it was held.
+        """
+        with self._lock:
+            if self._owners.get(key) != get_ident():
+                return False
+
+            del self._owners[key]
+
+            waiter = self._waiters.get(key)
+            if waiter is not None:
+                waiter[0].notify()
+
+            return True
+
+    def locked(self, key):
+        with self._lock:
+            return key in self._owners
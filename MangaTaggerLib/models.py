@@ -2,13 +2,13 @@ import logging
 import re
 from datetime import datetime
 
-from jikanpy import Jikan, APIException
+from jikanpy import APIException
 from pytz import timezone
 
 from MangaTaggerLib.api import MTJikan
 from MangaTaggerLib.errors import MetadataNotCompleteError
+from MangaTaggerLib.language import detect_language
 from MangaTaggerLib.utils import AppSettings, compare
-from googletrans import Translator
 
 anilistpreferences = ["english", "romaji", "native"]
 
@@ -222,7 +222,7 @@ class Data:
             self.series_title_eng = details["title"]["english"]
             if self.series_title_eng is None or self.series_title_eng == "null":
                 for x in details["synonyms"]:
-                    if Translator().detect(x).lang == "en":
+                    if detect_language(x) == "en":
                         self.series_title_eng = x
                         break
             self.synonyms = details["synonyms"]
@@ -307,7 +307,7 @@ class Data:
             asd = MTJikan().manga(self.id)
             authors1 = asd["authors"]
             authors2 = [x["mal_id"] for x in authors1]
-            people = [Jikan().person(x) for x in authors2]
+            people = [MTJikan().person(x) for x in authors2]
             staff = {}
             for x in people:
                 for y in x["published_manga"]:
@@ -0,0 +1,383 @@
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from threading import RLock
+from types import SimpleNamespace
+
+from bson import ObjectId, json_util
+from pymongo import ASCENDING, DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_JSON_OPTIONS = json_util.JSONOptions(tz_aware=False)
+
+
+class SQLiteClient:
+    """
+    Embedded stand-in for MongoClient that stores every collection as a table of JSON documents in one SQLite file.
+
+    Only the subset of the pymongo collection API that the database tables use is implemented: equality, $or and
+    $exists filters, $set and $setOnInsert updates, unordered bulk writes, and single or compound (unique) indexes,
+    which become SQLite expression indexes on the document fields so lookups do not scan the table. The file runs in
+    WAL mode and every statement is parameterized, so SQLite's statement cache reuses the prepared statements.
+    """
+    def __init__(self, path, synchronous='NORMAL'):
+        self._log = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = RLock()
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None,
+                                           cached_statements=256)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(f'PRAGMA synchronous={synchronous}')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS _indexes ('
+                                 'collection TEXT NOT NULL, '
+                                 'name TEXT NOT NULL, '
+                                 'keys TEXT NOT NULL, '
+                                 'is_unique INTEGER NOT NULL, '
+                                 'PRIMARY KEY (collection, name))')
+        self._databases = {}
+
+    # MongoClient compatibility; there is never a router in front of a local file
+    is_mongos = False
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = SQLiteDatabase(self, name)
+            return self._databases[name]
+
+    def execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SQLiteDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        with self.client._lock:
+            if name not in self._collections:
+                self._collections[name] = SQLiteCollection(self, name)
+            return self._collections[name]
+
+
+class SQLiteCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = f'{database.name}.{name}'
+        self._client = database.client
+        self._table = '"' + name.replace('"', '""') + '"'
+
+        self._client.execute(f'CREATE TABLE IF NOT EXISTS {self._table} ('
+                             f'id TEXT PRIMARY KEY, '
+                             f'document TEXT NOT NULL)')
+
+    def with_options(self, **kwargs):
+        # Durability is set for the whole file through PRAGMA synchronous when the client is opened
+        return self
+
+    # Documents
+
+    @staticmethod
+    def _field(key):
+        return 'json_extract(document, \'$."' + key.replace('"', '""').replace("'", "''") + '"\')'
+
+    @staticmethod
+    def _dumps(document):
+        return json_util.dumps({key: value for key, value in document.items() if key != '_id'},
+                               separators=(',', ':'))
+
+    @staticmethod
+    def _loads(row):
+        document = {'_id': ObjectId(row[0]) if ObjectId.is_valid(row[0]) else row[0]}
+        document.update(json_util.loads(row[1], json_options=_JSON_OPTIONS))
+        return document
+
+    @staticmethod
+    def _id(value):
+        return str(value)
+
+    def _compile(self, search_filter):
+        """
+        Translates a filter into a WHERE clause and its parameters.
+        """
+        clauses = []
+        parameters = []
+        for key, value in (search_filter or {}).items():
+            if key == '$or':
+                compiled = [self._compile(part) for part in value]
+                clauses.append('(' + ' OR '.join(f'({sql})' for sql, _ in compiled) + ')')
+                for _, part_parameters in compiled:
+                    parameters.extend(part_parameters)
+            elif key.startswith('$'):
+                raise NotImplementedError(f'Filter operator {key} is not supported by the SQLite backend')
+            elif isinstance(value, dict) and value and all(operator.startswith('$') for operator in value):
+                for operator, operand in value.items():
+                    if operator == '$exists':
+                        path = self._field(key).replace('json_extract', 'json_type', 1)
+                        clauses.append(f'{path} IS {"NOT " if operand else ""}NULL')
+                    elif operator == '$eq':
+                        sql, operand_parameters = self._compile({key: operand})
+                        clauses.append(sql)
+                        parameters.extend(operand_parameters)
+                    else:
+                        raise NotImplementedError(f'Filter operator {operator} is not supported by the SQLite backend')
+            elif key == '_id':
+                clauses.append('id = ?')
+                parameters.append(self._id(value))
+            elif value is None:
+                clauses.append(f'{self._field(key)} IS NULL')
+            else:
+                clauses.append(f'{self._field(key)} = ?')
+                parameters.append(self._scalar(value))
+
+        return ' AND '.join(clauses) or '1', parameters
+
+    @staticmethod
+    def _scalar(value):
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, (str, int, float)):
+            return value
+        # json_extract returns arrays, objects and extended JSON types as minified JSON text
+        return json_util.dumps(value, separators=(',', ':'))
+
+    def _select(self, search_filter, order='rowid', limit=None):
+        where, parameters = self._compile(search_filter)
+        sql = f'SELECT id, document FROM {self._table} WHERE {where} ORDER BY {order}'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        return sql, parameters
+
+    def find(self, search_filter=None, projection=None):
+        return SQLiteCursor(self, search_filter, projection)
+
+    def find_one(self, search_filter=None, projection=None):
+        for document in self.find(search_filter, projection).limit(1):
+            return document
+        return None
+
+    def count_documents(self, search_filter):
+        where, parameters = self._compile(search_filter)
+        return self._client.execute(f'SELECT COUNT(*) FROM {self._table} WHERE {where}', parameters)[0][0]
+
+    def distinct(self, key, search_filter=None):
+        values = []
+        for document in self.find(search_filter):
+            if key in document and document[key] not in values:
+                values.append(document[key])
+        return values
+
+    # Writes
+
+    def _insert(self, document):
+        document.setdefault('_id', ObjectId())
+        try:
+            self._client.execute(f'INSERT INTO {self._table} (id, document) VALUES (?, ?)',
+                                 (self._id(document['_id']), self._dumps(document)))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name}: {e}', 11000)
+        return document['_id']
+
+    def _update(self, search_filter, update, upsert):
+        unsupported = set(update) - {'$set', '$setOnInsert'}
+        if unsupported:
+            raise NotImplementedError(f'Update operators {unsupported} are not supported by the SQLite backend')
+
+        with self._client._lock:
+            rows = self._client.execute(*self._select(search_filter, limit=1))
+            if not rows:
+                if not upsert:
+                    return 0, None
+                document = {key: value for key, value in search_filter.items()
+                            if not key.startswith('$') and not isinstance(value, dict)}
+                document.update(update.get('$setOnInsert', {}))
+                document.update(update.get('$set', {}))
+                return 0, self._insert(document)
+
+            document = self._loads(rows[0])
+            document.update(update.get('$set', {}))
+            try:
+                self._client.execute(f'UPDATE {self._table} SET document = ? WHERE id = ?',
+                                     (self._dumps(document), rows[0][0]))
+            except sqlite3.IntegrityError as e:
+                raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name}: {e}', 11000)
+            return 1, None
+
+    def _delete(self, search_filter, limit=None):
+        where, parameters = self._compile(search_filter)
+        sql = f'SELECT rowid FROM {self._table} WHERE {where}'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        with self._client._lock:
+            before = self._client._connection.total_changes
+            self._client.execute(f'DELETE FROM {self._table} WHERE rowid IN ({sql})', parameters)
+            return self._client._connection.total_changes - before
+
+    def insert_one(self, document):
+        return SimpleNamespace(inserted_id=self._insert(document), acknowledged=True)
+
+    def insert_many(self, documents, ordered=True):
+        result = self.bulk_write([InsertOne(document) for document in documents], ordered=ordered)
+        return SimpleNamespace(inserted_ids=[document['_id'] for document in documents],
+                               acknowledged=result.acknowledged)
+
+    def update_one(self, search_filter, update, upsert=False):
+        matched, upserted_id = self._update(search_filter, update, upsert)
+        return SimpleNamespace(matched_count=matched, modified_count=matched, upserted_id=upserted_id)
+
+    def delete_one(self, search_filter):
+        return SimpleNamespace(deleted_count=self._delete(search_filter, limit=1))
+
+    def delete_many(self, search_filter):
+        return SimpleNamespace(deleted_count=self._delete(search_filter))
+
+    def drop(self):
+        with self._client._lock:
+            self._client.execute(f'DELETE FROM {self._table}')
+            for (name,) in self._client.execute('SELECT name FROM _indexes WHERE collection = ?', (self.name,)):
+                self._client.execute(f'DROP INDEX IF EXISTS "{self._index_name(name)}"')
+            self._client.execute('DELETE FROM _indexes WHERE collection = ?', (self.name,))
+
+    def bulk_write(self, requests, ordered=True):
+        """
+        Applies the writes in one transaction. Like MongoDB, an unordered bulk write applies every insert, then every
+        update, then every delete, and keeps going past failed writes; an ordered one stops at the first failure.
+        """
+        indexed = list(enumerate(requests))
+        if not ordered:
+            kinds = (InsertOne, UpdateOne, DeleteOne)
+            indexed.sort(key=lambda item: next(i for i, kind in enumerate(kinds) if isinstance(item[1], kind)))
+
+        details = {'writeErrors': [], 'writeConcernErrors': [], 'nInserted': 0, 'nUpserted': 0, 'nMatched': 0,
+                   'nModified': 0, 'nRemoved': 0, 'upserted': []}
+
+        with self._client._lock:
+            self._client.execute('BEGIN IMMEDIATE')
+            try:
+                for index, request in indexed:
+                    try:
+                        if isinstance(request, InsertOne):
+                            self._insert(request._doc)
+                            details['nInserted'] += 1
+                        elif isinstance(request, UpdateOne):
+                            matched, upserted_id = self._update(request._filter, request._doc, request._upsert)
+                            details['nMatched'] += matched
+                            details['nModified'] += matched
+                            if upserted_id is not None:
+                                details['nUpserted'] += 1
+                                details['upserted'].append({'index': index, '_id': upserted_id})
+                        elif isinstance(request, DeleteOne):
+                            details['nRemoved'] += self._delete(request._filter, limit=1)
+                        else:
+                            raise NotImplementedError(f'{type(request).__name__} is not supported by the SQLite '
+                                                      f'backend')
+                    except DuplicateKeyError as e:
+                        details['writeErrors'].append({'index': index, 'code': 11000, 'errmsg': str(e),
+                                                       'op': request})
+                        if ordered:
+                            break
+                self._client.execute('COMMIT')
+            except BaseException:
+                self._client.execute('ROLLBACK')
+                raise
+
+        if details['writeErrors']:
+            details['writeErrors'].sort(key=lambda error: error['index'])
+            raise BulkWriteError(details)
+
+        return SimpleNamespace(acknowledged=True, inserted_count=details['nInserted'],
+                               matched_count=details['nMatched'], modified_count=details['nModified'],
+                               deleted_count=details['nRemoved'], upserted_count=details['nUpserted'])
+
+    # Indexes
+
+    def _index_name(self, name):
+        return f'{self.name}__{name}'
+
+    def create_index(self, keys, unique=False, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, ASCENDING)]
+        keys = list(keys)
+        name = kwargs.get('name') or '_'.join(f'{field}_{direction}' for field, direction in keys)
+        columns = ', '.join(self._field(field) + (' DESC' if direction == -1 else '') for field, direction in keys)
+
+        with self._client._lock:
+            try:
+                self._client.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS '
+                                     f'"{self._index_name(name)}" ON {self._table} ({columns})')
+            except sqlite3.IntegrityError as e:
+                raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} index: {name}: '
+                                        f'{e}', 11000)
+            self._client.execute('INSERT OR REPLACE INTO _indexes (collection, name, keys, is_unique) '
+                                 'VALUES (?, ?, ?, ?)', (self.name, name, json.dumps(keys), int(unique)))
+        return name
+
+    def index_information(self):
+        information = {'_id_': {'key': [('_id', 1)]}}
+        for name, keys, is_unique in self._client.execute('SELECT name, keys, is_unique FROM _indexes '
+                                                          'WHERE collection = ?', (self.name,)):
+            information[name] = {'key': [tuple(key) for key in json.loads(keys)]}
+            if is_unique:
+                information[name]['unique'] = True
+        return information
+
+
+class SQLiteCursor:
+    def __init__(self, collection, search_filter, projection):
+        self._collection = collection
+        self._filter = search_filter
+        self._projection = projection
+        self._sort = []
+        self._limit = None
+
+    def sort(self, key, direction=ASCENDING):
+        self._sort.append((key, direction))
+        return self
+
+    def limit(self, limit):
+        self._limit = limit or None
+        return self
+
+    def _sql(self):
+        order = ', '.join(('id' if key == '_id' else self._collection._field(key))
+                          + (' DESC' if direction == -1 else '') for key, direction in self._sort) or 'rowid'
+        return self._collection._select(self._filter, order, self._limit)
+
+    def _project(self, document):
+        if not self._projection:
+            return document
+        included = {key for key, value in self._projection.items() if value and key != '_id'}
+        if included:
+            projected = {key: document[key] for key in included if key in document}
+            if self._projection.get('_id', True):
+                projected['_id'] = document['_id']
+            return projected
+        return {key: value for key, value in document.items() if self._projection.get(key, True)}
+
+    def __iter__(self):
+        for row in self._collection._client.execute(*self._sql()):
+            yield self._project(self._collection._loads(row))
+
+    def explain(self):
+        """
+        Describes SQLite's query plan in the shape of a MongoDB winningPlan: IXSCAN when every table access uses an
+        index and COLLSCAN when any part of the query scans the table.
+        """
+        details = [row[3] for row in self._collection._client.execute('EXPLAIN QUERY PLAN ' + self._sql()[0],
+                                                                      self._sql()[1])]
+        scans = [detail for detail in details if detail.startswith('SCAN') and 'INDEX' not in detail]
+        plan = {'stage': 'COLLSCAN'} if scans else {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}
+        if self._limit:
+            plan = {'stage': 'LIMIT', 'inputStage': plan}
+        return {'queryPlanner': {'winningPlan': plan, 'sqlitePlan': details}}
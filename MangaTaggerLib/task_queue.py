@@ -1,11 +1,13 @@
+import heapq
+import itertools
 import logging
 import time
 import uuid
 from enum import Enum
 from pathlib import Path
-from queue import Queue
-from threading import Thread
-from typing import List
+from queue import Queue, Empty
+from threading import Thread, Event, Condition, Lock
+from typing import List, Dict
 
 from watchdog.events import PatternMatchingEventHandler
 from watchdog.observers import Observer
@@ -15,6 +17,10 @@ from MangaTaggerLib import MangaTaggerLib
 from MangaTaggerLib.database import TaskQueueTable
 
 
+# Put on the queue once per worker thread by QueueWorker.exit() to wake blocked workers and stop them
+_SHUTDOWN = object()
+
+
 class QueueEventOrigin(Enum):
     WATCHDOG = 1
     FROM_DB = 2
@@ -23,6 +29,12 @@ class QueueEventOrigin(Enum):
 
 class QueueEvent:
     def __init__(self, event, origin=QueueEventOrigin.WATCHDOG):
+        self.batch = None
+        # ParsedChapter for the file, when it was parsed before being queued
+        self.parsed = None
+        # _id of the event's entry in the task_queue journal, once it has one
+        self.journal_id = None
+
         if origin == QueueEventOrigin.WATCHDOG:
             self.event_type = event.event_type
             self.src_path = Path(event.src_path)
@@ -31,6 +43,7 @@ class QueueEvent:
             except AttributeError:
                 pass
         elif origin == QueueEventOrigin.FROM_DB:
+            self.journal_id = event.get('_id')
             self.event_type = event['event_type']
             self.src_path = Path(event['src_path'])
             try:
@@ -44,14 +57,20 @@ class QueueEvent:
     def __str__(self):
         if self.event_type in ('created', 'existing'):
             return f'File {self.event_type} event at {self.src_path.absolute()}'
-        elif self.event_type == 'modified':
-            return f'File {self.event_type} event at {self.dest_path.absolute()}'
+        else:
+            return f'File {self.event_type} event at {self.path.absolute()}'
+
+    @property
+    def path(self) -> Path:
+        if self.event_type == 'moved':
+            return self.dest_path
+        return self.src_path
 
     def dictionary(self):
         ret_dict = {
             'event_type': self.event_type,
             'src_path': str(self.src_path.absolute()),
-            'manga_chapter': str(self.src_path.name.strip('.cbz'))
+            'manga_chapter': self.src_path.stem
         }
 
         try:
@@ -62,18 +81,211 @@ class QueueEvent:
         return ret_dict
 
 
+class SeriesBatch:
+    """
+    The queued and in-flight chapters of one series directory. The first chapter that needs metadata resolves it and
+    stores the result here, so the other chapters in the batch skip the database and API searches.
+    """
+    def __init__(self, series_dir: Path):
+        self.series_dir = series_dir
+        self.pending = 0
+        self.metadata = None
+        self.not_found = None
+        self.lock = Lock()
+
+
+class SeriesCoalescer:
+    """
+    Groups events bound for the worker queue by series directory. Events are still queued one per chapter so they fan
+    out across all worker threads, but every event for a series shares one SeriesBatch for as long as any of that
+    series' chapters are pending.
+    """
+    def __init__(self, queue: Queue, download_dir: Path):
+        self._log = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self._queue = queue
+        self._download_dir = download_dir
+        self._batches: Dict[Path, SeriesBatch] = {}
+        self._lock = Lock()
+
+    def put(self, event):
+        series_dir = event.path.parent
+
+        # Chapters saved directly in the download directory have no series folder to group them by
+        if self._download_dir is None or series_dir != Path(self._download_dir):
+            with self._lock:
+                batch = self._batches.get(series_dir)
+                if batch is None:
+                    batch = self._batches[series_dir] = SeriesBatch(series_dir)
+                batch.pending += 1
+            event.batch = batch
+            self._log.debug(f'"{event.path.name}" joined the batch for "{series_dir.name}" '
+                            f'({batch.pending} pending)')
+
+        self._queue.put(event)
+
+    def finish(self, event):
+        batch = event.batch
+        if batch is None:
+            return
+
+        with self._lock:
+            batch.pending -= 1
+            if batch.pending == 0 and self._batches.get(batch.series_dir) is batch:
+                del self._batches[batch.series_dir]
+                self._log.debug(f'Batch for "{batch.series_dir.name}" is complete')
+
+
+class _PendingFile:
+    __slots__ = ('event', 'signature', 'due')
+
+    def __init__(self, event, signature, due):
+        self.event = event
+        self.signature = signature
+        self.due = due
+
+
+class FileSettler:
+    """
+    Holds events for files that may still be downloading and hands each one to the worker queue once its size and
+    modification time have stopped changing for settle_seconds. A single thread services every pending file from a heap
+    of due times, so worker threads only ever receive files that are ready to be processed.
+
+    The queue can be any object with a put() method; QueueWorker passes its SeriesCoalescer. If given, discard is called
+    with every event that will never reach the queue, either because its file disappeared or because a newer event for
+    the same path replaced it.
+    """
+    def __init__(self, queue, settle_seconds=1, discard=None):
+        self._log = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self._queue = queue
+        self.settle_seconds = settle_seconds
+        self._discard = discard
+
+        self._pending = {}
+        self._timers = []
+        self._sequence = itertools.count()
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = Thread(target=self._run, name='MTT-Settler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, event):
+        """
+        Starts tracking the file referenced by the event. A newer event for a path that is already pending replaces the
+        older one and restarts its settle timer.
+        """
+        path = event.path
+        signature = self._signature(path)
+
+        with self._condition:
+            replaced = self._pending.get(path)
+            self._schedule(path, _PendingFile(event, signature, time.monotonic() + self.settle_seconds))
+
+        if replaced is not None and replaced.event is not event and self._discard is not None:
+            self._discard(replaced.event)
+
+        self._log.debug(f'"{path}" is waiting to settle before being added to the queue')
+
+    def stop(self):
+        """
+        Stops the settler thread and returns the events for files that never settled, so they can be saved.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._thread.is_alive():
+            self._thread.join()
+
+        return [pending.event for pending in self._pending.values()]
+
+    def pending_count(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _schedule(self, path, pending):
+        self._pending[path] = pending
+        heapq.heappush(self._timers, (pending.due, next(self._sequence), path, pending))
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._timers or self._timers[0][0] > time.monotonic()):
+                    timeout = self._timers[0][0] - time.monotonic() if self._timers else None
+                    self._condition.wait(timeout)
+
+                if self._stopped:
+                    return
+
+                due = []
+                while self._timers and self._timers[0][0] <= time.monotonic():
+                    _, _, path, pending = heapq.heappop(self._timers)
+                    # Skip timers for events that have since been replaced by a newer event for the same path
+                    if self._pending.get(path) is pending:
+                        due.append((path, pending))
+
+            # Stat and dispatch outside of the lock so new events are never blocked behind a slow disk or a full queue
+            for path, pending in due:
+                self._check(path, pending)
+
+    def _check(self, path, pending):
+        try:
+            signature = self._signature(path, missing_ok=False)
+        except FileNotFoundError:
+            with self._condition:
+                if self._pending.get(path) is not pending:
+                    return
+                del self._pending[path]
+            self._log.warning(f'"{path}" no longer exists and will not be added to the queue')
+            if self._discard is not None:
+                self._discard(pending.event)
+            return
+
+        with self._condition:
+            if self._pending.get(path) is not pending:
+                return
+
+            if signature != pending.signature:
+                self._log.debug(f'"{path}" is still being written to; checking again in {self.settle_seconds}s')
+                self._schedule(path, _PendingFile(pending.event, signature, time.monotonic() + self.settle_seconds))
+                return
+
+            del self._pending[path]
+
+        self._log.info(f'"{path}" has settled and will be added to the queue')
+        self._queue.put(pending.event)
+
+    @staticmethod
+    def _signature(path: Path, missing_ok=True):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            if missing_ok:
+                return None
+            raise
+        return stat.st_size, stat.st_mtime_ns
+
+
 class QueueWorker:
     _queue: Queue = None
+    _settler: FileSettler = None
+    _coalescer: SeriesCoalescer = None
     _observer: Observer = None
     _log: logging = None
     _worker_list: List[Thread] = None
     _running: bool = False
+    _stop_event: Event = None
     _debug_mode = False
 
     max_queue_size = None
     threads = None
+    settle_seconds = 1
+    poll_timeout = 1
     is_library_network_path = False
     download_dir: Path = None
+    # Journaled events replayed at startup, keyed by journal _id
     task_list = {}
 
     @classmethod
@@ -82,6 +294,9 @@ class QueueWorker:
         cls._queue = Queue(maxsize=cls.max_queue_size)
         cls._worker_list = []
         cls._running = True
+        cls._stop_event = Event()
+        cls._coalescer = SeriesCoalescer(cls._queue, cls.download_dir)
+        cls._settler = FileSettler(cls._coalescer, cls.settle_seconds, TaskQueueTable.acknowledge)
 
         for i in range(cls.threads):
             if not cls._debug_mode:
@@ -96,47 +311,62 @@ class QueueWorker:
         else:
             cls._observer = Observer()
 
-        cls._observer.schedule(SeriesHandler(cls._queue), cls.download_dir, True)
+        cls._observer.schedule(SeriesHandler(cls), cls.download_dir, True)
+
+    @classmethod
+    def put(cls, event):
+        """
+        Journals a new event and starts waiting for its file to settle.
+        """
+        TaskQueueTable.append(event)
+        cls._settler.put(event)
 
     @classmethod
     def load_task_queue(cls):
+        # Replay every event the journal holds that was never acknowledged, whether it was still queued or was being
+        # processed when Manga Tagger stopped
         TaskQueueTable.load(cls.task_list)
 
         for task in cls.task_list.values():
             event = QueueEvent(task, QueueEventOrigin.FROM_DB)
             cls._log.info(f'{event} has been added to the task queue')
-            cls._queue.put(event)
-
-        TaskQueueTable.delete_all()
+            cls.put(event)
 
     @classmethod
     def save_task_queue(cls):
-        TaskQueueTable.save(cls._queue)
+        # Every event is journaled as it arrives, so unfinished ones only need to be dropped from memory; they stay
+        # unacknowledged in the journal and are replayed on the next start
+        cls._settler.stop()
         with cls._queue.mutex:
             cls._queue.queue.clear()
 
     @classmethod
-    def add_to_task_queue(cls, manga_chapter):
+    def add_to_task_queue(cls, manga_chapter, parsed=None):
         event = QueueEvent(manga_chapter, QueueEventOrigin.SCAN)
+        event.parsed = parsed
         cls._log.info(f'{event} has been added to the task queue')
-        cls._queue.put(event)
+        cls.put(event)
 
     @classmethod
     def exit(cls):
         # Stop worker threads from picking new items from the queue in process()
         cls._log.info('Stopping processing...')
         cls._running = False
+        cls._stop_event.set()
 
         # Stop watchdog from adding new events to the queue
         cls._log.debug('Stopping watchdog...')
         cls._observer.stop()
         cls._observer.join()
 
-        # Save and empty task queue
+        # Stop the settler and empty the task queue; unfinished events remain in the journal
         cls.save_task_queue()
 
-        # Finish current running jobs and stop worker threads
+        # Finish current running jobs and stop worker threads; one sentinel per worker wakes any blocked in get()
         cls._log.info('Stopping worker threads...')
+        for _ in cls._worker_list:
+            cls._queue.put(_SHUTDOWN)
+
         for worker in cls._worker_list:
             worker.join()
             cls._log.debug(f'Worker thread {worker.name} has been shut down')
@@ -146,12 +376,13 @@ class QueueWorker:
         for worker in cls._worker_list:
             worker.start()
 
+        cls._settler.start()
         cls._observer.start()
 
         cls._log.info(f'Watching "{cls.download_dir}" for new downloads')
 
-        while cls._running:
-            time.sleep(1)
+        while not cls._stop_event.wait(cls.poll_timeout):
+            pass
 
     @classmethod
     def dummy_process(cls):
@@ -159,40 +390,43 @@ class QueueWorker:
 
     @classmethod
     def process(cls):
-        while cls._running:
-            if not cls._queue.empty():
-                event = cls._queue.get()
-
-                if event.event_type in ('created', 'existing'):
-                    cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.src_path}"')
-                    path = Path(event.src_path)
-                elif event.event_type == 'moved':
-                    cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.dest_path}"')
-                    path = Path(event.dest_path)
-                else:
-                    cls._log.error('Event was passed, but Manga Tagger does not know how to handle it. Please open an '
-                                   'issue for further investigation.')
-                    cls._queue.task_done()
-                    return
+        while not cls._stop_event.is_set():
+            # Block until an event arrives; the timeout only bounds how long a worker can miss the stop event
+            try:
+                event = cls._queue.get(timeout=cls.poll_timeout)
+            except Empty:
+                continue
 
-                current_size = -1
-                try:
-                    destination_size = path.stat().st_size
-                    while current_size != destination_size:
-                        current_size = destination_size
-                        time.sleep(1)
-                except FileNotFoundError as fnfe:
-                    cls._log.exception(fnfe)
-
-                try:
-                    MangaTaggerLib.process_manga_chapter(path, uuid.uuid1(), cls.download_dir)
-                except Exception as e:
-                    cls._log.exception(e)
-                    cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for '
-                                     'investigation.')
+            if event is _SHUTDOWN:
+                cls._queue.task_done()
+                break
 
+            TaskQueueTable.mark_in_progress(event)
+            try:
+                cls._process_event(event)
+            finally:
+                TaskQueueTable.acknowledge(event)
+                cls._coalescer.finish(event)
                 cls._queue.task_done()
 
+    @classmethod
+    def _process_event(cls, event):
+        # Files only reach the queue through the FileSettler, so they are complete by the time a worker pulls them
+        if event.event_type in ('created', 'existing', 'moved'):
+            cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.path}"')
+            path = Path(event.path)
+        else:
+            cls._log.error('Event was passed, but Manga Tagger does not know how to handle it. Please open an '
+                           'issue for further investigation.')
+            return
+
+        try:
+            MangaTaggerLib.process_manga_chapter(path, uuid.uuid1(), cls.download_dir, event.batch, event.parsed)
+        except Exception as e:
+            cls._log.exception(e)
+            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for '
+                             'investigation.')
+
 
 class SeriesHandler(PatternMatchingEventHandler):
     _log = None
@@ -206,6 +440,9 @@ class SeriesHandler(PatternMatchingEventHandler):
         return f'{cls.__module__}.{cls.__name__}'
 
     def __init__(self, queue):
+        """
+        The queue can be any object with a put() method; QueueWorker passes itself.
+        """
         self._log = logging.getLogger(self.fully_qualified_class_name())
         super().__init__(patterns=['*.cbz'])
         self.queue = queue
@@ -1,14 +1,13 @@
-import requests
 import os
-import zipfile
-import xml.etree.ElementTree as ET
+from io import BytesIO
 import re
 from PIL import Image
 import pymanga
 from bs4 import BeautifulSoup
 
 from MangaTaggerLib import MangaTaggerLib
-from MangaTaggerLib.api import AniList
+from MangaTaggerLib.api import AniList, HttpSession
+from MangaTaggerLib.cache import CoverCache
 
 
 def flat(*nums):
@@ -57,84 +56,140 @@ def cropped_thumbnail(img, size):
 
     return img.resize(target.size, Image.ANTIALIAS)
 
-def thumb(dir, logging_info):
-    if "default.jpg" not in os.listdir(dir) and os.listdir(dir):
-        file = [x for x in os.listdir(dir) if x.endswith('.cbz')][0]
-        with zipfile.ZipFile(os.path.join(dir, file)) as z:
-            if "ComicInfo.xml" in os.listdir(dir):
-                os.remove(os.path.join(dir, "ComicInfo.xml"))
-            #print(z.namelist())
-            info = z.extract(z.getinfo("ComicInfo.xml"), dir)
-            z.close()
-            tree = ET.parse(os.path.join(dir, "ComicInfo.xml"))
-            root = tree.getroot()
-            webUrl = root.findall("Web")[0].text
-            image = None
-            img = None
-            if "myanimelist" in webUrl:
-                webUrl = re.search(r'(?<=manga/)\d+', webUrl)
-                # r = requests.get("https://api.jikan.moe/v3/manga/" + webUrl.group(0) + "/pictures")
-                r = requests.get("https://api.jikan.moe/v3/manga/" + webUrl.group(0))
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def first_image(archive):
+    """
+    Reads the first page of an open chapter archive, the cover used for series without a page to take one from.
+    Returns None if the archive has no images.
+    """
+    imagefile = next((file for file in archive.namelist() if file.endswith(IMAGE_EXTENSIONS)), None)
+    if imagefile is None:
+        return None
+    return archive.read(imagefile)
+
+
+# Series pages that covers are downloaded for, with the source and the pattern of the series id in their URLs
+COVER_SOURCES = (("myanimelist", "MAL", re.compile(r'(?<=manga/)\d+')),
+                 ("anilist", "AniList", re.compile(r'(?<=manga/)\d+')),
+                 ("mangaupdates", "MangaUpdates", re.compile(r'(?<=\?id=)\d+')))
+
+
+def cover_key(webUrl):
+    """
+    Returns the (source, series id) the cover for webUrl is cached under, or None if the series has no page to
+    download one from.
+    """
+    for site, source, series_id in COVER_SOURCES:
+        if site in webUrl:
+            match = series_id.search(webUrl)
+            return (source, match.group(0)) if match else None
+    return None
+
+
+def _download(url):
+    response = HttpSession.get(url)
+    # Error pages are retried by HttpSession but still returned, and must not be taken for the cover
+    response.raise_for_status()
+    return response
+
+
+def download_cover(webUrl, logging_info):
+    """
+    Downloads the cover from the series page at webUrl. Returns the image's bytes, or None if the page has none. Raises
+    requests.HTTPError if the site answers with an error.
+    """
+    if "myanimelist" in webUrl:
+        webUrl = re.search(r'(?<=manga/)\d+', webUrl)
+        # r = requests.get("https://api.jikan.moe/v3/manga/" + webUrl.group(0) + "/pictures")
+        r = _download("https://api.jikan.moe/v3/manga/" + webUrl.group(0))
+        json = r.json()
+        #print(json["image_url"].replace(".jpg", "l.jpg"))
+        return _download(json["image_url"].replace(".jpg", "l.jpg")).content
+    elif "anilist" in webUrl:
+        req = HttpSession.get(webUrl)
+        if req.status_code == 404:
+            al_id = int(re.search(r'(?<=manga/)\d+', webUrl).group(0))
+            asd = MangaTaggerLib.sources["AniList"].manga(al_id, logging_info)
+            if asd['idMal']:
+                r = _download("https://api.jikan.moe/v3/manga/" + str(asd['idMal']))
                 json = r.json()
-                #print(json["image_url"].replace(".jpg", "l.jpg"))
-                image = requests.get(json["image_url"].replace(".jpg", "l.jpg"), stream=True)
-                img = Image.open(image.raw)
-            elif "anilist" in webUrl:
-                req = requests.get(webUrl)
-                if req.status_code == 404:
-                    al_id = int(re.search(r'(?<=manga/)\d+', webUrl).group(0))
-                    asd = MangaTaggerLib.sources["AniList"].manga(al_id, logging_info)
-                    if asd['idMal']:
-                        r = requests.get("https://api.jikan.moe/v3/manga/" + str(asd['idMal']))
-                        json = r.json()
-                        image = requests.get(json["image_url"].replace(".jpg", "l.jpg"), stream=True)
-                        img = Image.open(image.raw)
-                else:
-                    soup = BeautifulSoup(req.content, 'html.parser')
-                    image = requests.get(soup.find_all(name="img")[0]["src"], stream=True)
-                    img = Image.open(image.raw)
-            elif "mangaupdates" in webUrl:
-                webUrl = pymanga.series(re.search(r'(?<=\?id=)(\d+)', webUrl).group(1))["image"]
-                image = requests.get(webUrl, stream=True)
-                img = Image.open(image.raw)
-            else:
-                with zipfile.ZipFile(os.path.join(dir, file)) as z:
-                    imagefile = next(file for file in z.namelist() if (file.endswith(".png") or file.endswith(".jpg") or file.endswith(".jpeg") or file.endswith(".webp")))
-                    imagefile = z.extract(imagefile)
-                    image = Image.open(imagefile)
-                    if image.mode == "RGBA":
-                        new_image = Image.new("RGBA", image.size, "WHITE")
-                        new_image.paste(image, (0, 0), image)
-                        img = new_image.convert('RGB')
-                    else:
-                        img = Image.new("RGB", image.size)
-                        img.paste(image, (0, 0))
-            if img.mode == "RGBA":
-                new_image = Image.new("RGBA", img.size, "WHITE")
-                new_image.paste(img, (0, 0), img)
-                img = new_image.convert('RGB')
-            width = img.size[0]
-            height = img.size[1]
-
-            aspect = width / float(height)
-
-            ideal_width = 150
-            ideal_height = 212
-
-            ideal_aspect = ideal_width / float(ideal_height)
-
-            if aspect > ideal_aspect:
-                # Then crop the left and right edges:
-                new_width = int(ideal_aspect * height)
-                offset = (width - new_width) / 2
-                resize = (offset, 0, width - offset, height)
-            else:
-                # ... crop the top and bottom:
-                new_height = int(width / ideal_aspect)
-                offset = (height - new_height) / 2
-                resize = (0, offset, width, height - offset)
-
-            img = img.crop(resize)
-            img.save(os.path.join(dir, "default.jpg"), "JPEG", quality=100)
-            img.close()
-            os.remove(info)
+                return _download(json["image_url"].replace(".jpg", "l.jpg")).content
+            return None
+        req.raise_for_status()
+        soup = BeautifulSoup(req.content, 'html.parser')
+        return _download(soup.find_all(name="img")[0]["src"]).content
+    elif "mangaupdates" in webUrl:
+        webUrl = pymanga.series(re.search(r'(?<=\?id=)(\d+)', webUrl).group(1))["image"]
+        return _download(webUrl).content
+    return None
+
+
+def thumb(dir, logging_info, webUrl, cover_image=None):
+    """
+    Saves the series cover as default.jpg in dir unless it is already there. The cover comes from the series page at
+    webUrl, the Web field of the chapter's ComicInfo.xml, or else from cover_image, the chapter's first image as read
+    by first_image; with neither, no cover is saved. Downloaded covers and their thumbnails are kept in CoverCache, so
+    a series folder that is made again only needs a copy.
+    """
+    if "default.jpg" in os.listdir(dir):
+        return
+    thumbnail = os.path.join(dir, "default.jpg")
+    key = cover_key(webUrl)
+    if key is None:
+        if cover_image is None:
+            return
+        image = Image.open(BytesIO(cover_image))
+        if image.mode == "RGBA":
+            new_image = Image.new("RGBA", image.size, "WHITE")
+            new_image.paste(image, (0, 0), image)
+            img = new_image.convert('RGB')
+        else:
+            img = Image.new("RGB", image.size)
+            img.paste(image, (0, 0))
+    else:
+        if CoverCache.copy_to(*key, "thumbnail", thumbnail):
+            return
+        cover = CoverCache.get(*key, "original")
+        if cover is None:
+            cover = download_cover(webUrl, logging_info)
+            if cover is None:
+                return
+            # Only a readable image is cached, as a cached cover is never downloaded again
+            Image.open(BytesIO(cover)).verify()
+            CoverCache.put(*key, "original", cover)
+        img = Image.open(BytesIO(cover))
+    if img.mode == "RGBA":
+        new_image = Image.new("RGBA", img.size, "WHITE")
+        new_image.paste(img, (0, 0), img)
+        img = new_image.convert('RGB')
+    width = img.size[0]
+    height = img.size[1]
+
+    aspect = width / float(height)
+
+    ideal_width = 150
+    ideal_height = 212
+
+    ideal_aspect = ideal_width / float(ideal_height)
+
+    if aspect > ideal_aspect:
+        # Then crop the left and right edges:
+        new_width = int(ideal_aspect * height)
+        offset = (width - new_width) / 2
+        resize = (offset, 0, width - offset, height)
+    else:
+        # ... crop the top and bottom:
+        new_height = int(width / ideal_aspect)
+        offset = (height - new_height) / 2
+        resize = (0, offset, width, height - offset)
+
+    img = img.crop(resize)
+    output = BytesIO()
+    img.save(output, "JPEG", quality=100)
+    img.close()
+    with open(thumbnail, "wb") as file:
+        file.write(output.getvalue())
+    if key is not None:
+        CoverCache.put(*key, "thumbnail", output.getvalue())
@@ -14,13 +14,24 @@ from fuzzywuzzy import fuzz
 from pythonjsonlogger import jsonlogger
 
 from MangaTaggerLib import MangaTaggerLib, models
-from MangaTaggerLib.database import Database
+from MangaTaggerLib.database import Database, MetadataCache, TaskQueueTable
 from MangaTaggerLib.task_queue import QueueWorker
-from MangaTaggerLib.api import MTJikan, AniList, MangaUpdates, Fakku, NH
+from MangaTaggerLib.api import MTJikan, AniList, MangaUpdates, Fakku, NH, HttpSession
+from MangaTaggerLib.cache import CoverCache, ResponseCache
+from MangaTaggerLib.filename_parser import parse_filenames
 # arg0 = FMD2 directory, arg1 = Directory to watch, arg2 = [preferences], arg3 = [anilist title preferences],
 # arg4 = source -> folder (not done)
 from sys import argv
 
+# The same matcher fuzzywuzzy uses, so TitleScorer scores exactly as compare() does
+try:
+    from Levenshtein import ratio as _ratio
+except ImportError:
+    from difflib import SequenceMatcher
+
+    def _ratio(s1, s2):
+        return SequenceMatcher(None, s1, s2).ratio()
+
 
 class AppSettings:
     mode_settings = None
@@ -46,6 +57,9 @@ class AppSettings:
                 json.dump(settings, settings_json, indent=4)
 
         MangaTaggerLib.preferences = settings["preferences"]["sourcepref"]
+        MangaTaggerLib.lazy_source_search = settings["preferences"]["lazy_search"]
+        MangaTaggerLib.local_title_matching = settings["preferences"]["local_matching"]
+        MangaTaggerLib.formatted_search_limit = settings["preferences"]["formatted_search_limit"]
         models.anilistpreferences = settings["preferences"]["anilistpref"]
 
         cls._initialize_logger(settings['logger'])
@@ -54,6 +68,12 @@ class AppSettings:
         # Database Configuration
         cls._log.debug('Now setting database configuration...')
 
+        Database.backend = settings['database']['backend']
+        if Database.backend not in ('mongodb', 'sqlite'):
+            cls._log.critical(f'"{Database.backend}" is not a valid database backend; use "mongodb" or "sqlite" in the '
+                              f'"settings.json" and try again.')
+            sys.exit(1)
+        Database.sqlite_path = settings['database']['sqlite_path']
         Database.database_name = settings['database']['database_name']
         Database.host_address = settings['database']['host_address']
         Database.port = settings['database']['port']
@@ -61,6 +81,14 @@ class AppSettings:
         Database.password = settings['database']['password']
         Database.auth_source = settings['database']['auth_source']
         Database.server_selection_timeout_ms = settings['database']['server_selection_timeout_ms']
+        Database.write_batch_size = max(settings['database']['write_batch_size'], 1)
+        Database.write_interval = max(settings['database']['write_interval_seconds'], 0)
+        Database.write_concern = settings['database']['write_concern']
+        if Database.write_concern not in Database.write_concerns:
+            cls._log.critical(f'"{Database.write_concern}" is not a valid write concern; use one of '
+                              f'{list(Database.write_concerns)} in the "settings.json" and try again.')
+            sys.exit(1)
+        TaskQueueTable.max_replays = max(settings['database']['max_task_replays'], 0)
 
         cls._log.debug('Database settings configured!')
         Database.initialize()
@@ -95,6 +123,23 @@ class AppSettings:
 
         cls._log.debug(f'Max Queue Size: {QueueWorker.max_queue_size}')
 
+        QueueWorker.settle_seconds = max(settings['application']['multithreading']['settle_seconds'], 0)
+        cls._log.debug(f'File Settle Time (s): {QueueWorker.settle_seconds}')
+
+        MangaTaggerLib.lock_timeout = settings['application']['multithreading']['lock_timeout']
+        cls._log.debug(f'Lock Timeout (s): {MangaTaggerLib.lock_timeout}')
+
+        MangaTaggerLib.search_threads = max(settings['application']['multithreading']['search_threads'], 1)
+        cls._log.debug(f'Source Search Threads: {MangaTaggerLib.search_threads}')
+
+        # HTTP Configuration
+        HttpSession.connect_timeout = settings['application']['http']['connect_timeout']
+        HttpSession.read_timeout = settings['application']['http']['read_timeout']
+        HttpSession.retries = max(settings['application']['http']['retries'], 0)
+        HttpSession.initialize(QueueWorker.threads)
+        cls._log.debug(f'HTTP Timeouts (s): connect {HttpSession.connect_timeout}, read {HttpSession.read_timeout}')
+        cls._log.debug(f'HTTP Retries: {HttpSession.retries}')
+
         # Debug Mode - Prevent application from processing files
         if settings['application']['debug_mode']:
             QueueWorker._debug_mode = True
@@ -126,6 +171,18 @@ class AppSettings:
         # Scan download directory for downloads not already in database upon loading
         cls._scan_download_dir()
 
+        # Response Cache Configuration
+        if settings['cache']['enabled']:
+            ResponseCache.initialize(settings['cache']['path'],
+                                     {source: hours * 60 * 60
+                                      for source, hours in settings['cache']['ttl_hours'].items()},
+                                     settings['cache']['max_entries'])
+            CoverCache.initialize(settings['cache']['covers_path'], settings['cache']['covers_max_mb'] * 1024 * 1024)
+        cls._log.debug(f'Response Cache Enabled: {settings["cache"]["enabled"]}')
+
+        MetadataCache.max_size = max(settings['cache']['metadata_max_entries'], 1)
+        cls._log.debug(f'Metadata Cache Size: {MetadataCache.max_size}')
+
         # Initialize API
         MTJikan.initialize()
         AniList.initialize()
@@ -299,8 +356,17 @@ class AppSettings:
         # Stop worker threads
         QueueWorker.exit()
 
-        # Save necessary database tables
-        Database.save_database_tables()
+        # Report how busy the shared HTTP connection pools were
+        HttpSession.log_pool_utilization()
+
+        # Report response and cover cache effectiveness and close them
+        ResponseCache.log_statistics()
+        ResponseCache.close()
+        CoverCache.log_statistics()
+        CoverCache.close()
+
+        # Write everything still waiting in the write-behind buffer
+        Database.stop_writer()
 
         # Close MongoDB connection
         Database.close_connection()
@@ -335,16 +401,44 @@ class AppSettings:
                 },
                 "multithreading": {
                     "threads": 8,
-                    "max_queue_size": 0
+                    "max_queue_size": 0,
+                    "settle_seconds": 1,
+                    "lock_timeout": 600,
+                    "search_threads": 5
+                },
+                "http": {
+                    "connect_timeout": 5,
+                    "read_timeout": 30,
+                    "retries": 3
+                }
+            },
+            "cache": {
+                "enabled": True,
+                "path": "data/response_cache.db",
+                "max_entries": 10000,
+                "metadata_max_entries": 512,
+                "covers_path": "data/covers",
+                "covers_max_mb": 256,
+                "ttl_hours": {
+                    "AniList": 168,
+                    "MAL": 168,
+                    "MangaUpdates": 168,
+                    "NHentai": 720
                 }
             },
             "database": {
+                "backend": "mongodb",
+                "sqlite_path": "data/manga_tagger.db",
                 "database_name": "manga_tagger",
                 "host_address": "localhost",
                 "port": 27017,
                 "username": "manga_tagger",
                 "password": "Manga4LYFE",
                 "auth_source": "admin",
+                "write_batch_size": 100,
+                "write_interval_seconds": 1,
+                "write_concern": "acknowledged",
+                "max_task_replays": 3,
                 "server_selection_timeout_ms": 1
             },
             "logger": {
@@ -383,20 +477,91 @@ class AppSettings:
             },
             "preferences": {
                 "sourcepref": MangaTaggerLib.preferences,
-                "anilistpref": models.anilistpreferences
+                "anilistpref": models.anilistpreferences,
+                "lazy_search": False,
+                "local_matching": True,
+                "formatted_search_limit": MangaTaggerLib.formatted_search_limit
             }
         }
 
     @classmethod
     def _scan_download_dir(cls):
         for directory in QueueWorker.download_dir.iterdir():
-            for manga_chapter in directory.glob('*.cbz'):
-                if manga_chapter.name.strip('.cbz') not in QueueWorker.task_list.keys():
-                    QueueWorker.add_to_task_queue(manga_chapter)
-        for chapter in QueueWorker.download_dir.glob('*.cbz'):
-            if chapter.name.strip('.cbz') not in QueueWorker.task_list.keys():
-                QueueWorker.add_to_task_queue(chapter)
+            cls._queue_chapters(directory.glob('*.cbz'), directory.name)
+        # Chapters saved directly in the download directory name their series in the filename
+        cls._queue_chapters(QueueWorker.download_dir.glob('*.cbz'), None)
+
+    @classmethod
+    def _queue_chapters(cls, chapters, manga_title):
+        # Chapters already replayed from the journal are skipped by full path, as other series may share their name
+        replayed = {Path(task[key]) for task in QueueWorker.task_list.values()
+                    for key in ('src_path', 'dest_path') if key in task}
+        chapters = [chapter for chapter in chapters if chapter.absolute() not in replayed]
+        if not chapters:
+            return
+
+        parsed_chapters = parse_filenames([chapter.name for chapter in chapters], manga_title)
+        for chapter, parsed in zip(chapters, parsed_chapters):
+            if parsed is None:
+                cls._log.warning(f'"{chapter}" names a volume without a number and will not be processed')
+            else:
+                QueueWorker.add_to_task_queue(chapter, parsed)
 
 
 def compare(s1, s2):
     return fuzz.ratio(s1.lower(), s2.lower()) / 100
+
+
+class TitleScorer:
+    """
+    Scores candidate titles against one query on the same scale as compare(). The query is lowercased once, each
+    distinct candidate is scored at most once, and candidates too long or too short to reach the cutoff are skipped
+    without being compared.
+    """
+    def __init__(self, query):
+        self.query = query
+        self._query = query.lower()
+        self._scores = {}
+
+    def score(self, candidate):
+        return self._score(candidate.lower())
+
+    def could_reach(self, candidate, cutoff):
+        return self._could_reach(len(candidate.lower()), cutoff)
+
+    def first_match(self, candidates, cutoff, accept=None):
+        """
+        Scores (item, title) candidates in order and stops at the first that scores at least cutoff or that accept,
+        if given, returns True for. Returns that match and the best scoring of the candidates that were compared,
+        each as an (item, title, score) tuple or None.
+        """
+        best = None
+        for item, title in candidates:
+            candidate = title.lower()
+            if self._could_reach(len(candidate), cutoff):
+                score = self._score(candidate)
+                if best is None or score > best[2]:
+                    best = (item, title, score)
+                if score >= cutoff:
+                    return (item, title, score), best
+            if accept is not None and accept(item, title):
+                return (item, title, None), best
+        return None, best
+
+    def _score(self, candidate):
+        score = self._scores.get(candidate)
+        if score is None:
+            # fuzz.ratio without its per-call argument checks, which the query and candidate have already passed
+            if candidate == self._query:
+                score = 1.0
+            elif not candidate or not self._query:
+                score = 0.0
+            else:
+                score = int(round(100 * _ratio(self._query, candidate))) / 100
+            self._scores[candidate] = score
+        return score
+
+    def _could_reach(self, length, cutoff):
+        # A ratio can never exceed the share of both strings that the shorter one could match
+        total = len(self._query) + length
+        return total == 0 or round(200 * min(len(self._query), length) / total) / 100 >= cutoff
@@ -0,0 +1,345 @@
+"""
+Micro-benchmarks for Manga Tagger's hot paths. These are not part of the test suite; run them from the repository root
+with:
+
+    python -m tests.benchmark [name ...] [--mongodb HOST:PORT]
+
+Benchmarks that need MongoDB use an in-memory mongomock database with a simulated round-trip time unless a real
+server is given with --mongodb.
+"""
+import argparse
+import logging
+import time
+
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(label, seconds, extra=''):
+    print(f'  {label:<40} {seconds * 1e6:>12.1f} us/op {extra}')
+
+
+class LatencyCollection:
+    """
+    Wraps a collection, counting queries and sleeping for the given round-trip time on each one.
+    """
+    def __init__(self, collection, rtt):
+        self._collection = collection
+        self._rtt = rtt
+        self.round_trips = 0
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self._rtt:
+            time.sleep(self._rtt)
+
+    def find_one(self, *args, **kwargs):
+        self._round_trip()
+        return self._collection.find_one(*args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        self._round_trip()
+        return self._collection.find(*args, **kwargs)
+
+    def bulk_write(self, *args, **kwargs):
+        self._round_trip()
+        return self._collection.bulk_write(*args, **kwargs)
+
+    def with_options(self, **kwargs):
+        return self
+
+    def __getattr__(self, item):
+        return getattr(self._collection, item)
+
+
+def metadata_collection(options):
+    if options.mongodb:
+        from pymongo import MongoClient
+        host, port = options.mongodb.split(':')
+        collection = MongoClient(host, int(port))['manga_tagger_benchmark']['manga_metadata']
+        collection.drop()
+    else:
+        import mongomock
+        collection = mongomock.MongoClient()['manga_tagger_benchmark']['manga_metadata']
+    return collection
+
+
+@benchmark
+def metadata_lookup(options):
+    """
+    Compares the old four-step dbSearch loop with the single $or lookup, for hits on each key and for misses.
+    """
+    from MangaTaggerLib.database import MetadataTable
+
+    collection = metadata_collection(options)
+    collection.insert_many([{'search_value': f'Series {i}', 'series_title': f'Title {i}',
+                             'series_title_eng': f'English {i}'} for i in range(options.documents)])
+    for keys, options_ in MetadataTable.indexes:
+        collection.create_index(keys, **options_)
+
+    timed_collection = LatencyCollection(collection, 0 if options.mongodb else options.rtt)
+    MetadataTable._database = timed_collection
+    MetadataTable._log = logging.getLogger('benchmark')
+
+    def legacy_search(title):
+        for key in MetadataTable.search_keys:
+            result = timed_collection.find_one({key: title})
+            if result is not None:
+                return result
+        # The old loop ran a fourth, non-existent mode that always returned None
+        return None
+
+    n = options.documents // 2
+    for label, title in (('hit on search_value', f'Series {n}'), ('hit on series_title_eng', f'English {n}'),
+                         ('miss', 'Not A Series')):
+        print(f'{label}:')
+        for name, search in (('dbSearch loop', legacy_search), ('MetadataTable.search', MetadataTable.search)):
+            timed_collection.round_trips = 0
+            seconds = timed(lambda: search(title), options.repeat)
+            report(name, seconds, f'({timed_collection.round_trips / options.repeat:.0f} round trips)')
+
+
+@benchmark
+def per_chapter_database(options):
+    """
+    Measures the database work done for one chapter of an already-known series on each backend: journaling the event,
+    the metadata and processed_files lookups, recording the rename and acknowledging the event. Writes go straight
+    through, as they do when the write-behind buffer flushes every operation.
+    """
+    import importlib
+    import tempfile
+    from pathlib import Path
+
+    # MangaTaggerLib must be imported before task_queue to resolve their circular import
+    importlib.import_module('MangaTaggerLib.MangaTaggerLib')
+    from MangaTaggerLib.database import Database, MetadataTable, ProcFilesTable, TaskQueueTable
+    from MangaTaggerLib.sqlite_store import SQLiteClient
+    from MangaTaggerLib.task_queue import QueueEvent, QueueEventOrigin
+
+    tables = {MetadataTable: 'manga_metadata', ProcFilesTable: 'processed_files', TaskQueueTable: 'task_queue'}
+    directory = tempfile.TemporaryDirectory()
+
+    if options.mongodb:
+        from pymongo import MongoClient
+        host, port = options.mongodb.split(':')
+        mongo = MongoClient(host, int(port))['manga_tagger_benchmark']
+        label = f'MongoDB at {options.mongodb}'
+    else:
+        import mongomock
+        mongo = mongomock.MongoClient()['manga_tagger_benchmark']
+        label = f'mongomock + {options.rtt * 1000:g} ms RTT'
+    sqlite = SQLiteClient(Path(directory.name, 'benchmark.db'))['manga_tagger_benchmark']
+
+    for backend, database in ((label, mongo), ('SQLite (WAL)', sqlite)):
+        for table, name in tables.items():
+            database[name].drop()
+            table._log = logging.getLogger('benchmark')
+            table._database = database[name]
+            table.create_indexes()
+            wrapped = LatencyCollection(database[name], 0 if options.mongodb or database is sqlite else options.rtt)
+            table._database = wrapped
+
+        MetadataTable._database.insert_many([{'search_value': f'Series {i}', 'series_title': f'Title {i}'}
+                                             for i in range(options.documents)])
+        ProcFilesTable._database.insert_many([{'series_title': f'Series {i}', 'chapter_number': '001'}
+                                              for i in range(options.documents)])
+
+        chapters = iter(range(10 ** 9))
+
+        def chapter():
+            number = f'{next(chapters) + 2:03}'
+            event = QueueEvent(Path('downloads', 'Series 1', f'Chapter {number}.cbz'), QueueEventOrigin.SCAN)
+            TaskQueueTable.append(event)
+            TaskQueueTable.mark_in_progress(event)
+            MetadataTable.search('Series 1')
+            ProcFilesTable.search('Series 1', number)
+            ProcFilesTable.insert({'series_title': 'Series 1', 'chapter_number': number})
+            TaskQueueTable.acknowledge(event)
+
+        round_trips = sum(table._database.round_trips for table in tables)
+        seconds = timed(chapter, options.repeat)
+        round_trips = (sum(table._database.round_trips for table in tables) - round_trips) / options.repeat
+        report(backend, seconds, f'({round_trips:.0f} queries per chapter)')
+
+    Database.stop_writer()
+    sqlite.client.close()
+    directory.cleanup()
+
+
+@benchmark
+def filename_parsing(options):
+    """
+    Compares the throughput of the old file_renamer, which compiled its patterns on every call, with the precompiled
+    parser over the test corpus of FMD filenames.
+    """
+    from MangaTaggerLib.filename_parser import parse_filename, parse_filenames
+    from tests.filenames import corpus, legacy_file_renamer
+
+    filenames = list(corpus())
+    directories = {}
+    for filename, manga_title in filenames:
+        directories.setdefault(manga_title, []).append(filename)
+
+    def parse_each(parse):
+        for filename, manga_title in filenames:
+            try:
+                parse(filename, manga_title)
+            except AttributeError:
+                pass
+
+    def parse_directories():
+        for manga_title, directory in directories.items():
+            parse_filenames(directory, manga_title)
+
+    for name, parse_all in (('legacy file_renamer', lambda: parse_each(legacy_file_renamer)),
+                            ('parse_filename', lambda: parse_each(parse_filename)),
+                            ('parse_filenames', parse_directories)):
+        seconds = timed(parse_all, max(1, options.repeat // 100))
+        report(name, seconds / len(filenames), f'({len(filenames) / seconds:,.0f} files/s)')
+
+
+@benchmark
+def title_matching(options):
+    """
+    Compares scoring 50 AniList results with 10 synonyms each one compare() call at a time against TitleScorer, for a
+    query that matches the last synonym and one that matches nothing.
+    """
+    import random
+
+    # MangaTaggerLib must be imported before utils to resolve their circular import
+    from MangaTaggerLib import MangaTaggerLib
+    from MangaTaggerLib.utils import TitleScorer, compare
+
+    rng = random.Random(0)
+    words = ['absolute', 'boyfriend', 'peach', 'girl', 'the', 'of', 'kiss', 'no', 'edition', 'chronicles', 'sword',
+             'academy', 'love', 'story', 'x', 'monster', 'my', 'hero']
+
+    def title():
+        return ' '.join(rng.choice(words) for _ in range(rng.randint(1, 6))).title()
+
+    results = [{'id': i, 'title': {'romaji': title(), 'english': title(), 'native': None},
+                'synonyms': [title() for _ in range(10)]} for i in range(50)]
+    results[-1]['synonyms'][-1] = 'Absolute Boyfriend Of The Academy'
+
+    def legacy_match(manga_title):
+        for result in results:
+            titles = [x[1] for x in result["title"].items() if x[1] is not None]
+            [titles.append(x) for x in result["synonyms"]]
+            for candidate in titles:
+                if compare(manga_title, candidate) >= 0.9:
+                    return result
+        return None
+
+    def scorer_match(manga_title):
+        match, _ = TitleScorer(manga_title).first_match(MangaTaggerLib._candidate_titles('AniList', results), 0.9)
+        return match
+
+    for label, manga_title in (('match on last synonym', 'Absolute Boyfriend of the Academy'),
+                               ('no match', 'Zettai Kareshi')):
+        print(f'{label}:')
+        for name, match in (('compare() per title', legacy_match), ('TitleScorer', scorer_match)):
+            report(name, timed(lambda: match(manga_title), options.repeat))
+
+
+@benchmark
+def known_title_matching(options):
+    """
+    Measures matching a folder name against the titles of 5000 known series with 5 synonyms each, for a near-duplicate
+    of a known title and for an unknown series. Either way the alternative was a search of every source.
+    """
+    import random
+    from unittest.mock import patch
+
+    from bson import ObjectId
+
+    from MangaTaggerLib import MangaTaggerLib
+    from MangaTaggerLib.database import TitleIndex
+
+    rng = random.Random(0)
+    syllables = ['ka', 're', 'shi', 'zet', 'tai', 'mo', 'no', 'ga', 'ta', 'ri', 'ken', 'sei', 'ai', 'hi', 'ro', 'kun']
+    words = ['of', 'the', 'no', 'x', 'love', 'story', 'academy', 'monster', 'hero', 'kiss', 'night', 'dragon'] + \
+        [''.join(rng.choice(syllables) for _ in range(rng.randint(1, 4))) for _ in range(2000)]
+
+    def title():
+        return ' '.join(rng.choice(words) for _ in range(rng.randint(1, 6))).title()
+
+    TitleIndex.clear()
+    for _ in range(5000):
+        TitleIndex.add({'_id': ObjectId(), 'series_title': title(), 'synonyms': [title() for _ in range(5)]})
+    TitleIndex.add({'_id': ObjectId(), 'series_title': 'Absolute Boyfriend: Kiss of the Academy'})
+
+    with patch.object(MangaTaggerLib.MetadataTable, 'find_by_id', side_effect=lambda document_id: document_id):
+        for label, manga_title in (('near-duplicate', 'The Absolute Boyfriend - Kiss Of The Academy!'),
+                                   ('typo', 'Absolute Boyfrend Kiss of the Academy'),
+                                   ('unknown series', 'Peach Girl Next')):
+            report(label, timed(lambda: MangaTaggerLib._match_known_title(manga_title, {}), options.repeat),
+                   f'({TitleIndex.size()} titles indexed)')
+    TitleIndex.clear()
+
+
+@benchmark
+def comicinfo_rendering(options):
+    """
+    Compares building and pretty-printing ComicInfo.xml for each of 1000 chapters of one series with filling each
+    chapter into the series' template.
+    """
+    from types import SimpleNamespace
+
+    from MangaTaggerLib import MangaTaggerLib
+
+    metadata = SimpleNamespace(
+        title=None, series_title='Zettai Kareshi', series_title_eng='Absolute Boyfriend', series_title_jap=None,
+        synonyms=['Absolute Boyfriend'], description='Riiko Izawa is unlucky in love. ' * 20, page_count=None,
+        publish_date='2003-05-24', source='AniList',
+        staff={'story': ['Yuu Watase'], 'art': ['Yuu Watase'], 'cover': []}, serializations={'Shoujo Comic': None},
+        genres=['Comedy', 'Romance', 'Sci-Fi'], url='https://anilist.co/manga/30386', scrape_date='2021-01-01')
+    chapters = [(f'Chapter Title {number}', f'{number}') for number in range(1, 1001)]
+
+    def rebuild():
+        for title, number in chapters:
+            MangaTaggerLib._render_comicinfo(MangaTaggerLib._build_comicinfo(metadata, title, number))
+
+    def template():
+        MangaTaggerLib.ComicInfoTemplate.clear()
+        for title, number in chapters:
+            metadata.title = title
+            MangaTaggerLib.construct_comicinfo_xml(metadata, number, {})
+
+    repeat = max(1, options.repeat // 20)
+    for name, render in (('build and pretty-print', rebuild), ('series template', template)):
+        seconds = timed(render, repeat)
+        report(name, seconds / len(chapters), f'({seconds * 1000:.1f} ms per 1000 chapters)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Manga Tagger micro-benchmarks.')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run, from {", ".join(BENCHMARKS)} (default: all)')
+    parser.add_argument('--mongodb', help='HOST:PORT of a MongoDB server to use instead of mongomock')
+    parser.add_argument('--rtt', type=float, default=0.001, help='simulated database round-trip time in seconds')
+    parser.add_argument('--documents', type=int, default=100,
+                        help='documents to load into benchmark collections; mongomock scans them on every query')
+    parser.add_argument('--repeat', type=int, default=200, help='iterations per measurement')
+    options = parser.parse_args()
+    for name in options.names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark "{name}"')
+
+    logging.disable(logging.CRITICAL)
+    for name in options.names or BENCHMARKS:
+        print(f'== {name} ==')
+        BENCHMARKS[name](options)
+
+
+if __name__ == '__main__':
+    main()
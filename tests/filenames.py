@@ -0,0 +1,84 @@
+"""
+A corpus of FMD-style chapter filenames and the file_renamer implementation it was checked against, used to prove the
+precompiled parser gives the same results and to benchmark the two.
+"""
+import itertools
+import re
+
+SERIES = ['Peach Girl', 'Absolute Boyfriend', 'G-Maru Edition', 'Watch Dogs', 'The Archer', 'Volcano Chronicles',
+          'Act Of God', 'Choir', '100 Ways', 'Ichigo 100%', 'Kiss.Chapter', '']
+CHAPTERS = ['Chapter {n}', 'chapter {n}', 'CHAPTER{n}', 'Ch.{n}', 'ch. {n}', 'Ch {n}', 'ch{n}', 'Chx{n}', 'Act {n}',
+            'act.{n}', 'Episode {n}', '{n}', 'Oneshot', 'Volume {n}', 'Vol.{n}', 'vol {n}']
+VOLUMES = ['', 'Vol.{v} ', 'Volume {v} ', 'vol {v} ', 'Vol. ', 'Volx{v} ']
+NUMBERS = ['1', '01', '007', '0', '000', '12.5', '3.', '.5', '1.2.3', 'x']
+TITLES = ['', ' ', ' - The Beginning', ': Chapter Two', ' Part 2', ' Ch.3 Extra', ' (Vol 4)', ' Oneshot']
+
+
+def corpus():
+    """
+    Yields (filename, manga_title) pairs covering the delimiters, volume prefixes, chapter numbers and titles FMD
+    produces, with and without a series given by the directory.
+    """
+    for series, chapter, volume, number, title in itertools.product(SERIES, CHAPTERS, VOLUMES, NUMBERS, TITLES):
+        name = volume.format(v=number) + chapter.format(n=number) + title
+        yield f'{series} -.- {name}.cbz', None
+        yield f'{name}.cbz', series or None
+
+
+def legacy_file_renamer(filename, manga_title):
+    """
+    file_renamer before the parser was precompiled, without its logging.
+    """
+    delimiters = ["chapter", "ch.", "ch", "act"]
+    volumedelimiters = ["volume", "vol.", "vol"]
+    filename = filename.replace(".cbz", "").title()
+    if filename.find('-.-') != -1:
+        split_filename = [x.strip() for x in filename.split('-.-')]
+        if split_filename:
+            filename = split_filename[1]
+        else:
+            filename = ""
+        if manga_title is None and split_filename[0]:
+            manga_title = split_filename[0]
+    for x in delimiters:
+        if re.search("([ ]|^)" + x + "([0-9. ])", filename.lower(), flags=re.IGNORECASE):
+            vol_num = None
+            text = re.split(x, filename, maxsplit=1, flags=re.IGNORECASE)
+            for y in volumedelimiters:
+                if re.search("([ ]|^)" + y + "([0-9. ])", text[0], flags=re.IGNORECASE):
+                    volume = re.split(y, text[0], flags=re.IGNORECASE)[1]
+                    vol_num = re.search(r'[\d.]+', volume).group(0)
+                    break
+            chapter_text = text[1].strip()
+            if re.search(r'[\d.]+', chapter_text) is None:
+                continue
+            ch_num = re.search(r'[\d.]+', chapter_text).group(0)
+            ch_num = ch_num.lstrip("0") or "0"
+            chapter_title = re.split(r'[\d.]+', chapter_text, maxsplit=1)[1].strip()
+            if not chapter_title:
+                return [f"Chapter {ch_num}.cbz", ch_num, manga_title]
+            if vol_num:
+                return [f"Vol. {vol_num} Chapter {ch_num}.cbz", ch_num, chapter_title]
+            else:
+                return [f"Chapter {ch_num}.cbz", ch_num, chapter_title]
+
+    if re.search("oneshot", filename, flags=re.IGNORECASE):
+        return [f'{manga_title}.cbz', '0', manga_title]
+
+    for x in volumedelimiters:
+        if re.search("([ ]|^)" + x + "([0-9. ])", filename, flags=re.IGNORECASE):
+            volume = re.split(x, filename, flags=re.IGNORECASE)[1]
+            vol_num = re.search(r'[\d.]+', volume).group(0)
+            volume_title = re.split(r'[\d.]+', filename, maxsplit=1)[1].strip()
+            if not volume_title:
+                return [f"Volume {vol_num}.cbz", vol_num, manga_title]
+            else:
+                return [f"Volume {vol_num}.cbz", vol_num, volume_title]
+
+    if filename.strip().isdigit():
+        return [f'{filename}.cbz', f'{filename}', manga_title]
+
+    if manga_title is None:
+        manga_title = filename
+
+    return ["000.cbz", "0", manga_title]
@@ -0,0 +1,194 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from MangaTaggerLib.api import RateLimiter, HttpSession
+
+
+class FakeClock:
+    """
+    A clock that only moves when told to. Sleeping records the requested delay instead of blocking, so the delays the
+    limiter hands out can be checked exactly.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.sleeps.append(seconds)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+
+    def _limiter(self, limits):
+        return RateLimiter('test', limits, clock=self.clock.time, sleep=self.clock.sleep)
+
+    def test_burst_up_to_limit_does_not_wait(self):
+        """
+        Tests that calls up to the bucket capacity proceed immediately.
+        """
+        limiter = self._limiter([(2, 1)])
+
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_concurrent_callers_are_spaced_exactly(self):
+        """
+        Tests that concurrent callers each wait exactly until their own token is available, rather than all sleeping a
+        fixed amount and waking together.
+        """
+        limiter = self._limiter([(2, 1)])
+
+        threads = [threading.Thread(target=limiter.acquire) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(self.clock.sleeps), [0.5, 1.0, 1.5, 2.0])
+
+    def test_tokens_refill_over_time(self):
+        """
+        Tests that waiting the advertised wait time makes a token available.
+        """
+        limiter = self._limiter([(2, 1)])
+        limiter.acquire()
+        limiter.acquire()
+
+        self.assertEqual(limiter.wait_time(), 0.5)
+
+        self.clock.now += 0.5
+        self.assertEqual(limiter.wait_time(), 0)
+        self.assertEqual(limiter.acquire(), 0)
+
+    def test_strictest_limit_applies(self):
+        """
+        Tests that with per-second and per-minute limits, the per-minute limit takes over once its burst is used up.
+        """
+        limiter = self._limiter([(2, 1), (3, 60)])
+
+        waits = []
+        for _ in range(5):
+            waits.append(limiter.acquire())
+
+        self.assertEqual(waits, [0, 0, 0.5, 20.0, 40.0])
+
+    def test_wait_time_does_not_reserve(self):
+        """
+        Tests that checking the wait time does not consume a token.
+        """
+        limiter = self._limiter([(1, 1)])
+
+        self.assertEqual(limiter.wait_time(), 0)
+        self.assertEqual(limiter.wait_time(), 0)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(limiter.wait_time(), 1.0)
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+    """
+    Keep-alive handler that answers 503 to the first N requests, then 200, after waiting delay seconds.
+    """
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+    delay = 0
+
+    def do_GET(self):
+        time.sleep(LocalHandler.delay)
+        if LocalHandler.failures > 0:
+            LocalHandler.failures -= 1
+            status, body = 503, b'unavailable'
+        else:
+            status, body = 200, b'ok'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpSession(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), LocalHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/'
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        self.backoff_factor = HttpSession.backoff_factor
+        self.pool_size = HttpSession.pool_size
+        self.read_timeout = HttpSession.read_timeout
+        HttpSession.backoff_factor = 0
+        LocalHandler.failures = 0
+        LocalHandler.delay = 0
+        HttpSession.initialize(3)
+
+    def tearDown(self) -> None:
+        HttpSession.backoff_factor = self.backoff_factor
+        HttpSession.read_timeout = self.read_timeout
+        LocalHandler.delay = 0
+        HttpSession.initialize(self.pool_size)
+
+    def test_pool_sized_to_worker_threads(self):
+        """
+        Tests that re-initializing keeps the same session object but resizes its connection pool.
+        """
+        session = HttpSession.session()
+        HttpSession.initialize(6)
+
+        self.assertIs(HttpSession.session(), session)
+        self.assertEqual(session.get_adapter('https://graphql.anilist.co')._pool_maxsize, 6)
+
+    def test_connections_are_reused(self):
+        """
+        Tests that sequential requests to one host reuse a single keep-alive connection and that utilization reports it
+        as idle afterwards.
+        """
+        for _ in range(3):
+            self.assertEqual(HttpSession.get(self.url).text, 'ok')
+
+        stats = HttpSession.pool_utilization()['http://127.0.0.1']
+        self.assertEqual(stats['opened'], 1)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['max'], 3)
+
+    def test_transient_errors_are_retried(self):
+        """
+        Tests that 503 responses are retried transparently.
+        """
+        LocalHandler.failures = 2
+
+        self.assertEqual(HttpSession.get(self.url).status_code, 200)
+        self.assertEqual(LocalHandler.failures, 0)
+
+    def test_session_applies_default_timeout(self):
+        """
+        Tests that requests made on the shared session without a timeout, as jikanpy makes them, still time out.
+        """
+        HttpSession.read_timeout = 0.1
+        LocalHandler.delay = 2
+
+        start = time.monotonic()
+        with self.assertRaises(requests.RequestException):
+            HttpSession.session().get(self.url)
+
+        self.assertLess(time.monotonic() - start, 1.5)
@@ -0,0 +1,288 @@
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.api import AniList
+from MangaTaggerLib.cache import CoverCache, ResponseCache, cached
+from MangaTaggerLib.database import MetadataCache, MetadataTable, TitleIndex
+from MangaTaggerLib.locks import KeyedLock
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeSource:
+    """
+    Stands in for an API client; counts how often the network would have been hit.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    @cached('Fake', ignore=('logging_info',))
+    def search(self, query, logging_info=None):
+        self.calls += 1
+        return [{'title': query.strip()}]
+
+    @cached('Fake')
+    def missing(self, id):
+        self.calls += 1
+        return None
+
+    @cached('Fake')
+    def unknown(self, query):
+        self.calls += 1
+        return []
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name, 'data', 'responses.db')
+        self.clock = FakeClock()
+        ResponseCache.initialize(self.path, {'Fake': 60}, 3, clock=self.clock.time)
+        self.source = FakeSource()
+
+    def tearDown(self) -> None:
+        ResponseCache.close()
+        ResponseCache.ttls = {}
+        ResponseCache.max_entries = 10000
+        self.directory.cleanup()
+
+    def test_repeated_request_is_served_from_cache(self):
+        """
+        Tests that a repeated request, differing only in case, whitespace and ignored arguments, skips the source.
+        """
+        first = self.source.search('Peach Girl', {'id': 1})
+        second = self.source.search('  peach   GIRL ', {'id': 2})
+
+        self.assertEqual(self.source.calls, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(ResponseCache.hits['Fake'], 1)
+        self.assertEqual(ResponseCache.misses['Fake'], 1)
+
+    def test_cache_persists_across_restarts(self):
+        """
+        Tests that responses survive closing and reopening the cache file.
+        """
+        self.source.search('Absolute Boyfriend')
+        ResponseCache.initialize(self.path, {'Fake': 60}, 3, clock=self.clock.time)
+        self.source.search('Absolute Boyfriend')
+
+        self.assertEqual(self.source.calls, 1)
+
+    def test_entries_expire_after_ttl(self):
+        """
+        Tests that an entry older than its source's TTL is fetched again.
+        """
+        self.source.search('G-Maru Edition')
+        self.clock.now += 61
+        self.source.search('G-Maru Edition')
+
+        self.assertEqual(self.source.calls, 2)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """
+        Tests that exceeding max_entries evicts the entry that was read least recently.
+        """
+        for title in ('a', 'b', 'c'):
+            self.source.search(title)
+            self.clock.now += 1
+        self.source.search('a')
+        self.clock.now += 1
+        self.source.search('d')
+
+        self.assertEqual(ResponseCache.size(), 3)
+        self.source.calls = 0
+        self.source.search('a')
+        self.source.search('b')
+        self.assertEqual(self.source.calls, 1)
+
+    def test_none_is_not_cached(self):
+        """
+        Tests that failed lookups returning None are retried rather than cached.
+        """
+        self.source.missing(1)
+        self.source.missing(1)
+
+        self.assertEqual(self.source.calls, 2)
+
+    def test_empty_result_is_not_cached(self):
+        """
+        Tests that searches that found nothing are retried rather than cached for the source's whole TTL.
+        """
+        self.source.unknown('Peach Girl Next')
+        self.source.unknown('Peach Girl Next')
+
+        self.assertEqual(self.source.calls, 2)
+        self.assertEqual(ResponseCache.size(), 0)
+
+    @patch.object(AniList, '_log', logging.getLogger('test'))
+    @patch('MangaTaggerLib.api.AniList._wait_for_rate_limit')
+    @patch('MangaTaggerLib.api.HttpSession')
+    def test_anilist_search_without_results_is_not_cached(self, http_session, _):
+        """
+        Tests that an AniList search that found nothing, which AniList answers with a page of no media, is retried,
+        while one that found the series is cached.
+        """
+        page = {'Page': {'pageInfo': {'total': 0, 'currentPage': 1, 'lastPage': 1, 'hasNextPage': False,
+                                      'perPage': 50}, 'media': []}}
+        http_session.post.return_value.json.return_value = {'data': page}
+
+        for _ in range(3):
+            self.assertEqual(AniList.search('Peach Girl Next', {}), [])
+
+        self.assertEqual(http_session.post.call_count, 3)
+        self.assertEqual(ResponseCache.size(), 0)
+
+        page['Page']['media'] = [{'id': 30386}]
+        for _ in range(2):
+            self.assertEqual(AniList.search('Peach Girl Next', {}), [{'id': 30386}])
+
+        self.assertEqual(http_session.post.call_count, 4)
+
+    def test_uninitialized_cache_passes_through(self):
+        """
+        Tests that the decorated methods call through when no cache has been initialized.
+        """
+        ResponseCache.close()
+        self.source.search('Peach Girl')
+        self.source.search('Peach Girl')
+
+        self.assertEqual(self.source.calls, 2)
+
+
+class TestCoverCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name, 'covers')
+        self.clock = FakeClock()
+        CoverCache.initialize(self.path, 10, clock=self.clock.time)
+
+    def tearDown(self) -> None:
+        CoverCache.close()
+        CoverCache.max_bytes = 256 * 1024 * 1024
+        self.directory.cleanup()
+
+    def test_cover_survives_restart(self):
+        """
+        Tests that a cover is found by source and id after the cache is reopened.
+        """
+        CoverCache.put('AniList', 30386, 'original', b'cover')
+        CoverCache.initialize(self.path, 10, clock=self.clock.time)
+
+        self.assertEqual(CoverCache.get('AniList', '30386', 'original'), b'cover')
+        self.assertIsNone(CoverCache.get('AniList', '30386', 'thumbnail'))
+        self.assertIsNone(CoverCache.get('MAL', '30386', 'original'))
+
+    def test_identical_images_are_stored_once(self):
+        """
+        Tests that covers with the same content share one file and count once towards the size cap.
+        """
+        CoverCache.put('AniList', 1, 'original', b'cover')
+        CoverCache.put('MAL', 2, 'original', b'cover')
+
+        self.assertEqual(CoverCache.size(), 5)
+        self.assertEqual(len(list(self.path.glob('*/*'))), 1)
+
+    def test_least_recently_used_is_evicted(self):
+        """
+        Tests that once the images exceed the size cap, the ones read longest ago are dropped along with their files.
+        """
+        CoverCache.put('AniList', 1, 'original', b'first')
+        self.clock.now += 1
+        CoverCache.put('AniList', 2, 'original', b'other')
+        self.clock.now += 1
+        CoverCache.get('AniList', 1, 'original')
+        self.clock.now += 1
+        CoverCache.put('AniList', 3, 'original', b'third')
+
+        self.assertEqual(CoverCache.get('AniList', 1, 'original'), b'first')
+        self.assertIsNone(CoverCache.get('AniList', 2, 'original'))
+        self.assertEqual(CoverCache.get('AniList', 3, 'original'), b'third')
+        self.assertEqual(CoverCache.size(), 10)
+
+    def test_copy_to(self):
+        """
+        Tests that a cached thumbnail is copied to a series folder, and that a miss leaves the folder alone.
+        """
+        destination = Path(self.directory.name, 'default.jpg')
+
+        self.assertFalse(CoverCache.copy_to('AniList', 1, 'thumbnail', destination))
+        self.assertFalse(destination.exists())
+        CoverCache.put('AniList', 1, 'thumbnail', b'thumb')
+        self.assertTrue(CoverCache.copy_to('AniList', 1, 'thumbnail', destination))
+        self.assertEqual(destination.read_bytes(), b'thumb')
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        MetadataCache.clear()
+        self.addCleanup(MetadataCache.clear)
+        self.addCleanup(setattr, MetadataCache, 'max_size', MetadataCache.max_size)
+
+    def test_titles_are_normalized(self):
+        """
+        Tests that lookups ignore letter case and repeated whitespace.
+        """
+        MetadataCache.put('Peach Girl Next', 'metadata')
+
+        self.assertEqual(MetadataCache.get('  peach  girl NEXT'), 'metadata')
+
+    def test_least_recently_used_series_is_evicted(self):
+        """
+        Tests that the cache stays within max_size by dropping the series used least recently.
+        """
+        MetadataCache.max_size = 2
+        MetadataCache.put('a', 1)
+        MetadataCache.put('b', 2)
+        MetadataCache.get('a')
+        MetadataCache.put('c', 3)
+
+        self.assertEqual(MetadataCache.get('a'), 1)
+        self.assertIsNone(MetadataCache.get('b'))
+        self.assertEqual(MetadataCache.get('c'), 3)
+
+    @patch('MangaTaggerLib.database.Database.insert')
+    def test_insert_invalidates_all_titles(self, insert):
+        """
+        Tests that inserting a newer document drops entries cached under its search value and series titles.
+        """
+        for title in ('Absolute Boyfriend', 'Zettai Kareshi', 'Absolute Boyfriend (Eng)'):
+            MetadataCache.put(title, 'stale')
+        insert.side_effect = lambda data, logging_info: dict(data, _id=1)
+        self.addCleanup(TitleIndex.clear)
+
+        MetadataTable.insert({'search_value': 'Absolute Boyfriend', 'series_title': 'Zettai Kareshi',
+                              'series_title_eng': 'Absolute Boyfriend (Eng)'}, {})
+
+        insert.assert_called_once()
+        for title in ('Absolute Boyfriend', 'Zettai Kareshi', 'Absolute Boyfriend (Eng)'):
+            self.assertIsNone(MetadataCache.get(title))
+
+    @patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_DB_SEARCH', KeyedLock('database search'))
+    @patch('MangaTaggerLib.MangaTaggerLib.ProcSeriesTable')
+    @patch('MangaTaggerLib.MangaTaggerLib.Metadata')
+    @patch('MangaTaggerLib.MangaTaggerLib.MetadataTable')
+    def test_known_series_skips_database(self, table, metadata, processed_series):
+        """
+        Tests that once a series is resolved from the database, later chapters do not read the database at all.
+        """
+        table.search.return_value = {'search_value': 'G-Maru Edition'}
+        metadata.return_value = type('Metadata', (), {})()
+        processed_series.processed_series = set()
+
+        first = MangaTaggerLib.resolve_metadata('G-Maru Edition', {})
+        second = MangaTaggerLib.resolve_metadata('G-Maru Edition', {})
+
+        self.assertIs(first, second)
+        table.search.assert_called_once()
+        metadata.assert_called_once()
@@ -0,0 +1,63 @@
+import itertools
+import logging
+import unittest
+from types import SimpleNamespace
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.MangaTaggerLib import ComicInfoTemplate, construct_comicinfo_xml
+
+
+def series_metadata(**changes):
+    metadata = SimpleNamespace(
+        title=None, series_title='Zettai Kareshi', series_title_eng='Absolute Boyfriend', series_title_jap=None,
+        synonyms=['Absolute Boyfriend'], description='Riiko & Night <3 "robots"', page_count=None,
+        publish_date='2003-05-24', source='AniList',
+        staff={'story': ['Yuu Watase'], 'art': ['Yuu Watase'], 'cover': []}, serializations={'Shoujo Comic': None},
+        genres=['Comedy', 'Romance'], url='https://anilist.co/manga/30386', scrape_date='2021-01-01')
+    for key, value in changes.items():
+        setattr(metadata, key, value)
+    return metadata
+
+
+class TestComicInfoTemplate(unittest.TestCase):
+    titles = [None, '', ' ', 'The Beginning', 'Riiko & Night', '<Vol 1>', 'He said "hi"', "It's", 'a]]>b',
+              'Line\nBreak', 'Carriage\r\nReturn', 'Tab\there', '絶対彼氏', '  padded  ', '&amp;']
+    numbers = ['1', '12.5', '0', '', '&', None]
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        ComicInfoTemplate.clear()
+        self.addCleanup(ComicInfoTemplate.clear)
+
+    def assertRendersAsBefore(self, metadata):
+        for title, number in itertools.product(self.titles, self.numbers):
+            metadata.title = title
+            expected = MangaTaggerLib._render_comicinfo(MangaTaggerLib._build_comicinfo(metadata, title, number))
+            self.assertEqual(construct_comicinfo_xml(metadata, number, {})[0], expected, (title, number))
+
+    def test_output_is_identical(self):
+        """
+        Tests that chapters filled into the series template are byte-identical to building the whole document.
+        """
+        self.assertRendersAsBefore(series_metadata())
+        self.assertRendersAsBefore(series_metadata(source='MangaUpdates', publish_date='2003'))
+        self.assertRendersAsBefore(series_metadata(publish_date=None, synonyms=[], staff={'story': [], 'art': [],
+                                                                                         'cover': ['Yuu Watase']}))
+
+    def test_template_is_built_once_per_series(self):
+        """
+        Tests that every chapter of a series shares one template, and a different series gets its own.
+        """
+        first = ComicInfoTemplate.for_metadata(series_metadata(title='1'))
+
+        self.assertIs(ComicInfoTemplate.for_metadata(series_metadata(title='2')), first)
+        self.assertIsNot(ComicInfoTemplate.for_metadata(series_metadata(series_title='Peach Girl')), first)
+
+    def test_invalid_characters_fail_as_before(self):
+        """
+        Tests that a title XML cannot hold still fails to render, rather than producing a broken document.
+        """
+        metadata = series_metadata(title='Bell\x07')
+
+        with self.assertRaises(Exception):
+            construct_comicinfo_xml(metadata, '1', {})
@@ -0,0 +1,510 @@
+import logging
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import mongomock
+
+# MangaTaggerLib must be imported before task_queue to resolve their circular import
+from MangaTaggerLib import MangaTaggerLib  # noqa: F401
+from MangaTaggerLib.task_queue import QueueEvent, QueueEventOrigin
+
+from MangaTaggerLib.database import Database, MetadataTable, ProcFilesTable, ProcSeriesTable, TaskQueueTable, \
+    TitleIndex
+from MangaTaggerLib.sqlite_store import SQLiteClient
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Points every table at a fresh in-memory mongomock database.
+    """
+    def create_database(self):
+        return mongomock.MongoClient()['manga_tagger']
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.database = self.create_database()
+
+        collections = {
+            'MetadataTable': 'manga_metadata',
+            'ProcFilesTable': 'processed_files',
+            'ProcSeriesTable': 'processed_series',
+            'TaskQueueTable': 'task_queue'
+        }
+        for table in [Database] + Database.tables():
+            self.addCleanup(setattr, table, '_database', table.__dict__.get('_database'))
+            self.addCleanup(setattr, table, '_log', table.__dict__.get('_log'))
+            table._log = logging.getLogger(f'{table.__module__}.{table.__name__}')
+            table._database = self.database[collections[table.__name__]] if table is not Database else self.database
+
+        for setting in ('write_batch_size', 'write_interval'):
+            self.addCleanup(setattr, Database, setting, getattr(Database, setting))
+        self.addCleanup(Database.stop_writer)
+        self.addCleanup(setattr, ProcSeriesTable, 'processed_series', ProcSeriesTable.processed_series)
+        ProcSeriesTable.processed_series = set()
+
+
+class TestIndexes(DatabaseTestCase):
+    def test_declared_indexes_are_created(self):
+        """
+        Tests that create_indexes builds every declared index, after which none are reported missing.
+        """
+        self.assertEqual(len(MetadataTable.missing_indexes()), 3)
+
+        for table in Database.tables():
+            table.create_indexes()
+
+        for table in Database.tables():
+            self.assertEqual(table.missing_indexes(), [])
+
+        index = self.database['processed_files'].index_information()['series_title_1_chapter_number_1']
+        self.assertTrue(index['unique'])
+
+    def test_conflicting_documents_do_not_stop_startup(self):
+        """
+        Tests that a unique index that cannot be built because of duplicate records is reported instead of raised.
+        """
+        record = {'series_title': 'Absolute Boyfriend', 'chapter_number': '001'}
+        self.database['processed_files'].insert_many([dict(record), dict(record)])
+
+        ProcFilesTable.create_indexes()
+
+        self.assertEqual(len(ProcFilesTable.missing_indexes()), 1)
+
+    def test_collection_scans_are_reported(self):
+        """
+        Tests that verify_indexes fails when a lookup's query plan falls back to a collection scan.
+        """
+        for table in Database.tables():
+            table.create_indexes()
+
+        with patch.object(Database, 'query_plans', classmethod(lambda cls: {'[]': ['LIMIT', 'FETCH', 'IXSCAN']})):
+            self.assertTrue(Database.verify_indexes())
+
+        with patch.object(Database, 'query_plans', classmethod(lambda cls: {'[]': ['LIMIT', 'COLLSCAN']})):
+            self.assertFalse(Database.verify_indexes())
+
+
+class TestMetadataSearch(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.collection = self.database['manga_metadata']
+
+    def test_search_is_one_round_trip(self):
+        """
+        Tests that a lookup, hit or miss, issues a single query.
+        """
+        self.collection.insert_one({'search_value': 'Absolute Boyfriend', 'series_title': 'Zettai Kareshi'})
+
+        with patch.object(self.collection, 'find', wraps=self.collection.find) as find:
+            self.assertIsNotNone(MetadataTable.search('Zettai Kareshi'))
+            self.assertIsNone(MetadataTable.search('Peach Girl'))
+
+        self.assertEqual(find.call_count, 2)
+
+    def test_search_key_priority(self):
+        """
+        Tests that a match on search_value beats one on series_title, which beats one on series_title_eng, regardless
+        of insertion order.
+        """
+        self.collection.insert_many([
+            {'name': 'eng', 'search_value': 'a', 'series_title': 'b', 'series_title_eng': 'Peach Girl'},
+            {'name': 'title', 'search_value': 'c', 'series_title': 'Peach Girl', 'series_title_eng': 'd'},
+            {'name': 'value', 'search_value': 'Peach Girl', 'series_title': 'e', 'series_title_eng': 'f'}
+        ])
+
+        self.assertEqual(MetadataTable.search('Peach Girl')['name'], 'value')
+        self.collection.delete_one({'name': 'value'})
+        self.assertEqual(MetadataTable.search('Peach Girl')['name'], 'title')
+        self.collection.delete_one({'name': 'title'})
+        self.assertEqual(MetadataTable.search('Peach Girl')['name'], 'eng')
+
+    def test_oldest_document_wins_ties(self):
+        """
+        Tests that when two documents match on the same key, the one inserted first is returned, as find_one did.
+        """
+        self.collection.insert_many([
+            {'name': 'first', 'search_value': 'G-Maru Edition'},
+            {'name': 'second', 'search_value': 'G-Maru Edition'}
+        ])
+
+        self.assertEqual(MetadataTable.search('G-Maru Edition')['name'], 'first')
+
+
+class TestTitleIndex(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.collection = self.database['manga_metadata']
+        self.addCleanup(TitleIndex.clear)
+
+    def test_load_indexes_titles_and_synonyms(self):
+        """
+        Tests that every title and synonym of the stored series can be found by its normalized form.
+        """
+        self.collection.insert_many([
+            {'search_value': 'Absolute Boyfriend', 'series_title': 'Zettai Kareshi', 'series_title_eng': None,
+             'series_title_jap': '絶対彼氏。', 'synonyms': ['Zettai Kareshi: Kanzenban']},
+            {'search_value': 'Peach Girl', 'series_title': 'Peach Girl', 'synonyms': None}
+        ])
+
+        MetadataTable.load()
+
+        absolute_boyfriend = self.collection.find_one({'search_value': 'Absolute Boyfriend'})['_id']
+        for title in ('THE Absolute-Boyfriend', 'zettai kareshi', '絶対彼氏', 'Zettai Kareshi - Kanzenban'):
+            self.assertEqual(TitleIndex.candidates(title)[0][0], absolute_boyfriend)
+
+    def test_insert_updates_index(self):
+        """
+        Tests that a newly inserted series can be matched right away, before its write reaches the database.
+        """
+        Database.write_batch_size = 100
+        Database.write_interval = 60
+        Database.start_writer()
+        MetadataTable.load()
+
+        MetadataTable.insert({'search_value': 'G-Maru Edition', 'series_title': 'G-Maru Edition'}, {})
+
+        document = MangaTaggerLib._match_known_title('G Maru Editon', {})
+        self.assertEqual(document['search_value'], 'G-Maru Edition')
+
+    def test_distant_titles_do_not_match(self):
+        """
+        Tests that a title sharing only a few words with a known series is left for the sources to search.
+        """
+        self.collection.insert_one({'search_value': 'Absolute Boyfriend', 'series_title': 'Absolute Boyfriend'})
+        MetadataTable.load()
+
+        self.assertIsNone(MangaTaggerLib._match_known_title('Absolute Duo', {}))
+        self.assertIsNone(MangaTaggerLib._match_known_title('Peach Girl', {}))
+
+
+class TestWriteBehind(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.collection = self.database['processed_files']
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _record(self, chapter):
+        return {'series_title': 'Absolute Boyfriend', 'chapter_number': chapter}
+
+    def _wait_for(self, count, timeout=2):
+        deadline = time.monotonic() + timeout
+        while self.collection.count_documents({}) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.collection.count_documents({})
+
+    def test_processed_file_records_are_written(self):
+        """
+        Tests that renaming a chapter records it in processed_files, which previously failed on a non-existent method.
+        """
+        old_file = Path(self.directory.name, 'Absolute Boyfriend -.- Absolute Boyfriend 01 Lover Shop.cbz')
+        old_file.touch()
+        new_file = Path(self.directory.name, 'Absolute Boyfriend 001.cbz')
+
+        ProcFilesTable.insert_record_and_rename(old_file, new_file, 'Absolute Boyfriend', '001', {})
+
+        self.assertTrue(new_file.exists())
+        self.assertEqual(self.collection.find_one({'chapter_number': '001'})['new_filename'], new_file.name)
+
+    def test_writes_are_batched_by_size(self):
+        """
+        Tests that buffered writes wait until a full batch is pending, while searches still see them.
+        """
+        Database.write_batch_size = 3
+        Database.write_interval = 60
+        Database.start_writer()
+
+        ProcFilesTable.insert(self._record('001'))
+        ProcFilesTable.insert(self._record('002'))
+
+        self.assertEqual(self.collection.count_documents({}), 0)
+        self.assertIsNotNone(ProcFilesTable.search('Absolute Boyfriend', '002'))
+
+        ProcFilesTable.insert(self._record('003'))
+
+        self.assertEqual(self._wait_for(3), 3)
+
+    def test_bad_record_does_not_fail_its_batch(self):
+        """
+        Tests that a record the database cannot store is rejected when it is queued, and the rest of its batch is
+        still written.
+        """
+        Database.write_interval = 60
+        Database.start_writer()
+
+        ProcFilesTable.insert(self._record('001'))
+        rejected = ProcFilesTable.insert({'staff': {'Yuu.Watase': ['story']}})
+        unencodable = ProcFilesTable.insert({'series_title': object()})
+        ProcFilesTable.insert(self._record('002'))
+        Database.stop_writer()
+
+        self.assertIsNone(rejected)
+        self.assertIsNone(unencodable)
+        self.assertEqual(sorted(result['chapter_number'] for result in self.collection.find()), ['001', '002'])
+
+    def test_writes_are_flushed_by_interval_and_on_stop(self):
+        """
+        Tests that a partial batch is written once the interval passes, and everything left is written on stop.
+        """
+        Database.write_batch_size = 100
+        Database.write_interval = 0.05
+        Database.start_writer()
+
+        ProcFilesTable.insert(self._record('001'))
+        self.assertEqual(self._wait_for(1), 1)
+
+        Database.write_interval = 60
+        ProcFilesTable.insert(self._record('002'))
+        Database.stop_writer()
+
+        self.assertEqual(self.collection.count_documents({}), 2)
+
+    def test_failed_documents_are_reported_individually(self):
+        """
+        Tests that a document rejected in a bulk write is logged with its own logging info and does not stop the rest.
+        """
+        ProcFilesTable.create_indexes()
+        Database.write_interval = 60
+        Database.start_writer()
+
+        ProcFilesTable.insert(self._record('001'), {'event_id': 1})
+        ProcFilesTable.insert(self._record('001'), {'event_id': 2})
+        ProcFilesTable.insert(self._record('002'), {'event_id': 3})
+
+        logging.disable(logging.NOTSET)
+        with self.assertLogs('MangaTaggerLib.database.ProcFilesTable', logging.ERROR) as logs:
+            Database.flush()
+
+        self.assertEqual(self.collection.count_documents({}), 2)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].event_id, 2)
+
+
+class TestProcessedSeries(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.collection = self.database['processed_series']
+        ProcSeriesTable.create_indexes()
+
+    def test_series_are_persisted_individually(self):
+        """
+        Tests that adding a series writes one document for it straight away, and adding it again writes nothing.
+        """
+        ProcSeriesTable.add('Absolute Boyfriend')
+        ProcSeriesTable.add('Absolute Boyfriend')
+        ProcSeriesTable.add('G-Maru Edition')
+
+        self.assertEqual(sorted(self.collection.distinct('series_title')), ['Absolute Boyfriend', 'G-Maru Edition'])
+        self.assertEqual(self.collection.count_documents({}), 2)
+
+    def test_load_reads_every_series(self):
+        """
+        Tests that loading rebuilds the in-memory set from the per-series documents.
+        """
+        self.collection.insert_many([{'series_title': 'Absolute Boyfriend'}, {'series_title': 'Peach Girl Next'}])
+
+        ProcSeriesTable.load()
+
+        self.assertEqual(ProcSeriesTable.processed_series, {'Absolute Boyfriend', 'Peach Girl Next'})
+
+    def test_legacy_document_is_migrated(self):
+        """
+        Tests that the old single document holding every series as a key is split into per-series documents.
+        """
+        self.collection.insert_one({'Absolute Boyfriend': True, 'G-Maru Edition': True})
+        self.collection.insert_one({'series_title': 'G-Maru Edition'})
+
+        ProcSeriesTable.load()
+
+        self.assertEqual(ProcSeriesTable.processed_series, {'Absolute Boyfriend', 'G-Maru Edition'})
+        self.assertEqual(self.collection.count_documents({}), 2)
+        self.assertEqual(self.collection.count_documents({'series_title': {'$exists': False}}), 0)
+
+
+class TestTaskJournal(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.collection = self.database['task_queue']
+
+    def _event(self, name):
+        return QueueEvent(Path('downloads', 'Absolute Boyfriend', name), QueueEventOrigin.SCAN)
+
+    def test_event_lifecycle(self):
+        """
+        Tests that an event is journaled as queued, marked in progress, and removed once acknowledged.
+        """
+        event = self._event('Chapter 1.cbz')
+
+        TaskQueueTable.append(event)
+        self.assertEqual(self.collection.find_one({'_id': event.journal_id})['status'], TaskQueueTable.QUEUED)
+
+        TaskQueueTable.mark_in_progress(event)
+        self.assertEqual(self.collection.find_one({'_id': event.journal_id})['status'], TaskQueueTable.IN_PROGRESS)
+
+        TaskQueueTable.acknowledge(event)
+        self.assertEqual(self.collection.count_documents({}), 0)
+
+    def test_lifecycle_in_one_batch(self):
+        """
+        Tests that an event appended, started and acknowledged within one buffered batch leaves nothing behind, while
+        an unacknowledged one stays journaled.
+        """
+        Database.write_interval = 60
+        Database.start_writer()
+        finished = self._event('Chapter 1.cbz')
+        unfinished = self._event('Chapter 2.cbz')
+
+        for event in (finished, unfinished):
+            TaskQueueTable.append(event)
+            TaskQueueTable.mark_in_progress(event)
+        TaskQueueTable.acknowledge(finished)
+        Database.stop_writer()
+
+        self.assertEqual([result['manga_chapter'] for result in self.collection.find()], ['Chapter 2'])
+
+    def test_unacknowledged_events_are_replayed_in_order(self):
+        """
+        Tests that loading returns every unacknowledged event, queued or interrupted, and that replayed events keep
+        their journal entry instead of being appended again.
+        """
+        events = [self._event(f'Chapter {i}.cbz') for i in range(3)]
+        for event in events:
+            TaskQueueTable.append(event)
+        TaskQueueTable.mark_in_progress(events[1])
+
+        task_list = {}
+        TaskQueueTable.load(task_list)
+
+        self.assertEqual([task['manga_chapter'] for task in task_list.values()],
+                         ['Chapter 0', 'Chapter 1', 'Chapter 2'])
+        replayed = QueueEvent(task_list[events[1].journal_id], QueueEventOrigin.FROM_DB)
+        self.assertEqual(replayed.journal_id, events[1].journal_id)
+
+        TaskQueueTable.append(replayed)
+        self.assertEqual(self.collection.count_documents({}), 3)
+
+    def test_appends_are_written_immediately(self):
+        """
+        Tests that journal appends and in-progress marks reach the database without waiting for the write-behind
+        buffer, so a crash right after a chapter arrives cannot lose it.
+        """
+        Database.write_interval = 60
+        Database.start_writer()
+        self.addCleanup(Database.stop_writer)
+        event = self._event('Chapter 1.cbz')
+
+        TaskQueueTable.append(event)
+        self.assertEqual(self.collection.find_one({'_id': event.journal_id})['status'], TaskQueueTable.QUEUED)
+
+        TaskQueueTable.mark_in_progress(event)
+        self.assertEqual(self.collection.find_one({'_id': event.journal_id})['status'], TaskQueueTable.IN_PROGRESS)
+
+    def test_interrupted_events_are_replayed_a_limited_number_of_times(self):
+        """
+        Tests that each replay of an interrupted event is counted, and that one interrupted more than max_replays times
+        is dropped instead of being replayed again.
+        """
+        self.addCleanup(setattr, TaskQueueTable, 'max_replays', TaskQueueTable.max_replays)
+        TaskQueueTable.max_replays = 2
+        event = self._event('Chapter 1.cbz')
+        TaskQueueTable.append(event)
+
+        for replays in (1, 2):
+            TaskQueueTable.mark_in_progress(event)
+            task_list = {}
+            TaskQueueTable.load(task_list)
+
+            self.assertEqual(task_list[event.journal_id]['replays'], replays)
+            self.assertEqual(self.collection.find_one({'_id': event.journal_id})['status'], TaskQueueTable.QUEUED)
+
+        TaskQueueTable.mark_in_progress(event)
+        task_list = {}
+        TaskQueueTable.load(task_list)
+
+        self.assertEqual(task_list, {})
+        self.assertEqual(self.collection.count_documents({}), 0)
+
+    def test_same_chapter_name_in_two_series(self):
+        """
+        Tests that chapters with the same filename in different series are each replayed, under their full path.
+        """
+        events = [QueueEvent(Path('downloads', series, 'Ch. 001.cbz'), QueueEventOrigin.SCAN)
+                  for series in ('Absolute Boyfriend', 'Peach Girl')]
+        for event in events:
+            TaskQueueTable.append(event)
+
+        task_list = {}
+        TaskQueueTable.load(task_list)
+
+        self.assertEqual(sorted(task['src_path'] for task in task_list.values()),
+                         sorted(str(event.src_path.absolute()) for event in events))
+        self.assertEqual({task['manga_chapter'] for task in task_list.values()}, {'Ch. 001'})
+
+    def test_chapter_name_keeps_its_letters(self):
+        """
+        Tests that only the extension is dropped from the journaled chapter name.
+        """
+        self.assertEqual(self._event('b.cbz').dictionary()['manga_chapter'], 'b')
+        self.assertEqual(self._event('Ch. 1c.cbz').dictionary()['manga_chapter'], 'Ch. 1c')
+
+
+class SQLiteBackend:
+    """
+    Runs a DatabaseTestCase against the embedded SQLite backend instead of mongomock.
+    """
+    def create_database(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        client = SQLiteClient(Path(directory.name, 'manga_tagger.db'))
+        self.addCleanup(client.close)
+        return client['manga_tagger']
+
+
+class TestIndexesSQLite(SQLiteBackend, TestIndexes):
+    def test_query_plans_use_indexes(self):
+        """
+        Tests that SQLite's real query plans scan the collection before the indexes exist and use them afterwards.
+        """
+        self.assertFalse(Database.verify_indexes())
+
+        for table in Database.tables():
+            table.create_indexes()
+
+        self.assertTrue(Database.verify_indexes())
+        self.assertIn('IXSCAN', MetadataTable.query_plans()["['series_title_eng']"])
+
+
+class TestMetadataSearchSQLite(SQLiteBackend, TestMetadataSearch):
+    pass
+
+
+class TestTitleIndexSQLite(SQLiteBackend, TestTitleIndex):
+    pass
+
+
+class TestWriteBehindSQLite(SQLiteBackend, TestWriteBehind):
+    pass
+
+
+class TestProcessedSeriesSQLite(SQLiteBackend, TestProcessedSeries):
+    pass
+
+
+class TestTaskJournalSQLite(SQLiteBackend, TestTaskJournal):
+    def test_journal_survives_reopening(self):
+        """
+        Tests that journaled events are still there after the database file is closed and opened again.
+        """
+        event = self._event('Chapter 1.cbz')
+        TaskQueueTable.append(event)
+
+        client = SQLiteClient(self.database.client.path)
+        self.addCleanup(client.close)
+        task_list = {}
+        TaskQueueTable._database = client['manga_tagger']['task_queue']
+        TaskQueueTable.load(task_list)
+
+        self.assertEqual(task_list[event.journal_id]['manga_chapter'], 'Chapter 1')
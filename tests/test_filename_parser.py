@@ -0,0 +1,131 @@
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.filename_parser import parse_filename, parse_filenames
+from MangaTaggerLib.utils import AppSettings
+from tests.filenames import corpus, legacy_file_renamer
+
+
+def outcome(function, *args):
+    try:
+        return function(*args)
+    except Exception as e:
+        return type(e)
+
+
+class TestFilenameParser(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+    def test_matches_legacy_file_renamer(self):
+        """
+        Tests that the precompiled parser renames every filename in the corpus exactly as the old file_renamer did,
+        including the filenames it failed on.
+        """
+        mismatches = []
+        for filename, manga_title in corpus():
+            expected = outcome(legacy_file_renamer, filename, manga_title)
+            actual = outcome(lambda *args: parse_filename(*args).as_list(), filename, manga_title)
+            if actual != expected:
+                mismatches.append((filename, manga_title, expected, actual))
+
+        self.assertEqual(mismatches, [])
+
+    def test_result_is_structured(self):
+        """
+        Tests that the parsed result names its parts.
+        """
+        parsed = parse_filename('Peach Girl -.- Vol.2 Ch.012 - The Beginning.cbz')
+
+        self.assertEqual(parsed.kind, 'chapter')
+        self.assertEqual(parsed.series, 'Peach Girl')
+        self.assertEqual(parsed.volume, '2')
+        self.assertEqual(parsed.chapter_number, '12')
+        self.assertEqual(parsed.title, '- The Beginning')
+        self.assertEqual(parsed.new_filename, 'Vol. 2 Chapter 12.cbz')
+
+    def test_file_renamer_records_unparsable_filename(self):
+        """
+        Tests that file_renamer still returns a list and records the filename when nothing could be parsed from it.
+        """
+        logging_info = {}
+
+        result = MangaTaggerLib.file_renamer('Extras.cbz', 'Peach Girl', logging_info)
+
+        self.assertEqual(result, ['000.cbz', '0', 'Peach Girl'])
+        self.assertEqual(logging_info['new_filename'], 'Extras')
+
+
+class TestParseFilenames(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+    def test_batch_matches_single_parses(self):
+        """
+        Tests that a batch gives the same records as parsing each filename alone, with None for unparsable names.
+        """
+        filenames = ['Chapter 001.cbz', 'Vol. Chapter 2.cbz', 'Vol.3 Ch.004 Homecoming.cbz', 'Oneshot.cbz']
+
+        parsed = parse_filenames(filenames, 'Peach Girl')
+
+        self.assertIsNone(parsed[1])
+        for filename, chapter in zip(filenames[:1] + filenames[2:], parsed[:1] + parsed[2:]):
+            self.assertEqual(chapter.as_list(), parse_filename(filename, 'Peach Girl').as_list())
+        self.assertEqual(parsed[2].volume, '3')
+        self.assertEqual(parsed[2].chapter_title, 'Homecoming')
+
+    def test_records_are_compact(self):
+        """
+        Tests that parsed records carry no per-instance dictionary.
+        """
+        self.assertFalse(hasattr(parse_filename('Chapter 1.cbz'), '__dict__'))
+
+    @patch('MangaTaggerLib.utils.QueueWorker')
+    def test_scan_queues_parsed_chapters(self, queue_worker):
+        """
+        Tests that the startup scan parses each series directory in one pass and hands the records to the queue.
+        """
+        download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(download_dir.cleanup)
+        series_dir = Path(download_dir.name, 'Peach Girl')
+        series_dir.mkdir()
+        for filename in ('Chapter 1.cbz', 'Vol. Chapter 2.cbz'):
+            Path(series_dir, filename).touch()
+        Path(download_dir.name, 'Absolute Boyfriend -.- Chapter 3.cbz').touch()
+        queue_worker.download_dir = Path(download_dir.name)
+        queue_worker.task_list = {}
+        self.addCleanup(setattr, AppSettings, '_log', AppSettings._log)
+        AppSettings._log = logging.getLogger('test')
+
+        AppSettings._scan_download_dir()
+
+        queued = {call.args[0].name: call.args[1] for call in queue_worker.add_to_task_queue.call_args_list}
+        self.assertEqual(sorted(queued), ['Absolute Boyfriend -.- Chapter 3.cbz', 'Chapter 1.cbz'])
+        self.assertEqual(queued['Chapter 1.cbz'].series, 'Peach Girl')
+        self.assertEqual(queued['Absolute Boyfriend -.- Chapter 3.cbz'].series, 'Absolute Boyfriend')
+
+    @patch('MangaTaggerLib.utils.QueueWorker')
+    def test_scan_skips_replayed_chapters_by_path(self, queue_worker):
+        """
+        Tests that a chapter replayed from the journal only hides itself from the scan, not same-named chapters of
+        other series.
+        """
+        download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(download_dir.cleanup)
+        for series in ('Peach Girl', 'Absolute Boyfriend'):
+            Path(download_dir.name, series).mkdir()
+            Path(download_dir.name, series, 'Ch. 001.cbz').touch()
+        replayed = Path(download_dir.name, 'Peach Girl', 'Ch. 001.cbz').absolute()
+        queue_worker.download_dir = Path(download_dir.name)
+        queue_worker.task_list = {1: {'src_path': str(replayed), 'manga_chapter': 'Ch. 001'}}
+        self.addCleanup(setattr, AppSettings, '_log', AppSettings._log)
+        AppSettings._log = logging.getLogger('test')
+
+        AppSettings._scan_download_dir()
+
+        queued = [call.args[0].absolute() for call in queue_worker.add_to_task_queue.call_args_list]
+        self.assertEqual(queued, [Path(download_dir.name, 'Absolute Boyfriend', 'Ch. 001.cbz').absolute()])
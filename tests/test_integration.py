@@ -5,6 +5,8 @@ from pathlib import Path
 from unittest.mock import patch
 
 from MangaTaggerLib.api import AniList
+from MangaTaggerLib.database import MetadataCache
+from MangaTaggerLib.locks import KeyedLock
 from MangaTaggerLib.MangaTaggerLib import metadata_tagger, construct_comicinfo_xml
 from MangaTaggerLib.models import Metadata
 from tests.database import MetadataTable as MetadataTableTest
@@ -21,6 +23,7 @@ class TestMetadata(unittest.TestCase):
     def setUp(self) -> None:
         logging.disable(logging.CRITICAL)
         AniList.initialize()
+        MetadataCache.clear()
 
         patch1 = patch('MangaTaggerLib.models.AppSettings')
         self.models_AppSettings = patch1.start()
@@ -30,11 +33,9 @@ class TestMetadata(unittest.TestCase):
         patch2 = patch('MangaTaggerLib.MangaTaggerLib.MetadataTable')
         self.MetadataTable = patch2.start()
         self.addCleanup(patch2.stop)
-        self.MetadataTable.search_by_search_value = MetadataTableTest.search_return_no_results
-        self.MetadataTable.search_by_series_title = MetadataTableTest.search_return_no_results
-        self.MetadataTable.search_by_series_title_eng = MetadataTableTest.search_return_no_results
+        self.MetadataTable.search = MetadataTableTest.search_return_no_results
 
-        patch3 = patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_DB_SEARCH', new_callable=list)
+        patch3 = patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_DB_SEARCH', KeyedLock('database search'))
         self.CURRENTLY_PENDING_DB_SEARCH = patch3.start()
         self.addCleanup(patch3.stop)
 
@@ -90,7 +91,7 @@ class TestMetadata(unittest.TestCase):
     def test_metadata_case_1(self):
         title = 'Absolute Boyfriend'
 
-        self.CURRENTLY_PENDING_DB_SEARCH.append(title)
+        self.CURRENTLY_PENDING_DB_SEARCH.acquire(title)
 
         self.MangaTaggerLib_AppSettings.mode_settings = { 'write_comicinfo': False }
 
@@ -108,7 +109,7 @@ class TestMetadata(unittest.TestCase):
     def test_metadata_case_2(self):
         title = 'Peach Girl Next [EN]'
 
-        self.CURRENTLY_PENDING_DB_SEARCH.append(title)
+        self.CURRENTLY_PENDING_DB_SEARCH.acquire(title)
 
         self.MangaTaggerLib_AppSettings.mode_settings = { 'write_comicinfo': False }
 
@@ -127,7 +128,7 @@ class TestMetadata(unittest.TestCase):
         actual_title = 'G-Maru Edition'
         downloaded_title = '(G) Edition'
 
-        self.CURRENTLY_PENDING_DB_SEARCH.append(downloaded_title)
+        self.CURRENTLY_PENDING_DB_SEARCH.acquire(downloaded_title)
 
         self.MangaTaggerLib_AppSettings.mode_settings = { 'write_comicinfo': False }
 
@@ -146,7 +147,7 @@ class TestMetadata(unittest.TestCase):
         actual_title = 'Absolute Boyfriend'
         downloaded_title = 'Boyfriend'
 
-        self.CURRENTLY_PENDING_DB_SEARCH.append(downloaded_title)
+        self.CURRENTLY_PENDING_DB_SEARCH.acquire(downloaded_title)
 
         self.MangaTaggerLib_AppSettings.mode_settings = { 'write_comicinfo': False }
 
@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from MangaTaggerLib import language
+from MangaTaggerLib.language import detect_language
+
+
+class TestDetectLanguage(unittest.TestCase):
+    def setUp(self) -> None:
+        detect_language.cache_clear()
+        self.addCleanup(detect_language.cache_clear)
+
+    def test_native_titles_by_script(self):
+        """
+        Tests that native titles are placed by the script they are written in.
+        """
+        self.assertEqual(detect_language('進撃の巨人'), 'ja')
+        self.assertEqual(detect_language('ピーチガール'), 'ja')
+        self.assertEqual(detect_language('나 혼자만 레벨업'), 'ko')
+        self.assertEqual(detect_language('全职高手'), 'zh')
+
+    def test_romaji_and_english_titles(self):
+        """
+        Tests that Latin-script titles are told apart by how much of them reads as romaji.
+        """
+        for title in ('Zettai Kareshi', 'Shingeki no Kyojin', 'Kaguya-sama wa Kokurasetai', 'Shōnen Onmyōji'):
+            self.assertEqual(detect_language(title), 'ja', title)
+        for title in ('Absolute Boyfriend', 'Attack on Titan', 'Peach Girl', 'One Punch-Man', 'Death Note'):
+            self.assertEqual(detect_language(title), 'en', title)
+
+    def test_nothing_to_go_on(self):
+        """
+        Tests that blank and symbol-only titles are not guessed at.
+        """
+        for title in (None, '', '   ', '100%'):
+            self.assertIsNone(detect_language(title))
+
+    def test_fallback_is_only_consulted_once_for_ambiguous_titles(self):
+        """
+        Tests that the fallback is asked only about titles the heuristics cannot place, and only once per title.
+        """
+        fallback = MagicMock(return_value='en')
+        with patch.object(language, 'fallback', fallback):
+            self.assertEqual(detect_language('Zettai Kareshi'), 'ja')
+            self.assertEqual(detect_language('Tokyo Ghoul Re'), 'en')
+            self.assertEqual(detect_language('Tokyo Ghoul Re'), 'en')
+
+        fallback.assert_called_once_with('Tokyo Ghoul Re')
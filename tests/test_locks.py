@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+
+from MangaTaggerLib.locks import KeyedLock
+
+
+class TestKeyedLock(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lock = KeyedLock('test')
+
+    def test_independent_keys(self):
+        """
+        Tests that different keys can be held at the same time.
+        """
+        self.assertTrue(self.lock.acquire('Absolute Boyfriend'))
+        self.assertTrue(self.lock.acquire('Peach Girl Next'))
+        self.assertTrue(self.lock.locked('Absolute Boyfriend'))
+        self.assertTrue(self.lock.locked('Peach Girl Next'))
+
+    def test_waiter_is_woken_on_release(self):
+        """
+        Tests that a thread waiting on a key acquires it as soon as the owner releases it, without polling.
+        """
+        self.lock.acquire('Absolute Boyfriend')
+        acquired_at = []
+
+        def wait():
+            self.lock.acquire('Absolute Boyfriend')
+            acquired_at.append(time.monotonic())
+            self.lock.release('Absolute Boyfriend')
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        time.sleep(0.1)
+        self.assertFalse(acquired_at)
+
+        released_at = time.monotonic()
+        self.lock.release('Absolute Boyfriend')
+        waiter.join(5)
+
+        self.assertLess(acquired_at[0] - released_at, 0.1)
+        self.assertFalse(self.lock.locked('Absolute Boyfriend'))
+
+    def test_timeout(self):
+        """
+        Tests that acquire returns False when the key is not released within the timeout.
+        """
+        self.lock.acquire('Absolute Boyfriend')
+        result = []
+
+        waiter = threading.Thread(target=lambda: result.append(self.lock.acquire('Absolute Boyfriend', timeout=0.1)))
+        waiter.start()
+        waiter.join(5)
+
+        self.assertEqual(result, [False])
+        self.assertTrue(self.lock.locked('Absolute Boyfriend'))
+
+    def test_release_by_non_owner_is_ignored(self):
+        """
+        Tests that only the owning thread can release a key, so cleanup code in other threads cannot steal it.
+        """
+        self.lock.acquire('Absolute Boyfriend')
+
+        other = threading.Thread(target=self.lock.release, args=('Absolute Boyfriend',))
+        other.start()
+        other.join(5)
+
+        self.assertTrue(self.lock.locked('Absolute Boyfriend'))
+        self.assertTrue(self.lock.release('Absolute Boyfriend'))
+        self.assertFalse(self.lock.release('Absolute Boyfriend'))
+
+    def test_mutual_exclusion(self):
+        """
+        Tests that check-then-claim is atomic: concurrent threads never hold the same key at once.
+        """
+        holders = []
+        overlaps = []
+
+        def work():
+            for _ in range(50):
+                self.lock.acquire('Absolute Boyfriend')
+                holders.append(1)
+                if len(holders) > 1:
+                    overlaps.append(1)
+                holders.pop()
+                self.lock.release('Absolute Boyfriend')
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertFalse(overlaps)
+        self.assertFalse(self.lock.locked('Absolute Boyfriend'))
@@ -2,10 +2,9 @@ import logging
 import shutil
 import unittest
 from pathlib import Path
-from typing import List
 from unittest.mock import patch
 
-from MangaTaggerLib.MangaTaggerLib import file_renamer, rename_action
+from MangaTaggerLib.MangaTaggerLib import file_renamer, rename_action, CURRENTLY_PENDING_RENAME
 from MangaTaggerLib.errors import FileAlreadyProcessedError, FileUpdateNotRequiredError
 from tests.database import ProcFilesTable as ProcFilesTableTest
 
@@ -100,17 +99,18 @@ class TestMangaRenameAction(unittest.TestCase):
         shutil.rmtree(self.library_dir)
 
     @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
-    @patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_RENAME', new_callable=list)
-    def test_rename_action_initial(self, CURRENTLY_PENDING_RENAME: List, ProcFilesTable):
+    def test_rename_action_initial(self, ProcFilesTable):
         """
-        Tests for initial file rename when no results are returned from the database. Test should execute without error.
+        Tests for initial file rename when no results are returned from the database. Test should execute without error
+        and release the rename lock.
         """
         self.current_file.touch()
         ProcFilesTable.search = ProcFilesTableTest.search_return_no_results
 
-        CURRENTLY_PENDING_RENAME.append(self.new_file)
+        CURRENTLY_PENDING_RENAME.acquire(self.new_file)
 
         self.assertFalse(rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {}))
+        self.assertFalse(CURRENTLY_PENDING_RENAME.locked(self.new_file))
 
     @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
     def test_rename_action_duplicate(self, ProcFilesTable):
@@ -151,8 +151,7 @@ class TestMangaRenameAction(unittest.TestCase):
             rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {})
 
     @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
-    @patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_RENAME', new_callable=list)
-    def test_rename_action_upgrade(self, CURRENTLY_PENDING_RENAME: List, ProcFilesTable):
+    def test_rename_action_upgrade(self, ProcFilesTable):
         """
         Tests for version in file rename when results are returned from the database. Since the current file is a
         higher version than the exisitng file, test should execute without error.
@@ -161,8 +160,9 @@ class TestMangaRenameAction(unittest.TestCase):
         self.current_file.touch()
 
         self.new_file.touch()
-        CURRENTLY_PENDING_RENAME.append(self.new_file)
+        CURRENTLY_PENDING_RENAME.acquire(self.new_file)
 
         ProcFilesTable.search = ProcFilesTableTest.search_return_results_version
 
-        self.assertFalse(rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {}))
\ No newline at end of file
+        self.assertFalse(rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {}))
+        self.assertFalse(CURRENTLY_PENDING_RENAME.locked(self.new_file))
\ No newline at end of file
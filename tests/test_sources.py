@@ -0,0 +1,220 @@
+import itertools
+import logging
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.utils import TitleScorer, compare
+
+
+class TestSourceSearch(unittest.TestCase):
+    preferences = ["AniList", "MangaUpdates", "MAL", "Fakku", "NHentai"]
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        patch1 = patch('MangaTaggerLib.MangaTaggerLib.preferences', self.preferences)
+        patch1.start()
+        self.addCleanup(patch1.stop)
+
+        self.delays = dict.fromkeys(self.preferences, 0)
+        self.matches = set()
+        self.searched = []
+        self.lock = threading.Lock()
+
+        patch2 = patch('MangaTaggerLib.MangaTaggerLib._search_source', side_effect=self._search_source)
+        patch2.start()
+        self.addCleanup(patch2.stop)
+
+        patch3 = patch('MangaTaggerLib.MangaTaggerLib._match_source', side_effect=self._match_source)
+        patch3.start()
+        self.addCleanup(patch3.stop)
+
+    def _search_source(self, source, manga_title, logging_info):
+        time.sleep(self.delays[source])
+        with self.lock:
+            self.searched.append(source)
+        return [source] if source in self.matches else []
+
+    @staticmethod
+    def _match_source(source, results, manga_title, logging_info, old_file_path=None):
+        return results[0] if results else None
+
+    def test_preferred_source_wins_over_faster_source(self):
+        """
+        Tests that a match from a less preferred source that responds first does not beat a match from a more
+        preferred source.
+        """
+        self.matches = {"AniList", "MAL"}
+        self.delays["AniList"] = 0.3
+
+        self.assertEqual(MangaTaggerLib._search_sources('Absolute Boyfriend', {}), "AniList")
+
+    def test_falls_through_in_preference_order(self):
+        """
+        Tests that the first preferred source with a match is chosen when more preferred sources have no match.
+        """
+        self.matches = {"MAL", "NHentai"}
+
+        self.assertEqual(MangaTaggerLib._search_sources('Absolute Boyfriend', {}), "MAL")
+
+    def test_searches_run_concurrently(self):
+        """
+        Tests that the latency of a search is that of the slowest source rather than the sum of all sources.
+        """
+        self.delays = dict.fromkeys(self.preferences, 0.2)
+
+        start = time.monotonic()
+        self.assertIsNone(MangaTaggerLib._search_sources('Absolute Boyfriend', {}))
+
+        self.assertLess(time.monotonic() - start, 0.2 * len(self.preferences) - 0.1)
+        self.assertCountEqual(self.searched, self.preferences)
+
+    @patch('MangaTaggerLib.MangaTaggerLib.lazy_source_search', True)
+    def test_lazy_search_stops_at_first_match(self):
+        """
+        Tests that lazy searching only queries sources up to and including the first one with a match.
+        """
+        self.matches = {"MangaUpdates", "MAL"}
+
+        self.assertEqual(MangaTaggerLib._search_sources('Absolute Boyfriend', {}), "MangaUpdates")
+        self.assertEqual(self.searched, ["AniList", "MangaUpdates"])
+
+    @patch('MangaTaggerLib.MangaTaggerLib.lazy_source_search', True)
+    def test_lazy_search_matches_eager_choice(self):
+        """
+        Tests that lazy searching chooses the same source as searching every source.
+        """
+        self.matches = {"Fakku", "NHentai"}
+        lazy_choice = MangaTaggerLib._search_sources('Absolute Boyfriend', {})
+
+        with patch('MangaTaggerLib.MangaTaggerLib.lazy_source_search', False):
+            eager_choice = MangaTaggerLib._search_sources('Absolute Boyfriend', {})
+
+        self.assertEqual(lazy_choice, eager_choice)
+
+
+class TestTitleScorer(unittest.TestCase):
+    titles = ['Absolute Boyfriend', 'absolute boyfriend', 'Zettai Kareshi', 'Absolute Boyfriends', 'Boyfriend',
+              'A', '', 'Peach Girl', 'Absolute Boyfriend: The Complete Edition', 'ABSOLUTE BOYFRIEND (2008)']
+
+    def test_scores_match_compare(self):
+        """
+        Tests that the scorer gives exactly the scores compare() does, and never rules out a candidate that would pass.
+        """
+        for query, candidate in itertools.product(self.titles, repeat=2):
+            scorer = TitleScorer(query)
+            self.assertEqual(scorer.score(candidate), compare(query, candidate))
+            for cutoff in (0.8, 0.9):
+                if compare(query, candidate) >= cutoff:
+                    self.assertTrue(scorer.could_reach(candidate, cutoff))
+
+    def test_first_match_keeps_candidate_order(self):
+        """
+        Tests that the first candidate over the cutoff wins even when a later one scores higher, and that the best
+        candidate is reported when nothing matches.
+        """
+        scorer = TitleScorer('Absolute Boyfriend')
+        candidates = list(enumerate(['Peach Girl', 'Absolute Boyfriens', 'Absolute Boyfriend']))
+
+        match, _ = scorer.first_match(candidates, 0.9)
+        self.assertEqual(match[:2], (1, 'Absolute Boyfriens'))
+
+        match, best = scorer.first_match(candidates[:2], 0.99)
+        self.assertIsNone(match)
+        self.assertEqual(best[:2], (1, 'Absolute Boyfriens'))
+
+
+class TestMatchSource(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        self.sources = {source: MagicMock() for source in TestSourceSearch.preferences}
+        patch1 = patch.dict('MangaTaggerLib.MangaTaggerLib.sources', self.sources)
+        patch1.start()
+        self.addCleanup(patch1.stop)
+
+        patch2 = patch('MangaTaggerLib.MangaTaggerLib.Data', side_effect=lambda manga, *args: manga)
+        patch2.start()
+        self.addCleanup(patch2.stop)
+
+    def test_anilist_matches_on_synonyms_in_order(self):
+        """
+        Tests that AniList results are checked title by title, synonyms included, and the first close enough wins.
+        """
+        results = [
+            {'id': 1, 'title': {'romaji': 'Peach Girl', 'english': None}, 'synonyms': ['Momo']},
+            {'id': 2, 'title': {'romaji': 'Zettai Kareshi', 'english': None}, 'synonyms': ['Absolute Boyfriends']},
+            {'id': 3, 'title': {'romaji': 'Absolute Boyfriend', 'english': None}, 'synonyms': []},
+        ]
+        self.sources['AniList'].manga.side_effect = lambda id, logging_info: {'id': id}
+
+        manga = MangaTaggerLib._match_source('AniList', results, 'Absolute Boyfriend', {})
+
+        self.assertEqual(manga['id'], 2)
+
+    def test_nhentai_uses_lower_threshold(self):
+        """
+        Tests that NHentai results only need a score of 0.8 to match, while other sources need 0.9.
+        """
+        results = [{'id': 7, 'mal_id': 7, 'title': 'Absolute Girlfriend'}]
+        self.sources['NHentai'].manga.side_effect = lambda id, title: {'id': id}
+
+        self.assertIsNone(MangaTaggerLib._match_source('MAL', results, 'Absolute Boyfriend', {}))
+        manga = MangaTaggerLib._match_source('NHentai', results, 'Absolute Boyfriend', {}, MagicMock())
+        self.assertEqual(manga['id'], 7)
+
+
+class TestFormattedTitleSearch(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        self.nhentai = MagicMock()
+        self.nhentai.search.return_value = []
+        self.nhentai.manga.side_effect = lambda id, title: {'id': id}
+        patch1 = patch.dict('MangaTaggerLib.MangaTaggerLib.sources', {'NHentai': self.nhentai})
+        patch1.start()
+        self.addCleanup(patch1.stop)
+
+        patch2 = patch('MangaTaggerLib.MangaTaggerLib.Data', side_effect=lambda manga, *args: manga)
+        patch2.start()
+        self.addCleanup(patch2.stop)
+
+    def searched(self):
+        return [call.args[0] for call in self.nhentai.search.call_args_list]
+
+    @patch('MangaTaggerLib.MangaTaggerLib.formatted_search_limit', 100)
+    def test_each_distinct_variant_is_searched_once(self):
+        """
+        Tests that every search is for a different rewritten title, never the unchanged one, and that rewrites in a
+        combination are applied together.
+        """
+        self.assertIsNone(MangaTaggerLib._search_formatted_titles("TheBoy's Diary. Vol -Extra", {}))
+
+        searched = self.searched()
+        self.assertEqual(len(searched), len(set(searched)))
+        self.assertNotIn("TheBoy's Diary. Vol -Extra", searched)
+        self.assertIn("The Boy's Diary Vol Extra", searched)
+        self.assertLess(len(searched), 63)
+
+    @patch('MangaTaggerLib.MangaTaggerLib.formatted_search_limit', 3)
+    def test_searches_are_capped(self):
+        """
+        Tests that no more than formatted_search_limit searches are made for one title.
+        """
+        MangaTaggerLib._search_formatted_titles("TheBoy's Diary. Vol -Extra", {})
+
+        self.assertEqual(self.nhentai.search.call_count, 3)
+
+    def test_stops_at_first_match(self):
+        """
+        Tests that searching stops once a rewritten title finds a close enough result.
+        """
+        self.nhentai.search.side_effect = lambda title: [{'id': 9, 'title': title}]
+
+        manga = MangaTaggerLib._search_formatted_titles('GMaru Edition', {})
+
+        self.assertEqual(manga['id'], 9)
+        self.assertEqual(self.searched(), ['G Maru Edition'])
@@ -0,0 +1,316 @@
+import logging
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# MangaTaggerLib must be imported before task_queue to resolve their circular import
+from MangaTaggerLib import MangaTaggerLib  # noqa: F401
+from queue import Queue
+
+from MangaTaggerLib.MangaTaggerLib import metadata_tagger
+from MangaTaggerLib.errors import MangaNotFoundError
+from MangaTaggerLib.task_queue import QueueWorker, QueueEvent, QueueEventOrigin, FileSettler, SeriesCoalescer
+
+
+class TestQueueWorker(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        self.download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.download_dir.cleanup)
+
+        QueueWorker.download_dir = Path(self.download_dir.name)
+        QueueWorker.threads = 8
+        QueueWorker.max_queue_size = 0
+        QueueWorker.is_library_network_path = False
+        QueueWorker._debug_mode = False
+        QueueWorker.settle_seconds = 0.1
+        self.addCleanup(setattr, QueueWorker, 'settle_seconds', 1)
+
+        # Patched before initialize() so the settler's discard callback is bound to the mock journal
+        patch1 = patch('MangaTaggerLib.task_queue.TaskQueueTable')
+        self.TaskQueueTable = patch1.start()
+        self.addCleanup(patch1.stop)
+
+        patch2 = patch('MangaTaggerLib.task_queue.MangaTaggerLib')
+        self.MangaTaggerLib = patch2.start()
+        self.addCleanup(patch2.stop)
+
+        QueueWorker.initialize()
+
+        for worker in QueueWorker._worker_list:
+            worker.start()
+        QueueWorker._settler.start()
+        QueueWorker._observer.start()
+
+    def tearDown(self) -> None:
+        if not QueueWorker._stop_event.is_set():
+            QueueWorker.exit()
+
+    def _unwatched_chapter(self):
+        # Outside the watched directory, so the observer does not queue the file as well
+        other_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(other_dir.cleanup)
+        return Path(other_dir.name, 'Chapter 1.cbz')
+
+    @staticmethod
+    def _wait_for(mock, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not mock.called and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_idle_workers_do_not_consume_cpu(self):
+        """
+        Tests that idle worker threads block on the queue instead of spinning. Eight idle workers should use only a
+        small fraction of a single core over one second of wall time.
+        """
+        cpu_start = time.process_time()
+        time.sleep(1)
+        cpu_used = time.process_time() - cpu_start
+
+        self.assertLess(cpu_used, 0.1)
+
+    def test_event_is_dispatched(self):
+        """
+        Tests that a blocked worker wakes up and processes an event as soon as it is added to the queue.
+        """
+        QueueWorker._queue.put(QueueEvent(Path(self.download_dir.name, 'missing.cbz'), QueueEventOrigin.SCAN))
+        QueueWorker._queue.join()
+
+        self.MangaTaggerLib.process_manga_chapter.assert_called_once()
+
+    def test_event_is_journaled_and_acknowledged(self):
+        """
+        Tests that an event is journaled when enqueued, marked in progress when dequeued and acknowledged when done.
+        """
+        chapter = self._unwatched_chapter()
+        chapter.touch()
+        event = QueueEvent(chapter, QueueEventOrigin.SCAN)
+        QueueWorker.put(event)
+        self.TaskQueueTable.append.assert_called_once_with(event)
+
+        self._wait_for(self.TaskQueueTable.acknowledge)
+
+        self.MangaTaggerLib.process_manga_chapter.assert_called_once()
+        self.TaskQueueTable.mark_in_progress.assert_called_once_with(event)
+        self.TaskQueueTable.acknowledge.assert_called_once_with(event)
+
+    def test_discarded_event_is_acknowledged(self):
+        """
+        Tests that an event dropped because its file disappeared before settling is acknowledged in the journal.
+        """
+        chapter = self._unwatched_chapter()
+        chapter.touch()
+        event = QueueEvent(chapter, QueueEventOrigin.SCAN)
+        QueueWorker.put(event)
+        chapter.unlink()
+
+        self._wait_for(self.TaskQueueTable.acknowledge)
+
+        self.TaskQueueTable.append.assert_called_once_with(event)
+        self.TaskQueueTable.acknowledge.assert_called_once_with(event)
+        self.MangaTaggerLib.process_manga_chapter.assert_not_called()
+
+    def test_exit_joins_workers(self):
+        """
+        Tests that exit() wakes every blocked worker and joins them without waiting on queue timeouts.
+        """
+        QueueWorker.poll_timeout = 60
+        self.addCleanup(setattr, QueueWorker, 'poll_timeout', 1)
+
+        exit_start = time.monotonic()
+        QueueWorker.exit()
+
+        self.assertLess(time.monotonic() - exit_start, 5)
+        self.assertFalse(any(worker.is_alive() for worker in QueueWorker._worker_list))
+
+
+class TestFileSettler(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        self.download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.download_dir.cleanup)
+
+        self.queue = Queue()
+        self.discarded = []
+        self.settler = FileSettler(self.queue, settle_seconds=0.2, discard=self.discarded.append)
+        self.settler.start()
+        self.addCleanup(self.settler.stop)
+
+    def test_stable_file_is_dispatched(self):
+        """
+        Tests that a file which does not change is handed to the queue after the settle time.
+        """
+        chapter = Path(self.download_dir.name, 'Chapter 1.cbz')
+        chapter.write_bytes(b'0' * 16)
+
+        self.settler.put(QueueEvent(chapter, QueueEventOrigin.SCAN))
+
+        self.assertEqual(self.queue.get(timeout=5).src_path, chapter)
+        self.assertEqual(self.settler.pending_count(), 0)
+
+    def test_growing_file_is_held_until_stable(self):
+        """
+        Tests that a file that is still being written to is not dispatched until it stops growing, and that no worker
+        is needed while it is held.
+        """
+        chapter = Path(self.download_dir.name, 'Chapter 1.cbz')
+        chapter.write_bytes(b'0')
+        self.settler.put(QueueEvent(chapter, QueueEventOrigin.SCAN))
+
+        stop_writing = threading.Event()
+
+        def write():
+            while not stop_writing.wait(0.05):
+                with open(chapter, 'ab') as file:
+                    file.write(b'0')
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.6)
+        self.assertTrue(self.queue.empty())
+
+        stop_writing.set()
+        writer.join()
+
+        self.assertEqual(self.queue.get(timeout=5).src_path, chapter)
+
+    def test_missing_file_is_dropped(self):
+        """
+        Tests that a file deleted before it settles is not dispatched.
+        """
+        chapter = Path(self.download_dir.name, 'Chapter 1.cbz')
+        chapter.touch()
+        event = QueueEvent(chapter, QueueEventOrigin.SCAN)
+        self.settler.put(event)
+        chapter.unlink()
+
+        time.sleep(0.6)
+
+        self.assertTrue(self.queue.empty())
+        self.assertEqual(self.settler.pending_count(), 0)
+        self.assertEqual(self.discarded, [event])
+
+    def test_replaced_event_is_discarded(self):
+        """
+        Tests that a newer event for a pending path replaces the older one, which is reported as discarded.
+        """
+        chapter = Path(self.download_dir.name, 'Chapter 1.cbz')
+        chapter.touch()
+        first = QueueEvent(chapter, QueueEventOrigin.SCAN)
+        second = QueueEvent(chapter, QueueEventOrigin.SCAN)
+        self.settler.put(first)
+        self.settler.put(second)
+
+        self.assertIs(self.queue.get(timeout=5), second)
+        self.assertEqual(self.discarded, [first])
+
+    def test_stop_returns_pending_events(self):
+        """
+        Tests that events for files that have not settled are returned when the settler is stopped.
+        """
+        self.settler.settle_seconds = 60
+        chapter = Path(self.download_dir.name, 'Chapter 1.cbz')
+        chapter.touch()
+        event = QueueEvent(chapter, QueueEventOrigin.SCAN)
+        self.settler.put(event)
+
+        self.assertEqual(self.settler.stop(), [event])
+
+
+class TestSeriesCoalescer(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        self.download_dir = Path('downloads')
+        self.queue = Queue()
+        self.coalescer = SeriesCoalescer(self.queue, self.download_dir)
+
+    def _event(self, *parts):
+        return QueueEvent(Path(self.download_dir, *parts), QueueEventOrigin.SCAN)
+
+    def test_chapters_of_a_series_share_a_batch(self):
+        """
+        Tests that every chapter queued for a series directory shares one batch, and that each is still queued on its
+        own so chapters can be processed in parallel.
+        """
+        events = [self._event('Absolute Boyfriend', f'Chapter {x}.cbz') for x in range(3)]
+        other = self._event('Peach Girl Next', 'Chapter 1.cbz')
+
+        for event in events + [other]:
+            self.coalescer.put(event)
+
+        self.assertEqual(self.queue.qsize(), 4)
+        self.assertTrue(all(event.batch is events[0].batch for event in events))
+        self.assertEqual(events[0].batch.pending, 3)
+        self.assertIsNot(other.batch, events[0].batch)
+
+    def test_batch_ends_with_last_chapter(self):
+        """
+        Tests that a batch is discarded once its last chapter finishes, so later downloads start a fresh batch.
+        """
+        first = self._event('Absolute Boyfriend', 'Chapter 1.cbz')
+        second = self._event('Absolute Boyfriend', 'Chapter 2.cbz')
+        self.coalescer.put(first)
+        self.coalescer.put(second)
+
+        self.coalescer.finish(first)
+        self.coalescer.finish(second)
+
+        later = self._event('Absolute Boyfriend', 'Chapter 3.cbz')
+        self.coalescer.put(later)
+
+        self.assertIsNot(later.batch, first.batch)
+
+    def test_download_dir_chapters_are_not_batched(self):
+        """
+        Tests that chapters saved directly in the download directory are queued without a batch.
+        """
+        event = self._event('Absolute Boyfriend -.- Chapter 1.cbz')
+        self.coalescer.put(event)
+
+        self.assertIsNone(event.batch)
+        self.coalescer.finish(event)
+
+    @patch('MangaTaggerLib.MangaTaggerLib.AppSettings')
+    @patch('MangaTaggerLib.MangaTaggerLib.resolve_metadata')
+    def test_series_is_resolved_once_per_batch(self, resolve_metadata, AppSettings):
+        """
+        Tests that metadata_tagger resolves a series once for all chapters in a batch and gives each chapter its own
+        copy of the metadata.
+        """
+        AppSettings.mode_settings = {'write_comicinfo': False}
+        resolve_metadata.return_value = type('Metadata', (), {'title': None})()
+
+        events = [self._event('Absolute Boyfriend', f'Chapter {x}.cbz') for x in range(3)]
+        for event in events:
+            self.coalescer.put(event)
+
+        results = [metadata_tagger('Absolute Boyfriend', str(x), None, {}, series_batch=events[x].batch)
+                   for x in range(3)]
+
+        resolve_metadata.assert_called_once()
+        self.assertEqual(len({id(result) for result in results}), 3)
+
+    @patch('MangaTaggerLib.MangaTaggerLib.AppSettings')
+    @patch('MangaTaggerLib.MangaTaggerLib.resolve_metadata')
+    def test_series_not_found_once_per_batch(self, resolve_metadata, AppSettings):
+        """
+        Tests that when a series cannot be matched, the other chapters in the batch fail without searching again.
+        """
+        AppSettings.mode_settings = {'write_comicinfo': False}
+        resolve_metadata.side_effect = MangaNotFoundError('Absolute Boyfriend')
+
+        events = [self._event('Absolute Boyfriend', f'Chapter {x}.cbz') for x in range(2)]
+        for event in events:
+            self.coalescer.put(event)
+
+        for event in events:
+            with self.assertRaises(MangaNotFoundError):
+                metadata_tagger('Absolute Boyfriend', '1', None, {}, series_batch=event.batch)
+
+        resolve_metadata.assert_called_once()
@@ -0,0 +1,194 @@
+import logging
+import os
+import tempfile
+import unittest
+from io import BytesIO
+from pathlib import Path
+from unittest.mock import patch
+from zipfile import ZipFile
+
+import requests
+from PIL import Image, UnidentifiedImageError
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.cache import CoverCache
+from MangaTaggerLib.thumbnail import cover_key, download_cover, thumb
+
+
+def page(color, mode='RGB'):
+    image = BytesIO()
+    Image.new(mode, (300, 300), color).save(image, 'PNG')
+    return image.getvalue()
+
+
+class TestChapterFinalization(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.series_dir = Path(directory.name, 'Manga', 'Absolute Boyfriend')
+        self.series_dir.mkdir(parents=True)
+        self.chapter = Path(self.series_dir, 'Chapter 1.cbz')
+        with ZipFile(self.chapter, 'w') as archive:
+            archive.writestr('notes.txt', 'scanlator notes')
+            archive.writestr('001.png', page('red'))
+            archive.writestr('002.png', page('blue'))
+
+    def finalize(self, web_url):
+        opened = []
+        real_zipfile = MangaTaggerLib.ZipFile
+
+        def counting_zipfile(*args, **kwargs):
+            opened.append(args)
+            return real_zipfile(*args, **kwargs)
+
+        with patch('MangaTaggerLib.MangaTaggerLib.ZipFile', counting_zipfile):
+            MangaTaggerLib.reconstruct_manga_chapter('<ComicInfo/>', self.chapter, False, {}, web_url)
+        return opened
+
+    def test_archive_is_opened_once(self):
+        """
+        Tests that ComicInfo.xml is written and the cover made from the chapter's first page with a single open of the
+        archive, and without extracting anything to disk.
+        """
+        opened = self.finalize('')
+
+        self.assertEqual(len(opened), 1)
+        with ZipFile(self.chapter) as archive:
+            self.assertEqual(archive.read('ComicInfo.xml'), b'<ComicInfo/>')
+        self.assertEqual(sorted(os.listdir(self.series_dir)), ['Chapter 1.cbz', 'default.jpg'])
+        with Image.open(Path(self.series_dir, 'default.jpg')) as cover:
+            self.assertGreater(cover.getpixel((cover.width // 2, cover.height // 2))[0], 200)
+            self.assertAlmostEqual(cover.width / cover.height, 150 / 212, places=2)
+
+    def test_existing_cover_is_kept(self):
+        """
+        Tests that the cover is not read again once the series has one.
+        """
+        Path(self.series_dir, 'default.jpg').write_bytes(b'cover')
+
+        with patch('MangaTaggerLib.MangaTaggerLib.first_image') as first_image:
+            self.finalize('')
+
+        first_image.assert_not_called()
+        self.assertEqual(Path(self.series_dir, 'default.jpg').read_bytes(), b'cover')
+
+    def test_page_is_not_read_for_downloaded_covers(self):
+        """
+        Tests that the first page is left unread when the cover will come from the series page.
+        """
+        with patch('MangaTaggerLib.MangaTaggerLib.first_image') as first_image, \
+                patch('MangaTaggerLib.MangaTaggerLib.thumb') as thumb:
+            self.finalize('https://anilist.co/manga/30386')
+
+        first_image.assert_not_called()
+        self.assertIsNone(thumb.call_args.args[3])
+
+    def test_archive_without_images(self):
+        """
+        Tests that a chapter with no images still gets its ComicInfo.xml, and no cover, without an error.
+        """
+        with ZipFile(self.chapter, 'w') as archive:
+            archive.writestr('notes.txt', 'scanlator notes')
+
+        with patch.object(MangaTaggerLib.LOG, 'exception') as log_exception:
+            self.finalize('')
+
+        log_exception.assert_not_called()
+        with ZipFile(self.chapter) as archive:
+            self.assertIn('ComicInfo.xml', archive.namelist())
+        self.assertEqual(os.listdir(self.series_dir), ['Chapter 1.cbz'])
+
+    def test_transparent_page_is_flattened(self):
+        """
+        Tests that a transparent first page is put on white before being saved as a JPEG.
+        """
+        with ZipFile(self.chapter, 'w') as archive:
+            archive.writestr('001.png', page((0, 0, 0, 0), 'RGBA'))
+
+        self.finalize('')
+
+        with Image.open(Path(self.series_dir, 'default.jpg')) as cover:
+            self.assertEqual(cover.mode, 'RGB')
+            self.assertGreater(min(cover.getpixel((10, 10))), 240)
+
+
+class TestCachedCover(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        CoverCache.initialize(Path(directory.name, 'covers'))
+        self.addCleanup(CoverCache.close)
+        self.series_dir = Path(directory.name, 'Absolute Boyfriend')
+        self.series_dir.mkdir()
+
+    @patch('MangaTaggerLib.thumbnail.download_cover')
+    def test_recreated_folder_is_not_downloaded_again(self, download_cover):
+        """
+        Tests that a series folder that lost its cover gets the same default.jpg back from the cache, without a
+        download.
+        """
+        download_cover.return_value = page('green')
+
+        thumb(self.series_dir, {}, 'https://anilist.co/manga/30386')
+        first = Path(self.series_dir, 'default.jpg').read_bytes()
+        os.remove(Path(self.series_dir, 'default.jpg'))
+        thumb(self.series_dir, {}, 'https://anilist.co/manga/30386/')
+
+        download_cover.assert_called_once()
+        self.assertEqual(Path(self.series_dir, 'default.jpg').read_bytes(), first)
+
+    @patch('MangaTaggerLib.thumbnail.download_cover')
+    def test_thumbnail_is_made_from_cached_original(self, download_cover):
+        """
+        Tests that the downloaded cover is kept, so a thumbnail can be made again without the network.
+        """
+        CoverCache.put('MAL', '1706', 'original', page('green'))
+
+        thumb(self.series_dir, {}, 'https://myanimelist.net/manga/1706')
+
+        download_cover.assert_not_called()
+        self.assertTrue(Path(self.series_dir, 'default.jpg').is_file())
+        self.assertIsNotNone(CoverCache.get('MAL', '1706', 'thumbnail'))
+
+    @patch('MangaTaggerLib.thumbnail.download_cover')
+    def test_unreadable_download_is_not_cached(self, download_cover):
+        """
+        Tests that a download that is not an image is neither saved nor cached, so the next chapter downloads again.
+        """
+        download_cover.return_value = b'<html>Service Unavailable</html>'
+
+        with self.assertRaises(UnidentifiedImageError):
+            thumb(self.series_dir, {}, 'https://anilist.co/manga/30386')
+
+        self.assertIsNone(CoverCache.get('AniList', '30386', 'original'))
+        self.assertFalse(Path(self.series_dir, 'default.jpg').exists())
+
+        download_cover.return_value = page('green')
+        thumb(self.series_dir, {}, 'https://anilist.co/manga/30386')
+
+        self.assertEqual(download_cover.call_count, 2)
+        self.assertTrue(Path(self.series_dir, 'default.jpg').is_file())
+
+    @patch('MangaTaggerLib.thumbnail.HttpSession')
+    def test_error_response_is_not_a_cover(self, http_session):
+        """
+        Tests that an error page answered in place of the cover raises instead of being returned as the image.
+        """
+        response = requests.Response()
+        response.status_code = 503
+        response._content = b'<html>Service Unavailable</html>'
+        http_session.get.return_value = response
+
+        with self.assertRaises(requests.HTTPError):
+            download_cover('https://anilist.co/manga/30386', {})
+
+    def test_cover_key(self):
+        """
+        Tests that covers are keyed by the source and series id in the series page URL.
+        """
+        self.assertEqual(cover_key('https://anilist.co/manga/30386/Zettai-Kareshi'), ('AniList', '30386'))
+        self.assertEqual(cover_key('https://myanimelist.net/manga/1706/Zettai_Kareshi'), ('MAL', '1706'))
+        self.assertEqual(cover_key('https://www.mangaupdates.com/series.html?id=1446'), ('MangaUpdates', '1446'))
+        self.assertIsNone(cover_key('https://nhentai.net/g/177013/'))